@@ -1,11 +1,14 @@
-from datetime import date, timedelta
+from datetime import date, datetime, timedelta
 from aiogram import types, F
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.types import BufferedInputFile, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
+from broadcast import BroadcastEngine
 from config import ButtonText, Emoji, MessageFormatter, Config
-from database import DatabaseManager
+from database import BroadcastStatus, DatabaseManager
+from planning import NeedMatrixError, format_need_diff, format_need_matrix, parse_need_matrix, week_start
+from querystats import max_queries
 
 # FSM состояния для админского календаря
 class AdminCalendarFSM(StatesGroup):
@@ -14,6 +17,10 @@ class AdminCalendarFSM(StatesGroup):
     selecting_vacancy = State()
     entering_count = State()
 
+class AdminPlanFSM(StatesGroup):
+    waiting_matrix = State()
+    waiting_template_name = State()
+
 class AdminHandbookFSM(StatesGroup):
     editing = State()
 
@@ -23,6 +30,7 @@ class AdminBroadcastFSM(StatesGroup):
 # --- Состояния для поиска пользователя ---
 class AdminUserSearch(StatesGroup):
     waiting_user_search = State()
+    waiting_date_range = State()
 
 # --- Клавиатуры ---
 def admin_main_menu():
@@ -54,9 +62,38 @@ def calendar_days_keyboard(calendar_status, prefix="admin_cal_date"):
         status_info = calendar_status.get(date_str, {})
         btn_text = MessageFormatter.format_calendar_day(d, status_info)
         keyboard.append([InlineKeyboardButton(text=btn_text, callback_data=f"{prefix}_{date_str}")])
+    keyboard.append([InlineKeyboardButton(text="📋 План на неделю", callback_data="admin_plan_week")])
     keyboard.append([InlineKeyboardButton(text=ButtonText.BACK, callback_data="back_to_admin")])
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
 
+def plan_menu():
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🔁 Скопировать эту неделю на следующую", callback_data="admin_plan_copy")],
+        [InlineKeyboardButton(text="🗂 Шаблоны недели", callback_data="admin_tpl_list")],
+        [InlineKeyboardButton(text=ButtonText.BACK, callback_data="admin_calendar")]
+    ])
+
+def templates_keyboard(templates):
+    keyboard = [
+        [InlineKeyboardButton(
+            text=f"{'⏱ ' if t['is_auto'] else ''}{t['name']} ({t['items']})",
+            callback_data=f"admin_tpl_view_{t['id']}"
+        )]
+        for t in templates
+    ]
+    keyboard.append([InlineKeyboardButton(text="➕ Сохранить эту неделю как шаблон", callback_data="admin_tpl_new")])
+    keyboard.append([InlineKeyboardButton(text=ButtonText.BACK, callback_data="admin_calendar")])
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+def template_keyboard(template):
+    auto_text = "⏹ Выключить автозаполнение" if template['is_auto'] else "⏱ Включить автозаполнение"
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="📥 Применить к следующей неделе", callback_data=f"admin_tpl_apply_{template['id']}")],
+        [InlineKeyboardButton(text=auto_text, callback_data=f"admin_tpl_auto_{template['id']}")],
+        [InlineKeyboardButton(text=ButtonText.DELETE, callback_data=f"admin_tpl_del_{template['id']}")],
+        [InlineKeyboardButton(text=ButtonText.BACK, callback_data="admin_tpl_list")]
+    ])
+
 def shift_keyboard(shifts, date_str):
     keyboard = [
         [InlineKeyboardButton(text=s['name'], callback_data=f"admin_shift_{date_str}_{s['id']}")]
@@ -74,12 +111,64 @@ def vacancy_keyboard(vacancies, date_str, shift_id):
     keyboard.append([InlineKeyboardButton(text=ButtonText.TO_MAIN, callback_data="back_to_admin")])
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
 
-def users_filter_keyboard():
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="Сегодня", callback_data="admin_users_filter_today")],
-        [InlineKeyboardButton(text="Все", callback_data="admin_users_filter_all")],
-        [InlineKeyboardButton(text=ButtonText.BACK, callback_data="back_to_admin")]
-    ])
+# Фильтры списка пользователей: ключ -> подпись кнопки
+USER_FILTERS = {
+    "all": "Все",
+    "today": "Сегодня",
+    "week": "За неделю",
+    "banned": "Забаненные",
+    "blocked": "Заблокированные",
+    "reserved": "С записью",
+    "range": "За период",
+}
+
+# Период регистрации в callback: range.{ГГГГММДД}.{ГГГГММДД}
+USER_RANGE_FORMAT = "%Y%m%d"
+
+def parse_user_filter(spec):
+    """Фильтр списка пользователей из callback: (ключ, date_from, date_to) или None"""
+    name, *dates = spec.split(".")
+    if name not in USER_FILTERS or (name == "range") != (len(dates) == 2):
+        return None
+    if name != "range":
+        return name, None, None
+    try:
+        date_from, date_to = (datetime.strptime(d, USER_RANGE_FORMAT).date() for d in dates)
+    except ValueError:
+        return None
+    return name, date_from, date_to
+
+def parse_date_range(text):
+    """Период из ввода администратора: «ДД.ММ.ГГГГ-ДД.ММ.ГГГГ» или одна дата"""
+    parts = [part.strip() for part in text.replace("–", "-").split("-")]
+    if not 1 <= len(parts) <= 2:
+        return None
+    try:
+        dates = [datetime.strptime(part, "%d.%m.%Y").date() for part in parts]
+    except ValueError:
+        return None
+    return min(dates), max(dates)
+
+def users_filter_keyboard(filter_spec="all", page=None):
+    keyboard = []
+    if page and page['users']:
+        # admin_users_pg_{фильтр}_{n|p}_{tg_id крайней строки страницы}
+        nav = []
+        if page['has_prev']:
+            first_id = page['users'][0]['tg_id']
+            nav.append(InlineKeyboardButton(text=Emoji.BACK, callback_data=f"admin_users_pg_{filter_spec}_p_{first_id}"))
+        if page['has_next']:
+            last_id = page['users'][-1]['tg_id']
+            nav.append(InlineKeyboardButton(text=Emoji.FORWARD, callback_data=f"admin_users_pg_{filter_spec}_n_{last_id}"))
+        if nav:
+            keyboard.append(nav)
+    filters = [
+        InlineKeyboardButton(text=title, callback_data=f"admin_users_filter_{key}")
+        for key, title in USER_FILTERS.items()
+    ]
+    keyboard.extend(filters[i:i + 3] for i in range(0, len(filters), 3))
+    keyboard.append([InlineKeyboardButton(text=ButtonText.BACK, callback_data="back_to_admin")])
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
 
 def user_action_keyboard(user):
     actions = []
@@ -101,6 +190,35 @@ def confirmation_keyboard(res_id):
         #[InlineKeyboardButton(text=ButtonText.BACK, callback_data="admin_confirmations")]
     ])
 
+def confirmation_queue_keyboard(reservations, selected, page, total):
+    """Страница очереди подтверждения: отметки записей, групповые действия, навигация"""
+    page_size = Config.CONFIRMATIONS_PAGE_SIZE
+    toggles = [
+        InlineKeyboardButton(
+            text=f"{'☑️' if r['id'] in selected else '⬜'} {page * page_size + i}",
+            callback_data=f"admin_cq_toggle_{r['id']}_{page}"
+        )
+        for i, r in enumerate(reservations, 1)
+    ]
+    keyboard = [toggles[i:i + 5] for i in range(0, len(toggles), 5)]
+    keyboard.append([InlineKeyboardButton(
+        text=f"{Emoji.SUCCESS} Подтвердить все на странице", callback_data=f"admin_cq_all_{page}"
+    )])
+    if selected:
+        keyboard.append([
+            InlineKeyboardButton(text=f"{Emoji.SUCCESS} Подтвердить ({len(selected)})", callback_data=f"admin_cq_confirm_{page}"),
+            InlineKeyboardButton(text=f"{Emoji.ERROR} Отменить ({len(selected)})", callback_data=f"admin_cq_cancel_{page}"),
+        ])
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton(text=Emoji.BACK, callback_data=f"admin_cq_page_{page - 1}"))
+    if (page + 1) * page_size < total:
+        nav.append(InlineKeyboardButton(text=Emoji.FORWARD, callback_data=f"admin_cq_page_{page + 1}"))
+    if nav:
+        keyboard.append(nav)
+    keyboard.append([InlineKeyboardButton(text=ButtonText.BACK, callback_data="back_to_admin")])
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
 def report_dates_keyboard(dates: list):
     """
     dates — список дат (datetime.date) по которым есть данные
@@ -129,7 +247,7 @@ def report_back_keyboard():
     ])
 
 # --- Основные обработчики ---
-def register_admin_handlers(dp, db: DatabaseManager):
+def register_admin_handlers(dp, db: DatabaseManager, broadcaster: BroadcastEngine):
     # Главное меню админа
     @dp.callback_query(F.data == "back_to_admin")
     async def back_to_admin_menu(callback: types.CallbackQuery, state: FSMContext):
@@ -138,6 +256,7 @@ def register_admin_handlers(dp, db: DatabaseManager):
 
     # --- Управление календарем ---
     @dp.callback_query(F.data == "admin_calendar")
+    @max_queries(1)
     async def admin_calendar(callback: types.CallbackQuery, state: FSMContext):
         calendar_status = await db.get_calendar_status()
         await callback.message.edit_text(
@@ -220,6 +339,165 @@ def register_admin_handlers(dp, db: DatabaseManager):
         )
         await state.set_state(AdminCalendarFSM.selecting_vacancy)
 
+    # --- План на неделю (матрица потребности) ---
+    @dp.callback_query(F.data == "admin_plan_week")
+    async def admin_plan_week(callback: types.CallbackQuery, state: FSMContext):
+        start = date.today()
+        days = Config.CALENDAR_DAYS_AHEAD
+        shifts = await db.get_shifts()
+        vacancies = await db.get_vacancies()
+        needs = await db.get_need_workers(start, start + timedelta(days=days - 1))
+        matrix = format_need_matrix(start, days, shifts, vacancies, needs)
+        await callback.message.edit_text(
+            "📋 План на неделю\n\n"
+            "Отправьте матрицу потребности сообщением или CSV-файлом.\n"
+            "Первая строка — «Смена;Должность;даты», далее по строке на пару смена × должность.\n"
+            "Пустая ячейка или «-» — без изменений.\n\n"
+            "Текущий план — в файле ниже, его можно отредактировать и отправить обратно.",
+            reply_markup=plan_menu()
+        )
+        await callback.message.answer_document(
+            BufferedInputFile(matrix.encode("utf-8-sig"), filename=f"plan_{start.isoformat()}.csv")
+        )
+        await state.set_state(AdminPlanFSM.waiting_matrix)
+
+    @dp.message(AdminPlanFSM.waiting_matrix)
+    async def admin_plan_apply(message: types.Message, state: FSMContext):
+        if message.document:
+            data = (await message.bot.download(message.document)).read()
+            try:
+                text = data.decode("utf-8-sig")
+            except UnicodeDecodeError:
+                text = data.decode("cp1251", errors="replace")  # CSV из Excel
+        else:
+            text = message.text or ""
+
+        shifts = await db.get_shifts()
+        vacancies = await db.get_vacancies()
+        try:
+            cells = parse_need_matrix(text, shifts, vacancies)
+        except NeedMatrixError as e:
+            errors = "\n".join(e.errors[:20])
+            more = f"\n… и еще {len(e.errors) - 20}" if len(e.errors) > 20 else ""
+            await message.answer(
+                f"{Emoji.ERROR} План не применен:\n{errors}{more}\n\nИсправьте и отправьте снова.",
+                reply_markup=back_menu()
+            )
+            return
+
+        changes = await db.apply_need_matrix(cells)
+        await message.answer(format_need_diff(changes), reply_markup=to_admin_menu())
+        await state.clear()
+
+    @dp.callback_query(F.data == "admin_plan_copy")
+    async def admin_plan_copy(callback: types.CallbackQuery, state: FSMContext):
+        this_week = week_start(date.today())
+        next_week = this_week + timedelta(days=7)
+        changed = await db.copy_need_week(this_week, next_week)
+        await state.clear()
+        await callback.message.edit_text(
+            f"{Emoji.SUCCESS} Неделя {this_week.strftime('%d.%m')}–{(this_week + timedelta(days=6)).strftime('%d.%m')} "
+            f"скопирована на {next_week.strftime('%d.%m')}–{(next_week + timedelta(days=6)).strftime('%d.%m')}.\n"
+            f"Изменено ячеек: {changed}",
+            reply_markup=to_admin_menu()
+        )
+
+    # --- Шаблоны недели ---
+    async def show_templates(callback: types.CallbackQuery):
+        templates = await db.get_need_templates()
+        text = "🗂 Шаблоны недели\n\n"
+        if templates:
+            text += "⏱ — шаблон, которым календарь заполняется автоматически."
+        else:
+            text += "Шаблонов пока нет."
+        await callback.message.edit_text(text, reply_markup=templates_keyboard(templates))
+
+    @dp.callback_query(F.data == "admin_tpl_list")
+    async def admin_tpl_list(callback: types.CallbackQuery, state: FSMContext):
+        await state.clear()
+        await show_templates(callback)
+
+    @dp.callback_query(F.data == "admin_tpl_new")
+    async def admin_tpl_new(callback: types.CallbackQuery, state: FSMContext):
+        this_week = week_start(date.today())
+        await callback.message.edit_text(
+            f"Потребность недели {this_week.strftime('%d.%m')}–{(this_week + timedelta(days=6)).strftime('%d.%m')} "
+            "будет сохранена как шаблон.\nВведите название шаблона "
+            "(шаблон с таким названием будет перезаписан):",
+            reply_markup=back_menu()
+        )
+        await state.set_state(AdminPlanFSM.waiting_template_name)
+
+    @dp.message(AdminPlanFSM.waiting_template_name)
+    async def admin_tpl_save(message: types.Message, state: FSMContext):
+        name = (message.text or "").strip()
+        if not name or len(name) > 100:
+            await message.answer("Введите название длиной от 1 до 100 символов:")
+            return
+        result = await db.save_need_template(name, week_start(date.today()))
+        await state.clear()
+        await message.answer(
+            f"{Emoji.SUCCESS} Шаблон «{name}» сохранен, ячеек: {result['items']}",
+            reply_markup=templates_keyboard(await db.get_need_templates())
+        )
+
+    async def find_template(callback: types.CallbackQuery):
+        template_id = int(callback.data.split("_")[-1])
+        template = next((t for t in await db.get_need_templates() if t['id'] == template_id), None)
+        if template is None:
+            await callback.answer("Шаблон не найден.")
+            await show_templates(callback)
+        return template
+
+    async def show_template(callback: types.CallbackQuery, template):
+        status = "включено" if template['is_auto'] else "выключено"
+        await callback.message.edit_text(
+            f"🗂 Шаблон «{template['name']}»\n"
+            f"Ячеек: {template['items']}\n"
+            f"Автозаполнение календаря: {status}",
+            reply_markup=template_keyboard(template)
+        )
+
+    @dp.callback_query(F.data.startswith("admin_tpl_view_"))
+    async def admin_tpl_view(callback: types.CallbackQuery):
+        template = await find_template(callback)
+        if template:
+            await show_template(callback, template)
+
+    @dp.callback_query(F.data.startswith("admin_tpl_apply_"))
+    async def admin_tpl_apply(callback: types.CallbackQuery):
+        template = await find_template(callback)
+        if not template:
+            return
+        next_week = week_start(date.today()) + timedelta(days=7)
+        changed = await db.apply_need_template(template['id'], next_week, next_week + timedelta(days=6))
+        await callback.answer(f"Шаблон применен к неделе с {next_week.strftime('%d.%m')}, изменено ячеек: {changed}")
+        await show_template(callback, template)
+
+    @dp.callback_query(F.data.startswith("admin_tpl_auto_"))
+    async def admin_tpl_auto(callback: types.CallbackQuery):
+        template = await find_template(callback)
+        if not template:
+            return
+        await db.set_need_template_auto(template['id'], not template['is_auto'])
+        template['is_auto'] = not template['is_auto']
+        if template['is_auto']:
+            # Пустые дни календаря заполняются сразу, не дожидаясь планировщика
+            start = date.today()
+            end = start + timedelta(days=Config.CALENDAR_DAYS_AHEAD + Config.NEED_TEMPLATE_LEAD_DAYS - 1)
+            added = await db.materialize_need_templates(start, end)
+            await callback.answer(f"Автозаполнение включено, добавлено ячеек: {added}")
+        await show_template(callback, template)
+
+    @dp.callback_query(F.data.startswith("admin_tpl_del_"))
+    async def admin_tpl_delete(callback: types.CallbackQuery):
+        template = await find_template(callback)
+        if not template:
+            return
+        await db.delete_need_template(template['id'])
+        await callback.answer(f"Шаблон «{template['name']}» удален")
+        await show_templates(callback)
+
     # --- Управление справочником ---
     @dp.callback_query(F.data == "admin_handbook")
     async def admin_handbook_edit(callback: types.CallbackQuery, state: FSMContext):
@@ -240,19 +518,70 @@ def register_admin_handlers(dp, db: DatabaseManager):
 
     # --- Подтверждение резерваций ---
     @dp.callback_query(F.data == "admin_confirmations")
-    async def admin_confirmations(callback: types.CallbackQuery):
-        pending = await db.get_pending_reservations()
+    @max_queries(2)
+    async def admin_confirmations(callback: types.CallbackQuery, state: FSMContext):
+        await state.update_data(cq_selected=[])
+        await show_confirmation_page(callback, state, 0)
+
+    async def show_confirmation_page(callback: types.CallbackQuery, state: FSMContext, page: int):
+        # Одна страница очереди — одно сообщение, которое обновляется на месте
+        page_size = Config.CONFIRMATIONS_PAGE_SIZE
+        pending, total = await db.get_pending_reservations_page(page * page_size, page_size)
+        if not pending and page > 0:
+            # Страница опустела после обработки — показываем предыдущую
+            page = max(0, (total - 1) // page_size)
+            pending, total = await db.get_pending_reservations_page(page * page_size, page_size)
         if not pending:
+            await state.update_data(cq_selected=[], cq_page_ids=[])
             await callback.message.edit_text(f"{Emoji.SUCCESS} Нет неподтвержденных резерваций.", reply_markup=to_admin_menu())
             return
-        for r in pending:
-            await callback.message.delete()
-            msg = (
-                f"{Emoji.INFO} Новая резервация\n"
-                f"{MessageFormatter.format_reservation(r)}\n\n"
-                f"👤 {r['full_name']} / {r['phone']}\n"
+        data = await state.get_data()
+        page_ids = [r['id'] for r in pending]
+        selected = set(data.get('cq_selected', [])) & set(page_ids)
+        await state.update_data(cq_selected=list(selected), cq_page_ids=page_ids)
+
+        pages = (total + page_size - 1) // page_size
+        text = f"{Emoji.INFO} Неподтвержденные записи: {total} (стр. {page + 1} из {pages})\n\n"
+        for i, r in enumerate(pending, page * page_size + 1):
+            mark = "☑️" if r['id'] in selected else "⬜"
+            text += (
+                f"{mark} {i}. {r['date_reservation'].strftime('%d.%m')} {r['shift_name']} — {r['vacancy_name']}\n"
+                f"    👤 {r['full_name']} / {r['phone']}\n"
             )
-            await callback.message.answer(msg, reply_markup=confirmation_keyboard(r['id']))
+        await callback.message.edit_text(
+            text, reply_markup=confirmation_queue_keyboard(pending, selected, page, total)
+        )
+
+    @dp.callback_query(F.data.startswith("admin_cq_page_"))
+    @max_queries(2)
+    async def admin_cq_page(callback: types.CallbackQuery, state: FSMContext):
+        await show_confirmation_page(callback, state, int(callback.data.split("_")[-1]))
+
+    @dp.callback_query(F.data.startswith("admin_cq_toggle_"))
+    async def admin_cq_toggle(callback: types.CallbackQuery, state: FSMContext):
+        # admin_cq_toggle_{res_id}_{page}
+        res_id, page = map(int, callback.data.split("_")[-2:])
+        data = await state.get_data()
+        selected = set(data.get('cq_selected', []))
+        selected ^= {res_id}
+        await state.update_data(cq_selected=list(selected))
+        await show_confirmation_page(callback, state, page)
+
+    @dp.callback_query(F.data.startswith(("admin_cq_all_", "admin_cq_confirm_", "admin_cq_cancel_")))
+    async def admin_cq_apply(callback: types.CallbackQuery, state: FSMContext):
+        # admin_cq_{all|confirm|cancel}_{page}
+        action, page = callback.data.split("_")[-2:]
+        data = await state.get_data()
+        ids = data.get('cq_page_ids', []) if action == "all" else data.get('cq_selected', [])
+        # Вся группа обрабатывается одним UPDATE/DELETE
+        if action == "cancel":
+            count = await db.delete_reservations(ids)
+            await callback.answer(f"Отменено записей: {count}")
+        else:
+            count = await db.confirm_reservations(ids)
+            await callback.answer(f"Подтверждено записей: {count}")
+        await state.update_data(cq_selected=[])
+        await show_confirmation_page(callback, state, int(page))
 
     @dp.callback_query(F.data.startswith("admin_confirm_"))
     async def admin_confirm_confirm(callback: types.CallbackQuery):
@@ -271,47 +600,76 @@ def register_admin_handlers(dp, db: DatabaseManager):
     # --- Пользователи ---
     @dp.callback_query(F.data == "admin_users")
     async def admin_users(callback: types.CallbackQuery, state: FSMContext):
-        users = await db.get_all_users()
-        text = f"{Emoji.USERS} Все пользователи:\n"
-        for u in users[:10]:  # показываем первые 10 для информации
+        await show_users_page(callback, state, "all")
+
+    async def show_users_page(callback: types.CallbackQuery, state: FSMContext, filter_spec: str,
+                              after=None, before=None, message: types.Message = None):
+        # Каждая страница — один небольшой запрос по индексу (date_of_reg, tg_id)
+        filter_name, date_from, date_to = parse_user_filter(filter_spec)
+        page = await db.list_users(
+            filter_name, after=after, before=before, limit=Config.USERS_PAGE_SIZE, date_from=date_from, date_to=date_to
+        )
+        title = USER_FILTERS[filter_name].lower()
+        if filter_name == "range":
+            title = f"{date_from.strftime('%d.%m.%Y')}–{date_to.strftime('%d.%m.%Y')}"
+        text = f"{Emoji.USERS} Пользователи ({title}):\n\n"
+        if not page['users']:
+            text += "Пользователей нет.\n\n"
+        for u in page['users']:
             text += MessageFormatter.format_user_info(u) + "\n\n"
-        text += "Для подробной работы введите ФИО, ID или номер телефона пользователя."
-        await callback.message.edit_text(text, reply_markup=users_filter_keyboard())
+        text += "Для поиска конкретного пользователя введите ФИО, ID или номер телефона."
+        keyboard = users_filter_keyboard(filter_spec, page)
+        if message is not None:
+            await message.answer(text, reply_markup=keyboard)
+        else:
+            await callback.message.edit_text(text, reply_markup=keyboard)
         await state.set_state(AdminUserSearch.waiting_user_search)
 
+    @dp.callback_query(F.data.startswith("admin_users_pg_"))
+    async def admin_users_page(callback: types.CallbackQuery, state: FSMContext):
+        # admin_users_pg_{фильтр}_{n|p}_{tg_id}
+        filter_spec, direction, tg_id = callback.data.replace("admin_users_pg_", "").split("_")
+        if parse_user_filter(filter_spec) is None:
+            await callback.answer("Неизвестный фильтр.")
+            return
+        cursor = int(tg_id)
+        if direction == "n":
+            await show_users_page(callback, state, filter_spec, after=cursor)
+        else:
+            await show_users_page(callback, state, filter_spec, before=cursor)
+
+    @dp.message(AdminUserSearch.waiting_date_range)
+    async def admin_users_date_range(message: types.Message, state: FSMContext):
+        period = parse_date_range(message.text or "")
+        if period is None:
+            await message.answer("Неверный формат. Введите период как 01.10.2026-15.10.2026 или одну дату.")
+            return
+        date_from, date_to = period
+        filter_spec = f"range.{date_from.strftime(USER_RANGE_FORMAT)}.{date_to.strftime(USER_RANGE_FORMAT)}"
+        await show_users_page(None, state, filter_spec, message=message)
+
     @dp.message(AdminUserSearch.waiting_user_search)
     async def admin_find_user(message: types.Message, state: FSMContext):
         query = message.text.strip()
-        users = await db.get_all_users()
-        found_users = []
+        # Фильтрация по ID, телефону и ФИО выполняется в БД
+        found_users, total = await db.search_users(query, limit=Config.USER_SEARCH_PAGE_SIZE)
 
-        # ID (цифры)
-        if query.isdigit():
-            found_users = [u for u in users if str(u['tg_id']) == query or (u.get('phone') and query in u['phone'])]
-        else:
-            # Поиск по ФИО (без учета регистра)
-            found_users = [u for u in users if query.lower() in u['full_name'].lower()]
-            # Поиск по телефону
-            if not found_users:  # ищем по телефону только если не нашли по ФИО
-                found_users = [u for u in users if u.get('phone') and query in u['phone']]
-
-        # Убираем дубликаты по tg_id
-        unique_users = {u['tg_id']: u for u in found_users}.values()
-
-        if not unique_users:
+        if not found_users:
             await message.answer("Пользователь не найден. Попробуйте еще раз или введите другие данные.")
             return
 
-        if len(unique_users) > 1:
-            txt = "Найдено несколько пользователей:\n\n"
-            for u in list(unique_users)[:5]:  # показываем максимум 5
+        if total > 1:
+            txt = f"Найдено пользователей: {total}\n\n"
+            for u in found_users:
                 txt += f"👤 {u['full_name']}\n📱 ID: {u['tg_id']}\n📞 Тел: {u.get('phone', 'не указан')}\n\n"
+            if total > len(found_users):
+                txt += f"... показаны первые {len(found_users)}\n\n"
             txt += "Уточните данные или введите точный ID."
             await message.answer(txt)
             return
 
         # Один пользователь найден
-        user = list(unique_users)[0]
+        user = found_users[0]
         info = MessageFormatter.format_user_info(user)
         await message.answer(
             info,
@@ -323,22 +681,19 @@ def register_admin_handlers(dp, db: DatabaseManager):
 
     async def admin_users_filtered(callback: types.CallbackQuery, state: FSMContext):
         filter_type = callback.data.split("_")[-1]
-        users = await db.get_all_users()
-        today = date.today()
-
-        if filter_type == "today":
-            users = [u for u in users if u['date_of_reg'].date() == today]
-
-        text = f"{Emoji.USERS} Пользователи ({filter_type}):\n\n"
-        for u in users[:10]:
-            text += MessageFormatter.format_user_info(u) + "\n\n"
-
-        if len(users) > 10:
-            text += f"... и еще {len(users) - 10} пользователей\n\n"
-
-        text += "Для поиска конкретного пользователя введите ФИО, ID или номер телефона."
-        await callback.message.edit_text(text, reply_markup=users_filter_keyboard())
-        await state.set_state(AdminUserSearch.waiting_user_search)
+        if filter_type not in USER_FILTERS:
+            await callback.answer("Неизвестный фильтр.")
+            return
+        if filter_type == "range":
+            await callback.message.edit_text(
+                "Введите период регистрации в формате ДД.ММ.ГГГГ-ДД.ММ.ГГГГ или одну дату:",
+                reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+                    [InlineKeyboardButton(text=ButtonText.BACK, callback_data="admin_users")]
+                ])
+            )
+            await state.set_state(AdminUserSearch.waiting_date_range)
+            return
+        await show_users_page(callback, state, filter_type)
 
     @dp.callback_query(F.data.startswith("admin_ban_"))
     async def admin_ban(callback: types.CallbackQuery):
@@ -425,23 +780,47 @@ def register_admin_handlers(dp, db: DatabaseManager):
     # --- Рассылка ---
     @dp.callback_query(F.data == "admin_broadcast")
     async def admin_broadcast_start(callback: types.CallbackQuery, state: FSMContext):
-        await callback.message.edit_text("Введите текст для рассылки всем пользователям:", reply_markup=back_menu())
+        text = "Введите текст для рассылки всем пользователям:"
+        keyboard = []
+        # Незавершенные задания можно приостановить, продолжить или отменить
+        jobs = await db.get_unfinished_broadcast_jobs()
+        if jobs:
+            text = "Незавершенные рассылки:\n\n"
+            for job in jobs:
+                status = "идет" if job['status'] == BroadcastStatus.RUNNING else "на паузе"
+                text += f"№{job['id']} ({status}): {job['delivered'] + job['failed']} из {job['total']}\n"
+                keyboard.extend(broadcaster.control_keyboard(job).inline_keyboard)
+            text += "\nИли введите текст новой рассылки:"
+        keyboard.append([InlineKeyboardButton(text=ButtonText.BACK, callback_data="back_to_admin")])
+        await callback.message.edit_text(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard))
         await state.set_state(AdminBroadcastFSM.waiting_text)
 
     @dp.message(AdminBroadcastFSM.waiting_text)
     async def admin_broadcast_send(message: types.Message, state: FSMContext):
         text = message.text.strip()
-        users = await db.get_all_users()
-        count = 0
-        for u in users:
-            try:
-                await message.bot.send_message(u['tg_id'], f"📢 {text}")
-                count += 1
-            except Exception:
-                continue
-        await message.answer(f"Рассылка завершена. Отправлено {count} сообщений.", reply_markup=to_admin_menu())
+        # Рассылка идет в фоне, прогресс и итог придут отдельным сообщением
+        job = await broadcaster.create(message.bot, message.chat.id, text)
+        await message.answer(f"📢 Рассылка №{job['id']} запущена.", reply_markup=to_admin_menu())
         await state.clear()
 
+    @dp.callback_query(F.data.startswith("admin_bc_"))
+    async def admin_broadcast_control(callback: types.CallbackQuery):
+        # admin_bc_{pause|resume|cancel}_{job_id}
+        _, _, action, job_id = callback.data.split("_")
+        job_id = int(job_id)
+        if action == "pause":
+            job = await broadcaster.pause(job_id)
+        elif action == "resume":
+            job = await broadcaster.resume(callback.bot, job_id)
+        else:
+            job = await broadcaster.cancel(job_id)
+        if not job:
+            await callback.answer("Рассылка уже завершена.")
+            return
+        answers = {"pause": "Рассылка приостановлена.", "resume": "Рассылка продолжена.", "cancel": "Рассылка отменена."}
+        await callback.answer(answers[action])
+        await callback.message.edit_reply_markup(reply_markup=broadcaster.control_keyboard(job))
+
     # --- Навигация назад ---
     @dp.callback_query(F.data == "back_to_admin")
     async def back_admin(callback: types.CallbackQuery, state: FSMContext):
@@ -0,0 +1,314 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Set
+from uuid import uuid4
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramForbiddenError, TelegramNetworkError, TelegramRetryAfter
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from config import Config, Emoji
+from database import BroadcastStatus, DatabaseManager, DeliveryStatus
+from querystats import detach_tracking
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Ограничитель частоты отправки: rate токенов в секунду с запасом capacity"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        """Остановка выдачи токенов (ответ Telegram RetryAfter)"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class ChatRateLimiter:
+    """Минимальный интервал между сообщениями в один чат"""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate
+        self._last_sent: OrderedDict[int, float] = OrderedDict()  # В порядке последней отправки
+
+    async def wait(self, chat_id: int):
+        now = time.monotonic()
+        # Чаты, в которые давно не писали, интервал уже не ограничивает — храним только недавние
+        while self._last_sent:
+            oldest_chat, sent_at = next(iter(self._last_sent.items()))
+            if sent_at + self.interval > now:
+                break
+            del self._last_sent[oldest_chat]
+        delay = self._last_sent.get(chat_id, 0.0) + self.interval - now
+        self._last_sent[chat_id] = now + max(0.0, delay)
+        self._last_sent.move_to_end(chat_id)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class BroadcastEngine:
+    """Фоновая рассылка с ограничением частоты, повторами и отчетом о ходе
+
+    Задание и состояние доставки по каждому получателю хранятся в БД
+    (tb_BroadcastJob, tb_BroadcastDelivery) и сохраняются после каждой
+    пачки отправок. После перезапуска незавершенные задания продолжаются
+    с первого неотправленного получателя.
+
+    Задание рассылает только процесс, захвативший его (owner) в БД;
+    аренда продлевается при сохранении каждой пачки. Задание упавшего
+    процесса подхватывается после истечения его аренды.
+    """
+
+    def __init__(self, db: DatabaseManager, owner: str = None):
+        self.db = db
+        # Имя уникально для каждого запуска: экземпляры с одним hostname не считаются одним владельцем
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}"
+        self.global_limiter = TokenBucket(Config.BROADCAST_RATE_PER_SEC)
+        self.chat_limiter = ChatRateLimiter(Config.BROADCAST_PER_CHAT_RATE)
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._stop_requests: Dict[int, str] = {}  # id задания -> статус, в который его перевести
+        self._waiters: Set[asyncio.Task] = set()
+
+    async def create(self, bot: Bot, admin_chat_id: int, text: str) -> Dict:
+        """Создание задания и запуск рассылки в фоне"""
+        job = await self.db.create_broadcast_job(text, admin_chat_id)
+        await self._claim_and_start(bot, job['id'])
+        return job
+
+    async def resume_unfinished(self, bot: Bot):
+        """Продолжение заданий, прерванных перезапуском бота"""
+        for job in await self.db.get_unfinished_broadcast_jobs():
+            if job['status'] != BroadcastStatus.RUNNING:
+                continue
+            if await self._claim_and_start(bot, job['id']):
+                logger.info(
+                    f"Продолжение рассылки {job['id']}: отправлено {job['delivered'] + job['failed']} из {job['total']}"
+                )
+            else:
+                # Задание держит другой процесс или аренда упавшего процесса еще не истекла
+                waiter = asyncio.create_task(self._claim_when_free(bot, job['id']))
+                self._waiters.add(waiter)
+                waiter.add_done_callback(self._waiters.discard)
+
+    async def _claim_when_free(self, bot: Bot, job_id: int):
+        """Захват задания, как только истечет аренда его владельца"""
+        detach_tracking()
+        while True:
+            await asyncio.sleep(Config.BROADCAST_LEASE_SECONDS)
+            try:
+                job = await self.db.get_broadcast_job(job_id)
+                if job is None or job['status'] != BroadcastStatus.RUNNING:
+                    return
+                if await self._claim_and_start(bot, job_id):
+                    logger.info(f"Рассылка {job_id} подхвачена после истечения аренды")
+                    return
+            except Exception as e:
+                logger.warning(f"Не удалось проверить аренду рассылки {job_id}: {e}")
+
+    async def pause(self, job_id: int) -> Optional[Dict]:
+        return await self._stop(job_id, BroadcastStatus.PAUSED)
+
+    async def cancel(self, job_id: int) -> Optional[Dict]:
+        return await self._stop(job_id, BroadcastStatus.CANCELLED)
+
+    async def resume(self, bot: Bot, job_id: int) -> Optional[Dict]:
+        job = await self.db.set_broadcast_status(job_id, BroadcastStatus.RUNNING)
+        if job and job_id in self._tasks:
+            # Задача еще досылает пачку перед паузой — отменяем остановку, она продолжит рассылку
+            self._stop_requests.pop(job_id, None)
+        elif job:
+            # Если задание еще выполняет другой процесс, он сам продолжит его после resume
+            await self._claim_and_start(bot, job_id)
+        return job
+
+    async def _stop(self, job_id: int, status: str) -> Optional[Dict]:
+        job = await self.db.set_broadcast_status(job_id, status)
+        if job and job_id in self._tasks:
+            # Текущая пачка досылается и сохраняется, затем задание останавливается
+            self._stop_requests[job_id] = status
+        return job
+
+    async def _claim_and_start(self, bot: Bot, job_id: int) -> bool:
+        if job_id not in self._tasks:
+            if not await self.db.claim_broadcast_job(job_id, self.owner, Config.BROADCAST_LEASE_SECONDS):
+                return False
+            self._start(bot, job_id)
+        return True
+
+    def _start(self, bot: Bot, job_id: int):
+        if job_id in self._tasks:
+            return
+        self._stop_requests.pop(job_id, None)
+        task = asyncio.create_task(self._run(bot, job_id))
+        self._tasks[job_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job_id, None))
+
+    async def _run(self, bot: Bot, job_id: int):
+        # Задача создается из обработчика и иначе считалась бы частью его обновления
+        detach_tracking()
+        job = None
+        try:
+            job = await self.db.get_broadcast_job(job_id)
+            if job is None:
+                logger.warning(f"Рассылка {job_id} не найдена")
+                return
+            if job['progress_message_id'] is None:
+                progress = await bot.send_message(
+                    job['admin_chat_id'], self._format_progress(job),
+                    reply_markup=self.control_keyboard(job)
+                )
+                await self.db.set_broadcast_progress_message(job_id, progress.message_id)
+                job['progress_message_id'] = progress.message_id
+
+            text = f"📢 {job['text']}"
+            semaphore = asyncio.Semaphore(Config.BROADCAST_CONCURRENCY)
+            last_report = time.monotonic()
+            while True:
+                while job_id not in self._stop_requests:
+                    recipients = await self.db.get_broadcast_recipients(job_id, Config.BROADCAST_CHECKPOINT_BATCH)
+                    if not recipients:
+                        job = await self.db.set_broadcast_status(job_id, BroadcastStatus.DONE) or job
+                        break
+                    statuses = await asyncio.gather(*(
+                        self._send_limited(semaphore, bot, tg_id, text) for tg_id in recipients
+                    ))
+                    job = await self.db.checkpoint_broadcast(
+                        job_id, dict(zip(recipients, statuses)), self.owner, Config.BROADCAST_LEASE_SECONDS
+                    )
+                    if job['owner'] != self.owner:
+                        # Аренда истекла, и задание захватил другой процесс
+                        logger.warning(f"Рассылка {job_id} перешла к процессу {job['owner']}")
+                        return
+                    if job['status'] != BroadcastStatus.RUNNING:
+                        break  # Пауза или отмена из другого процесса бота
+                    if time.monotonic() - last_report >= Config.BROADCAST_PROGRESS_INTERVAL:
+                        await self._edit_progress(bot, job, self._format_progress(job), self.control_keyboard(job))
+                        last_report = time.monotonic()
+                # Задание не отпускается, если его успели снова запустить (resume), пока досылалась пачка
+                if await self.db.release_broadcast_job(job_id, self.owner):
+                    break
+                self._stop_requests.pop(job_id, None)
+
+            job = await self.db.get_broadcast_job(job_id)
+            if job['status'] == BroadcastStatus.DONE:
+                logger.info(
+                    f"Рассылка {job_id} завершена: доставлено {job['delivered']}, "
+                    f"ошибок {job['failed']}, заблокировали бота {job['blocked']}"
+                )
+            await self._edit_progress(bot, job, self._format_summary(job), self.control_keyboard(job))
+        except Exception as e:
+            # Задание остается в статусе running и продолжится после перезапуска
+            logger.error(f"Ошибка рассылки {job_id}: {e}")
+            try:
+                await self.db.release_broadcast_job(job_id, self.owner, only_stopped=False)
+                if job is not None:
+                    await bot.send_message(
+                        job['admin_chat_id'], f"{Emoji.ERROR} Рассылка №{job_id} прервана из-за ошибки: {e}"
+                    )
+            except Exception as report_error:
+                logger.error(f"Не удалось сообщить об ошибке рассылки {job_id}: {report_error}")
+        finally:
+            self._stop_requests.pop(job_id, None)
+
+    async def _send_limited(self, semaphore: asyncio.Semaphore, bot: Bot, chat_id: int, text: str) -> int:
+        async with semaphore:
+            return await self._send(bot, chat_id, text)
+
+    async def _send(self, bot: Bot, chat_id: int, text: str) -> int:
+        """Отправка одному получателю, возвращает DeliveryStatus"""
+        for attempt in range(Config.BROADCAST_MAX_RETRIES + 1):
+            await self.global_limiter.acquire()
+            await self.chat_limiter.wait(chat_id)
+            try:
+                await bot.send_message(chat_id, text)
+                return DeliveryStatus.DELIVERED
+            except TelegramRetryAfter as e:
+                # Флуд-контроль касается всего бота — притормаживаем все потоки
+                self.global_limiter.pause(e.retry_after)
+            except TelegramForbiddenError:
+                return DeliveryStatus.BLOCKED
+            except TelegramNetworkError as e:
+                logger.warning(f"Сетевая ошибка рассылки для {chat_id} (попытка {attempt + 1}): {e}")
+                await asyncio.sleep(2 ** attempt)
+            except TelegramAPIError as e:
+                logger.warning(f"Сообщение для {chat_id} не доставлено: {e}")
+                return DeliveryStatus.FAILED
+        return DeliveryStatus.FAILED
+
+    async def _edit_progress(self, bot: Bot, job: Dict, text: str, reply_markup=None):
+        chat_id = job['admin_chat_id']
+        await self.chat_limiter.wait(chat_id)
+        try:
+            await bot.edit_message_text(
+                text, chat_id=chat_id, message_id=job['progress_message_id'], reply_markup=reply_markup
+            )
+        except TelegramRetryAfter as e:
+            self.global_limiter.pause(e.retry_after)
+        except TelegramAPIError:
+            pass  # Текст не изменился или сообщение удалено — на рассылку не влияет
+
+    @staticmethod
+    def control_keyboard(job: Dict) -> Optional[InlineKeyboardMarkup]:
+        """Кнопки управления заданием"""
+        job_id = job['id']
+        if job['status'] == BroadcastStatus.RUNNING:
+            first = InlineKeyboardButton(text="⏸ Пауза", callback_data=f"admin_bc_pause_{job_id}")
+        elif job['status'] == BroadcastStatus.PAUSED:
+            first = InlineKeyboardButton(text="▶️ Продолжить", callback_data=f"admin_bc_resume_{job_id}")
+        else:
+            return None
+        return InlineKeyboardMarkup(inline_keyboard=[[
+            first,
+            InlineKeyboardButton(text="⛔ Отменить", callback_data=f"admin_bc_cancel_{job_id}"),
+        ]])
+
+    @staticmethod
+    def _format_progress(job: Dict) -> str:
+        done = job['delivered'] + job['failed']
+        return (
+            f"📢 Рассылка №{job['id']}: {done} из {job['total']}\n"
+            f"{Emoji.SUCCESS} Доставлено: {job['delivered']}\n"
+            f"{Emoji.ERROR} Не доставлено: {job['failed']}"
+        )
+
+    @classmethod
+    def _format_summary(cls, job: Dict) -> str:
+        titles = {
+            BroadcastStatus.DONE: f"{Emoji.SUCCESS} Рассылка №{job['id']} завершена.",
+            BroadcastStatus.PAUSED: f"⏸ Рассылка №{job['id']} на паузе.",
+            BroadcastStatus.CANCELLED: f"⛔ Рассылка №{job['id']} отменена.",
+        }
+        if job['status'] not in titles:
+            return cls._format_progress(job)
+        return (
+            f"{titles[job['status']]}\n\n"
+            f"Получателей: {job['total']}\n"
+            f"Доставлено: {job['delivered']}\n"
+            f"Не доставлено: {job['failed']}\n"
+            f"Заблокировали бота: {job['blocked']}"
+        )
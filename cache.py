@@ -0,0 +1,229 @@
+import time
+from collections import OrderedDict
+from datetime import date, timedelta
+from typing import Dict, List, Optional
+
+
+class SlotInventory:
+    """Кэш потребности и записей по слотам (дата, смена, вакансия)
+
+    Данные загружаются целыми датами, живут не дольше ttl секунд и
+    вытесняются по LRU, когда дат больше max_dates. Операции записи
+    обновляют счетчики сразу (write-through), поэтому шаги выбора
+    слота обслуживаются без обращения к БД.
+    """
+
+    def __init__(self, ttl: float, max_dates: int):
+        self.ttl = ttl
+        self.max_dates = max(1, max_dates)
+        self._dates = OrderedDict()  # date -> (время загрузки, {(id_shift, id_vacancy): слот})
+        self._version = 0  # Увеличивается при каждом изменении, чтобы отбрасывать устаревшие загрузки
+        self.hits = 0
+        self.misses = 0
+
+    def _entry(self, work_date: date) -> Optional[Dict]:
+        entry = self._dates.get(work_date)
+        if entry is None:
+            return None
+        loaded_at, slots = entry
+        if time.monotonic() - loaded_at >= self.ttl:
+            del self._dates[work_date]
+            return None
+        self._dates.move_to_end(work_date)
+        return slots
+
+    def missing_dates(self, start_date: date, end_date: date) -> List[date]:
+        """Даты периода, которых нет в кэше или срок которых истек"""
+        missing = []
+        current = start_date
+        while current <= end_date:
+            if self._entry(current) is None:
+                missing.append(current)
+                self.misses += 1
+            else:
+                self.hits += 1
+            current += timedelta(days=1)
+        return missing
+
+    def covers(self, start_date: date, end_date: date) -> bool:
+        """Все даты периода есть в кэше и не истекли (без учета в статистике)"""
+        current = start_date
+        while current <= end_date:
+            if self._entry(current) is None:
+                return False
+            current += timedelta(days=1)
+        return True
+
+    def begin_load(self) -> int:
+        """Метка версии перед запросом к БД"""
+        return self._version
+
+    def load(self, start_date: date, end_date: date, rows: List[Dict], version: int):
+        """Сохранение слотов периода; результат отбрасывается, если кэш успели изменить"""
+        if version != self._version:
+            return
+        loaded = {}
+        current = start_date
+        while current <= end_date:
+            loaded[current] = {}
+            current += timedelta(days=1)
+        for row in rows:
+            loaded.setdefault(row['date'], {})[(row['id_shift'], row['id_vacancy'])] = dict(row)
+
+        now = time.monotonic()
+        for work_date, slots in loaded.items():
+            self._dates[work_date] = (now, slots)
+            self._dates.move_to_end(work_date)
+        # Даты загружаемого окна не вытесняются, даже если окно длиннее max_dates
+        for work_date in list(self._dates):
+            if len(self._dates) <= self.max_dates:
+                break
+            if work_date not in loaded:
+                del self._dates[work_date]
+
+    def available(self, start_date: date, end_date: date) -> Dict[date, List[Dict]]:
+        """Слоты со свободными местами, сгруппированные по датам"""
+        result = {}
+        for work_date in sorted(self._dates):
+            if not start_date <= work_date <= end_date:
+                continue
+            entry = self._entry(work_date)
+            if entry is None:
+                continue
+            slots = [dict(slot) for slot in entry.values() if slot['available_count'] > 0]
+            if slots:
+                slots.sort(key=lambda slot: (slot['shift_name'], slot['vacancy_name']))
+                result[work_date] = slots
+        return result
+
+    def _slot(self, work_date: date, shift_id: int, vacancy_id: int) -> Optional[Dict]:
+        entry = self._dates.get(work_date)
+        return entry[1].get((shift_id, vacancy_id)) if entry else None
+
+    def set_counts(self, work_date: date, shift_id: int, vacancy_id: int, need_count: int, reserved_count: int):
+        """Запись точных счетчиков слота, полученных из БД"""
+        self._version += 1
+        slot = self._slot(work_date, shift_id, vacancy_id)
+        if slot is None:
+            self.invalidate(work_date)
+            return
+        slot['need_count'] = need_count
+        slot['reserved_count'] = reserved_count
+        slot['available_count'] = need_count - reserved_count
+
+    def set_need(self, work_date: date, shift_id: int, vacancy_id: int, need_count: int):
+        """Изменение потребности слота"""
+        slot = self._slot(work_date, shift_id, vacancy_id)
+        if slot is None:
+            # Нового слота в кэше нет (нет названий смены и вакансии) — дата перечитается из БД
+            self.invalidate(work_date)
+            return
+        self.set_counts(work_date, shift_id, vacancy_id, need_count, slot['reserved_count'])
+
+    def release(self, work_date: date, shift_id: int, vacancy_id: int):
+        """Освобождение места после удаления записи"""
+        slot = self._slot(work_date, shift_id, vacancy_id)
+        if slot is None:
+            self.invalidate(work_date)
+            return
+        self.set_counts(work_date, shift_id, vacancy_id, slot['need_count'], max(0, slot['reserved_count'] - 1))
+
+    def invalidate(self, work_date: date = None):
+        """Сброс одной даты или всего кэша"""
+        self._version += 1
+        if work_date is None:
+            self._dates.clear()
+        else:
+            self._dates.pop(work_date, None)
+
+    def stats(self) -> Dict[str, int]:
+        """Статистика кэша"""
+        return {'dates': len(self._dates), 'hits': self.hits, 'misses': self.misses}
+
+
+class VersionedCache:
+    """Значение из БД с версией и периодической проверкой актуальности
+
+    Пока с последней проверки прошло меньше check_interval секунд,
+    значение отдается без запросов к БД. После этого вызывающий код
+    сверяет версию дешевым запросом и перечитывает данные, только если
+    версия изменилась. При check_interval <= 0 проверка отключена и
+    значение живет до явного сброса.
+    """
+
+    def __init__(self, check_interval: float):
+        self.check_interval = check_interval
+        self.value = None
+        self.version = None
+        self.loaded = False
+        self._checked_at = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    def is_fresh(self) -> bool:
+        """Значение можно отдать без обращения к БД"""
+        if not self.loaded:
+            return False
+        if self.check_interval <= 0:
+            return True
+        return time.monotonic() - self._checked_at < self.check_interval
+
+    def set(self, value, version):
+        self.value = value
+        self.version = version
+        self.loaded = True
+        self._checked_at = time.monotonic()
+
+    def mark_checked(self):
+        """Версия сверена с БД и не изменилась"""
+        self._checked_at = time.monotonic()
+
+    def invalidate(self):
+        self.loaded = False
+        self.value = None
+        self.version = None
+
+    def stats(self) -> Dict[str, int]:
+        """Статистика кэша"""
+        return {'loaded': int(self.loaded), 'hits': self.hits, 'misses': self.misses}
+
+
+class TTLCache:
+    """LRU-кэш ограниченного размера с временем жизни записей"""
+
+    MISSING = object()  # Признак отсутствия ключа (None — допустимое значение)
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = max(1, maxsize)
+        self.ttl = ttl
+        self._data = OrderedDict()  # ключ -> (истекает в, значение)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        item = self._data.get(key)
+        if item is None or item[0] <= time.monotonic():
+            if item is not None:
+                del self._data[key]
+            self.misses += 1
+            return self.MISSING
+        self._data.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def set(self, key, value):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key=MISSING):
+        """Сброс одного ключа или всего кэша"""
+        if key is self.MISSING:
+            self._data.clear()
+        else:
+            self._data.pop(key, None)
+
+    def stats(self) -> Dict[str, int]:
+        """Статистика кэша"""
+        return {'size': len(self._data), 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,180 @@
+import asyncio
+import hmac
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.exceptions import TelegramAPIError, TelegramRetryAfter
+
+from config import Config
+from database import DatabaseManager
+
+logger = logging.getLogger(__name__)
+
+# Сообщения во входной очереди процесса-обработчика
+UPDATE = "update"
+INVALIDATE = "invalidate"
+STOP = None
+
+WATCH_INTERVAL = 5  # Проверка живости процессов-обработчиков, сек
+
+
+def update_user_id(update: Dict) -> int:
+    """Пользователь (или чат), от которого пришло обновление; 0, если его нет"""
+    for key, event in update.items():
+        if key == "update_id" or not isinstance(event, dict):
+            continue
+        user = event.get("from") or event.get("user")
+        if user:
+            return user["id"]
+        chat = event.get("chat") or (event.get("message") or {}).get("chat")
+        if chat:
+            return abs(chat["id"])
+    return 0
+
+
+class Supervisor:
+    """Распределение обновлений между процессами-обработчиками
+
+    Обновления одного пользователя всегда попадают в один процесс
+    (from_user.id % workers), поэтому его диалог и состояние FSM не
+    разрываются между процессами. Сигналы сброса кэша, которые процесс
+    публикует после изменений в БД, пересылаются остальным процессам.
+    """
+
+    def __init__(self, worker_target: Callable, workers: int):
+        self.worker_target = worker_target
+        self.workers = workers
+        self._ctx = multiprocessing.get_context("spawn")
+        self._inboxes = [self._ctx.Queue() for _ in range(workers)]
+        self._signals = self._ctx.Queue()
+        self._processes: List[Optional[multiprocessing.Process]] = [None] * workers
+        self._relay: Optional[threading.Thread] = None
+
+    def start(self):
+        for index in range(self.workers):
+            self._spawn(index)
+        self._relay = threading.Thread(target=self._relay_signals, name="cache-signals", daemon=True)
+        self._relay.start()
+        logger.info(f"Запущено процессов-обработчиков: {self.workers}")
+
+    def _spawn(self, index: int):
+        process = self._ctx.Process(
+            target=self.worker_target,
+            args=(index, self._inboxes[index], self._signals),
+            name=f"bot-worker-{index}",
+        )
+        process.start()
+        self._processes[index] = process
+
+    def _relay_signals(self):
+        while True:
+            message = self._signals.get()
+            if message is STOP:
+                return
+            source, kind, key = message
+            for index, inbox in enumerate(self._inboxes):
+                if index != source:
+                    inbox.put((INVALIDATE, kind, key))
+
+    def dispatch(self, update: Dict):
+        self._inboxes[update_user_id(update) % self.workers].put((UPDATE, update))
+
+    async def watch(self):
+        """Перезапуск упавших процессов; очередь процесса сохраняется"""
+        while True:
+            await asyncio.sleep(WATCH_INTERVAL)
+            for index, process in enumerate(self._processes):
+                if not process.is_alive():
+                    logger.error(f"Процесс-обработчик {index} завершился с кодом {process.exitcode}, перезапуск")
+                    self._spawn(index)
+
+    def stop(self, timeout: float = 30):
+        for inbox in self._inboxes:
+            inbox.put(STOP)
+        for process in self._processes:
+            if process is None:
+                continue
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        self._signals.put(STOP)
+
+    def alive(self) -> int:
+        return sum(1 for process in self._processes if process is not None and process.is_alive())
+
+    async def run_polling(self, bot: Bot, allowed_updates: List[str]):
+        """Получение обновлений long polling'ом в супервизоре"""
+        await bot.delete_webhook()
+        offset = None
+        while True:
+            try:
+                updates = await bot.get_updates(offset=offset, timeout=30, allowed_updates=allowed_updates)
+            except TelegramRetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+                continue
+            except TelegramAPIError as e:
+                logger.warning(f"Ошибка получения обновлений: {e}")
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                self.dispatch(update.model_dump(mode="json", by_alias=True, exclude_none=True))
+                offset = update.update_id + 1
+
+    def webhook_app(self) -> web.Application:
+        """Прием вебхука супервизором: проверка секрета и передача обновления в процесс пользователя"""
+        app = web.Application()
+
+        async def handle_update(request: web.Request) -> web.Response:
+            secret = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+            if not hmac.compare_digest(secret, Config.WEBHOOK_SECRET):
+                return web.Response(status=401)
+            self.dispatch(await request.json())
+            return web.Response()
+
+        async def health(request: web.Request) -> web.Response:
+            alive = self.alive()
+            return web.json_response(
+                {"status": "ok" if alive == self.workers else "degraded", "workers": self.workers, "alive": alive},
+                status=200 if alive == self.workers else 503,
+            )
+
+        app.router.add_post(Config.WEBHOOK_PATH, handle_update)
+        app.router.add_get(Config.HEALTH_PATH, health)
+        return app
+
+
+async def serve_worker(index: int, inbox, signals, dp: Dispatcher, bot: Bot, db: DatabaseManager):
+    """Цикл процесса-обработчика: обновления и сигналы сброса кэша из очереди супервизора"""
+    db.invalidation_listener = lambda kind, key: signals.put((index, kind, key))
+    loop = asyncio.get_running_loop()
+    reader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inbox")
+    tasks = set()
+
+    async def process(update: Dict):
+        try:
+            await dp.feed_raw_update(bot, update)
+        except Exception as e:
+            logger.exception(f"Ошибка обработки обновления {update.get('update_id')}: {e}")
+
+    await dp.emit_startup(bot=bot)
+    try:
+        while True:
+            message = await loop.run_in_executor(reader, inbox.get)
+            if message is STOP:
+                break
+            if message[0] == INVALIDATE:
+                db.apply_invalidation(message[1], message[2])
+                continue
+            task = asyncio.create_task(process(message[1]))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+    finally:
+        await dp.emit_shutdown(bot=bot)
+        reader.shutdown(wait=False)
@@ -7,15 +7,94 @@ class Config:
     # Токен бота Telegram
     BOT_TOKEN: str = os.getenv("BOT_TOKEN", '7899869655:AAG1nRWWcaW74WMgHd59Vw9egwLNk5VqvDI')
     
+    # Режим получения обновлений: polling или webhook
+    BOT_MODE: str = os.getenv("BOT_MODE", "polling")
+    TELEGRAM_API_SERVER: str = os.getenv("TELEGRAM_API_SERVER", "")  # Свой Bot API сервер, например http://localhost:8081 (пусто — api.telegram.org)
+    
+    UPDATE_CONCURRENCY: int = int(os.getenv("UPDATE_CONCURRENCY", "32"))  # Обновлений разных пользователей в обработке одновременно
+    WORKERS: int = int(os.getenv("WORKERS", "1"))  # Процессов-обработчиков; больше 1 — супервизор распределяет обновления по пользователям
+    
+    # Webhook (BOT_MODE=webhook)
+    WEBHOOK_BASE_URL: str = os.getenv("WEBHOOK_BASE_URL", "")  # Внешний адрес за reverse proxy; пусто — вебхук не регистрируется при старте
+    WEBHOOK_PATH: str = os.getenv("WEBHOOK_PATH", "/webhook")
+    WEBHOOK_SECRET: str = os.getenv("WEBHOOK_SECRET", "")  # Проверяется в заголовке X-Telegram-Bot-Api-Secret-Token
+    WEBAPP_HOST: str = os.getenv("WEBAPP_HOST", "127.0.0.1")
+    WEBAPP_PORT: int = int(os.getenv("WEBAPP_PORT", "8080"))
+    HEALTH_PATH: str = os.getenv("HEALTH_PATH", "/health")
+    
+    # Журнал медленных запросов и лимиты запросов обработчиков
+    SLOW_QUERY_THRESHOLD: float = float(os.getenv("SLOW_QUERY_THRESHOLD", "0.5"))  # Порог медленного запроса, сек (0 — отключено)
+    QUERY_BUDGET_STRICT: bool = os.getenv("QUERY_BUDGET_STRICT", "0") == "1"  # Превышение max_queries — исключение (для тестов)
+    
+    # Метрики Prometheus
+    METRICS_PORT: int = int(os.getenv("METRICS_PORT", "0"))  # 0 — отключено; процесс-обработчик N слушает METRICS_PORT + N
+    METRICS_PATH: str = os.getenv("METRICS_PATH", "/metrics")
+    
+    # Хранилище состояний FSM: memory, mssql (таблица tb_FSMState основной БД, в том числе встроенной) или sqlite
+    FSM_STORAGE: str = os.getenv("FSM_STORAGE", "mssql")
+    FSM_SQLITE_PATH: str = os.getenv("FSM_SQLITE_PATH", "fsm_states.sqlite3")
+    FSM_STATE_TTL: int = int(os.getenv("FSM_STATE_TTL", "86400"))  # Время жизни брошенного состояния, сек (0 — бессрочно)
+    FSM_CLEANUP_INTERVAL: float = float(os.getenv("FSM_CLEANUP_INTERVAL", "600"))  # Удаление просроченных состояний, сек
+    # Кэш состояний FSM из БД в процессе, сек (0 — без кэша). Только если tb_FSMState пользуется один
+    # экземпляр бота (один процесс или WORKERS): другие экземпляры не сбрасывают этот кэш
+    FSM_CACHE_TTL: float = float(os.getenv("FSM_CACHE_TTL", "0"))
+    FSM_CACHE_MAX_SIZE: int = int(os.getenv("FSM_CACHE_MAX_SIZE", "10000"))  # Максимум состояний в кэше
+    
+    # База данных: mssql (SQL Server через ODBC) или sqlite (встроенная база в файле, без сетевых запросов)
+    DB_BACKEND: str = os.getenv("DB_BACKEND", "mssql")
+    DB_SQLITE_PATH: str = os.getenv("DB_SQLITE_PATH", "tgbot_workers.sqlite3")
+    
     # Настройки базы данных MSSQL
     DB_SERVER: str = os.getenv("DB_SERVER", "192.168.2.59")
     DB_NAME: str = os.getenv("DB_NAME", "tgbot_workers")
     DB_USER: str = os.getenv("DB_USER", "tgbot_workers")
     DB_PASSWORD: str = os.getenv("DB_PASSWORD", "oyRxj0t+@ujE0sI")
-    
+    DB_BOOTSTRAP: bool = os.getenv("DB_BOOTSTRAP", "0") == "1"  # Создать основные таблицы из schema.sql (новая локальная или тестовая БД)
+
+    # Пул подключений к БД
+    DB_POOL_MIN_SIZE: int = int(os.getenv("DB_POOL_MIN_SIZE", "2"))  # Подключений, открываемых при старте
+    DB_POOL_MAX_SIZE: int = int(os.getenv("DB_POOL_MAX_SIZE", "10"))  # Максимум одновременно открытых подключений
+    DB_POOL_ACQUIRE_TIMEOUT: float = float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", "10"))  # Ожидание свободного подключения, сек
+    DB_POOL_IDLE_TIMEOUT: float = float(os.getenv("DB_POOL_IDLE_TIMEOUT", "300"))  # Простой, после которого подключение закрывается, сек
+    DB_POOL_PING_INTERVAL: float = float(os.getenv("DB_POOL_PING_INTERVAL", "30"))  # Простой, после которого подключение проверяется, сек
+
+    # Выполнение запросов вне event loop
+    DB_EXECUTOR_WORKERS: int = int(os.getenv("DB_EXECUTOR_WORKERS", str(DB_POOL_MAX_SIZE)))  # Потоков для запросов к БД
+    DB_QUERY_TIMEOUT: float = float(os.getenv("DB_QUERY_TIMEOUT", "15"))  # Таймаут одного запроса, сек
+
     # Настройки бота
     MAX_RESERVATIONS_PER_USER: int = 1  # Максимум записей на одну дату
     CALENDAR_DAYS_AHEAD: int = 7  # Количество дней календаря вперед
+
+    # Автозаполнение календаря шаблоном недели
+    NEED_TEMPLATE_LEAD_DAYS: int = int(os.getenv("NEED_TEMPLATE_LEAD_DAYS", "7"))  # Дней сверх CALENDAR_DAYS_AHEAD, заполняемых заранее
+    NEED_TEMPLATE_CHECK_INTERVAL: float = float(os.getenv("NEED_TEMPLATE_CHECK_INTERVAL", "3600"))  # Период проверки, сек (0 — отключено)
+
+    # Кэш свободных мест
+    SLOT_CACHE_TTL: float = float(os.getenv("SLOT_CACHE_TTL", "30"))  # Время жизни данных по дате, сек
+    SLOT_CACHE_MAX_DATES: int = int(os.getenv("SLOT_CACHE_MAX_DATES", "60"))  # Максимум дат в кэше
+
+    # Кэш справочников вакансий и смен
+    REFERENCE_CHECK_INTERVAL: float = float(os.getenv("REFERENCE_CHECK_INTERVAL", "300"))  # Проверка изменений в БД, сек (0 — не проверять)
+    HANDBOOK_CHECK_INTERVAL: float = float(os.getenv("HANDBOOK_CHECK_INTERVAL", "60"))  # Проверка версии справочника, сек (0 — не проверять)
+
+    # Кэш пользователей
+    # Изменения в этом экземпляре бота (и в его процессах WORKERS) сбрасывают кэш сразу;
+    # другие экземпляры с той же БД видят их не позже чем через USER_CACHE_TTL
+    USER_CACHE_TTL: float = float(os.getenv("USER_CACHE_TTL", "5"))  # Время жизни записи, сек
+    USER_CACHE_MAX_SIZE: int = int(os.getenv("USER_CACHE_MAX_SIZE", "10000"))  # Максимум пользователей в кэше
+    USER_SEARCH_PAGE_SIZE: int = int(os.getenv("USER_SEARCH_PAGE_SIZE", "5"))  # Результатов поиска пользователей в ответе
+    USERS_PAGE_SIZE: int = int(os.getenv("USERS_PAGE_SIZE", "10"))  # Пользователей на странице списка
+    CONFIRMATIONS_PAGE_SIZE: int = int(os.getenv("CONFIRMATIONS_PAGE_SIZE", "10"))  # Записей на странице подтверждения
+
+    # Рассылка
+    BROADCAST_CONCURRENCY: int = int(os.getenv("BROADCAST_CONCURRENCY", "10"))  # Одновременных отправок
+    BROADCAST_RATE_PER_SEC: float = float(os.getenv("BROADCAST_RATE_PER_SEC", "25"))  # Общий лимит Telegram ~30 сообщений/сек
+    BROADCAST_PER_CHAT_RATE: float = float(os.getenv("BROADCAST_PER_CHAT_RATE", "1"))  # Лимит Telegram на один чат, сообщений/сек
+    BROADCAST_MAX_RETRIES: int = int(os.getenv("BROADCAST_MAX_RETRIES", "3"))  # Повторов при RetryAfter и сетевых ошибках
+    BROADCAST_PROGRESS_INTERVAL: float = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", "5"))  # Обновление прогресса, сек
+    BROADCAST_CHECKPOINT_BATCH: int = int(os.getenv("BROADCAST_CHECKPOINT_BATCH", "50"))  # Получателей между сохранениями в БД
+    BROADCAST_LEASE_SECONDS: float = float(os.getenv("BROADCAST_LEASE_SECONDS", "300"))  # Аренда задания процессом, продлевается при сохранении пачки
     
     # Сообщения
     WELCOME_MESSAGE = """
@@ -54,10 +133,26 @@ class Config:
             print("❌ Не установлен токен бота! Установите переменную окружения BOT_TOKEN")
             return False
         
-        if not all([cls.DB_SERVER, cls.DB_NAME, cls.DB_USER, cls.DB_PASSWORD]):
+        if cls.DB_BACKEND not in ("mssql", "sqlite"):
+            print(f"❌ Неизвестная БД DB_BACKEND={cls.DB_BACKEND}, допустимо: mssql, sqlite")
+            return False
+        
+        if cls.DB_BACKEND == "mssql" and not all([cls.DB_SERVER, cls.DB_NAME, cls.DB_USER, cls.DB_PASSWORD]):
             print("❌ Не все параметры базы данных настроены!")
             return False
         
+        if cls.BOT_MODE not in ("polling", "webhook"):
+            print(f"❌ Неизвестный режим BOT_MODE={cls.BOT_MODE}, допустимо: polling, webhook")
+            return False
+        
+        if cls.FSM_STORAGE not in ("memory", "mssql", "sqlite"):
+            print(f"❌ Неизвестное хранилище FSM_STORAGE={cls.FSM_STORAGE}, допустимо: memory, mssql, sqlite")
+            return False
+        
+        if cls.BOT_MODE == "webhook" and not cls.WEBHOOK_SECRET:
+            print("❌ Для режима webhook установите WEBHOOK_SECRET")
+            return False
+        
         return True
 
 # Эмодзи для интерфейса
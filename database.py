@@ -1,14 +1,434 @@
-import pyodbc
 import asyncio
 import logging
+import math
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime, date, timedelta
-from typing import List, Dict, Optional
+from typing import Callable, List, Dict, Optional, Tuple
 from config import Config
+from cache import SlotInventory, TTLCache, VersionedCache
+from metrics import observe_query
+from querystats import record_query
+
+try:
+    import pyodbc
+except ImportError:  # Нужен только для MSSQL: встроенной SQLite-базе ODBC не требуется
+    pyodbc = None
 
 logger = logging.getLogger(__name__)
 
+
+class PoolTimeoutError(Exception):
+    """Не удалось получить подключение из пула за отведенное время"""
+
+
+class QueryCancelledError(Exception):
+    """Запрос отменен до начала выполнения"""
+
+
+class _QueryHandle:
+    """Ссылка на выполняемый курсор (объект с cancel()), чтобы отменить запрос из event loop"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cursor = None
+        self.cancelled = False
+
+    def attach(self, cursor):
+        with self._lock:
+            if self.cancelled:
+                raise QueryCancelledError("Запрос отменен")
+            self._cursor = cursor
+
+    def detach(self):
+        with self._lock:
+            self._cursor = None
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            cursor = self._cursor
+        if cursor is not None:
+            try:
+                cursor.cancel()
+            except Exception:
+                pass  # Запрос уже завершился или подключение закрыто
+
+
+def _input_size(sql_type: str) -> tuple:
+    """Тип параметра для setinputsizes, чтобы fast_executemany не запрашивал его у сервера"""
+    name, _, size = sql_type.partition("(")
+    if name == "NVARCHAR":
+        return pyodbc.SQL_WVARCHAR, int(size.rstrip(")")), 0
+    return {
+        "BIGINT": (pyodbc.SQL_BIGINT, 0, 0),
+        "INT": (pyodbc.SQL_INTEGER, 0, 0),
+        "DATE": (pyodbc.SQL_TYPE_DATE, 0, 0),
+    }[name]
+
+
+def _is_disconnect_error(error: Exception) -> bool:
+    """Ошибка означает, что подключение разорвано и его нельзя вернуть в пул"""
+    sqlstate = str(error.args[0]) if error.args else ""
+    return sqlstate.startswith("08") or sqlstate == "01002"
+
+
+class ConnectionPool:
+    """Ограниченный пул подключений DB-API с проверкой и переиспользованием
+
+    errors — классы ошибок драйвера, is_disconnect — признак ошибки, после
+    которой подключение нельзя вернуть в пул.
+    """
+
+    def __init__(self, connect, min_size: int, max_size: int, acquire_timeout: float,
+                 idle_timeout: float, ping_interval: float, errors: tuple,
+                 is_disconnect: Callable[[Exception], bool]):
+        self._connect = connect
+        self.errors = errors
+        self._is_disconnect = is_disconnect
+        self.min_size = max(0, min(min_size, max_size))
+        self.max_size = max(1, max_size)
+        self.acquire_timeout = acquire_timeout
+        self.idle_timeout = idle_timeout
+        self.ping_interval = ping_interval
+
+        self._cond = threading.Condition()
+        self._idle = []  # [(conn, время возврата)] — последним вернули последний элемент
+        self._size = 0  # Открытые подключения: свободные + выданные
+        self._closed = False
+        self._counters = {
+            'created': 0,
+            'closed': 0,
+            'evicted': 0,
+            'acquired': 0,
+            'waits': 0,
+            'timeouts': 0,
+        }
+
+    def open(self):
+        """Открытие минимального количества подключений"""
+        for _ in range(self.min_size):
+            with self._cond:
+                self._size += 1
+            conn = self._create()
+            self.release(conn)
+
+    def _create(self):
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._counters['created'] += 1
+        return conn
+
+    def _close_quietly(self, conn):
+        try:
+            conn.close()
+        except self.errors:
+            pass
+
+    def _discard(self, conn, evicted: bool = False):
+        """Закрытие подключения с освобождением места в пуле"""
+        self._close_quietly(conn)
+        with self._cond:
+            self._size -= 1
+            self._counters['closed'] += 1
+            if evicted:
+                self._counters['evicted'] += 1
+            self._cond.notify()
+
+    def _take_expired_locked(self) -> list:
+        """Изъятие давно простаивающих подключений сверх минимума (под блокировкой)"""
+        expired = []
+        now = time.monotonic()
+        # Самые старые подключения находятся в начале списка
+        while self._idle and self._size - len(expired) > self.min_size:
+            conn, released_at = self._idle[0]
+            if now - released_at < self.idle_timeout:
+                break
+            self._idle.pop(0)
+            expired.append(conn)
+        return expired
+
+    def _ping(self, conn) -> bool:
+        try:
+            conn.cursor().execute("SELECT 1").fetchall()
+            return True
+        except self.errors:
+            return False
+
+    def acquire(self):
+        """Получение подключения из пула"""
+        deadline = time.monotonic() + self.acquire_timeout
+        while True:
+            conn = None
+            released_at = None
+            expired = []
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise RuntimeError("Пул подключений закрыт")
+                    recycled = self._take_expired_locked()
+                    if recycled:
+                        self._size -= len(recycled)
+                        self._counters['closed'] += len(recycled)
+                        expired.extend(recycled)
+                    if self._idle:
+                        conn, released_at = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._counters['timeouts'] += 1
+                        raise PoolTimeoutError(
+                            f"Нет свободных подключений к БД за {self.acquire_timeout} сек"
+                        )
+                    self._counters['waits'] += 1
+                    self._cond.wait(remaining)
+
+            for old_conn in expired:
+                self._close_quietly(old_conn)
+
+            if conn is None:
+                conn = self._create()
+            elif time.monotonic() - released_at >= self.ping_interval and not self._ping(conn):
+                # Подключение разорвано, пока простаивало — выбрасываем и пробуем снова
+                self._discard(conn, evicted=True)
+                continue
+
+            with self._cond:
+                self._counters['acquired'] += 1
+            return conn
+
+    def release(self, conn, broken: bool = False):
+        """Возврат подключения в пул"""
+        if not broken:
+            try:
+                conn.rollback()  # Не оставляем незавершенных транзакций
+            except self.errors:
+                broken = True
+        if broken:
+            self._discard(conn, evicted=True)
+            return
+        with self._cond:
+            if not self._closed:
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+                return
+        self._discard(conn)
+
+    @contextmanager
+    def connection(self):
+        """Подключение из пула на время блока with"""
+        conn = self.acquire()
+        try:
+            yield conn
+        except self.errors as e:
+            self.release(conn, broken=self._is_disconnect(e))
+            raise
+        except BaseException:
+            self.release(conn)
+            raise
+        else:
+            self.release(conn)
+
+    def close(self):
+        """Закрытие всех свободных подключений; выданные закроются при возврате"""
+        with self._cond:
+            self._closed = True
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+            self._counters['closed'] += len(idle)
+            self._cond.notify_all()
+        for conn in idle:
+            self._close_quietly(conn)
+
+    def stats(self) -> Dict[str, int]:
+        """Статистика пула"""
+        with self._cond:
+            return {
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                **self._counters,
+            }
+
+
+class ReservationStatus:
+    """Результат попытки записи"""
+    CREATED = "created"
+    ALREADY_BOOKED = "already_booked"
+    FULL = "full"
+
+
+class CacheSignal:
+    """Виды сигналов сброса кэша между процессами бота"""
+    USER = "user"  # ключ — tg_id
+    VACANCIES = "vacancies"
+    SHIFTS = "shifts"
+    HANDBOOK = "handbook"
+    SLOTS = "slots"  # ключ — дата или None для всего кэша
+
+
+class BroadcastStatus:
+    """Состояние задания рассылки"""
+    RUNNING = "running"
+    PAUSED = "paused"
+    CANCELLED = "cancelled"
+    DONE = "done"
+
+
+class DeliveryStatus:
+    """Состояние доставки рассылки одному получателю"""
+    PENDING = 0
+    DELIVERED = 1
+    FAILED = 2
+    BLOCKED = 3
+
+
+# Служебные таблицы бота, создаются при запуске, если их еще нет
+SCHEMA_STATEMENTS = [
+    """
+    IF OBJECT_ID('tb_BroadcastJob', 'U') IS NULL
+    CREATE TABLE tb_BroadcastJob (
+        id INT IDENTITY(1,1) PRIMARY KEY,
+        text NVARCHAR(MAX) NOT NULL,
+        status VARCHAR(16) NOT NULL,
+        admin_chat_id BIGINT NOT NULL,
+        progress_message_id BIGINT NULL,
+        total INT NOT NULL DEFAULT 0,
+        delivered INT NOT NULL DEFAULT 0,
+        failed INT NOT NULL DEFAULT 0,
+        blocked INT NOT NULL DEFAULT 0,
+        created_at DATETIME NOT NULL DEFAULT GETDATE(),
+        finished_at DATETIME NULL,
+        owner VARCHAR(100) NULL,
+        lease_until DATETIME NULL
+    )
+    """,
+    """
+    IF COL_LENGTH('tb_BroadcastJob', 'owner') IS NULL
+    ALTER TABLE tb_BroadcastJob ADD owner VARCHAR(100) NULL, lease_until DATETIME NULL
+    """,
+    """
+    IF OBJECT_ID('tb_BroadcastDelivery', 'U') IS NULL
+    CREATE TABLE tb_BroadcastDelivery (
+        id_job INT NOT NULL,
+        tg_id BIGINT NOT NULL,
+        status TINYINT NOT NULL DEFAULT 0,
+        CONSTRAINT PK_tb_BroadcastDelivery PRIMARY KEY (id_job, tg_id)
+    )
+    """,
+    """
+    IF OBJECT_ID('tb_FSMState', 'U') IS NULL
+    CREATE TABLE tb_FSMState (
+        storage_key VARCHAR(200) NOT NULL PRIMARY KEY,
+        state VARCHAR(200) NULL,
+        data NVARCHAR(MAX) NULL,
+        expires_at DATETIME NULL
+    )
+    """,
+    """
+    IF OBJECT_ID('tb_NeedTemplate', 'U') IS NULL
+    CREATE TABLE tb_NeedTemplate (
+        id INT IDENTITY(1,1) PRIMARY KEY,
+        name NVARCHAR(100) NOT NULL CONSTRAINT UQ_tb_NeedTemplate_name UNIQUE,
+        is_auto BIT NOT NULL DEFAULT 0,
+        created_at DATETIME NOT NULL DEFAULT GETDATE()
+    )
+    """,
+    """
+    IF OBJECT_ID('tb_NeedTemplateItem', 'U') IS NULL
+    CREATE TABLE tb_NeedTemplateItem (
+        id_template INT NOT NULL,
+        weekday TINYINT NOT NULL,
+        id_shift INT NOT NULL,
+        id_vacancy INT NOT NULL,
+        need_count INT NOT NULL,
+        CONSTRAINT PK_tb_NeedTemplateItem PRIMARY KEY (id_template, weekday, id_shift, id_vacancy)
+    )
+    """,
+]
+
+# Индексы для поиска пользователей. Ошибка создания (например, столбец
+# NVARCHAR(MAX) индексировать нельзя) не мешает запуску бота
+for _index_name, _table, _columns in (
+    ("IX_Users_full_name", "Users", "full_name"),
+    ("IX_Users_phone", "Users", "phone"),
+    ("IX_tb_Reservation_id_user", "tb_Reservation", "id_user, date_reservation"),
+    ("IX_Users_date_of_reg", "Users", "date_of_reg DESC, tg_id DESC"),
+):
+    SCHEMA_STATEMENTS.append(f"""
+    IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = '{_index_name}' AND object_id = OBJECT_ID('{_table}'))
+    BEGIN TRY
+        CREATE INDEX {_index_name} ON {_table} ({_columns})
+    END TRY
+    BEGIN CATCH
+        PRINT ERROR_MESSAGE()
+    END CATCH
+    """)
+
+# Основные таблицы для новой БД (DB_BOOTSTRAP=1); пакеты разделены строками GO
+BASE_SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "schema.sql")
+
+
+def read_sql_script(path: str) -> List[str]:
+    """Пакеты SQL-скрипта, разделенные строками GO"""
+    with open(path, encoding="utf-8") as f:
+        batches = re.split(r"^\s*GO\s*$", f.read(), flags=re.MULTILINE | re.IGNORECASE)
+    return [batch.strip() for batch in batches if batch.strip()]
+
+
+BROADCAST_JOB_COLUMNS = (
+    "id, text, status, admin_chat_id, progress_message_id, total, delivered, failed, blocked, "
+    "created_at, finished_at, owner"
+)
+
+
 class DatabaseManager:
+    """Доступ к БД бота: запросы, кэши и сигналы их сброса
+
+    Реализация для SQL Server (T-SQL через ODBC). Встроенная SQLite-база —
+    подкласс SQLiteDatabaseManager с тем же API; выбор — create_database().
+    """
+    
+    # Версия справочника для сверки кэша: число строк и контрольная сумма
+    REFERENCE_VERSION_EXPR = "COUNT_BIG(*) as version_count, CHECKSUM_AGG(BINARY_CHECKSUM(id, name)) as version_checksum"
+    # Временная таблица пакетных операций (_bulk), видна только своему подключению
+    BATCH_TABLE = "#batch"
+    
     def __init__(self):
+        self.pool = self._create_pool()
+        # Отдельный ограниченный пул потоков: блокирующий драйвер БД не должен стопорить event loop
+        self._executor = ThreadPoolExecutor(
+            max_workers=Config.DB_EXECUTOR_WORKERS,
+            thread_name_prefix="db",
+        )
+        self.slot_inventory = SlotInventory(ttl=Config.SLOT_CACHE_TTL, max_dates=Config.SLOT_CACHE_MAX_DATES)
+        self.vacancies_cache = VersionedCache(check_interval=Config.REFERENCE_CHECK_INTERVAL)
+        self.shifts_cache = VersionedCache(check_interval=Config.REFERENCE_CHECK_INTERVAL)
+        self.handbook_cache = VersionedCache(check_interval=Config.HANDBOOK_CHECK_INTERVAL)
+        self.user_cache = TTLCache(maxsize=Config.USER_CACHE_MAX_SIZE, ttl=Config.USER_CACHE_TTL)
+        # Получает (вид, ключ) после каждого изменения кэшей, чтобы другие процессы бота сбросили свои копии
+        self.invalidation_listener: Optional[Callable[[str, object], None]] = None
+    
+    def _create_pool(self) -> ConnectionPool:
+        """Пул подключений к SQL Server через ODBC"""
+        if pyodbc is None:
+            raise RuntimeError("Для DB_BACKEND=mssql нужен пакет pyodbc")
         self.connection_string = (
             f"DRIVER={{ODBC Driver 13 for SQL Server}};"
             f"SERVER={Config.DB_SERVER};"
@@ -17,62 +437,253 @@ class DatabaseManager:
             f"PWD={Config.DB_PASSWORD};"
             f"TrustServerCertificate=yes;"
         )
-        #self._handbook_text = ""  # Временное хранение справочника
+        return ConnectionPool(
+            lambda: pyodbc.connect(self.connection_string),
+            min_size=Config.DB_POOL_MIN_SIZE,
+            max_size=Config.DB_POOL_MAX_SIZE,
+            acquire_timeout=Config.DB_POOL_ACQUIRE_TIMEOUT,
+            idle_timeout=Config.DB_POOL_IDLE_TIMEOUT,
+            ping_interval=Config.DB_POOL_PING_INTERVAL,
+            errors=(pyodbc.Error,),
+            is_disconnect=_is_disconnect_error,
+        )
+    
+    def _schema_statements(self) -> List[str]:
+        """Инструкции, создающие недостающие таблицы при запуске"""
+        base = read_sql_script(BASE_SCHEMA_PATH) if Config.DB_BOOTSTRAP else []
+        return base + SCHEMA_STATEMENTS
+    
+    @staticmethod
+    def _page(offset: int, limit: int) -> Tuple[str, tuple]:
+        """Ограничение выборки (после ORDER BY) и его параметры"""
+        return "OFFSET ? ROWS FETCH NEXT ? ROWS ONLY", (offset, limit)
+    
+    @staticmethod
+    def _like(column: str) -> str:
+        """Поиск подстроки без учета регистра (регистр снимает CI-collation столбца)"""
+        return f"{column} LIKE ?"
+    
+    @staticmethod
+    def _escape_like(text: str) -> str:
+        return re.sub(r"([\[%_])", r"[\1]", text)
     
     async def init_db(self):
         """Инициализация подключения к БД"""
         try:
-            # Проверяем подключение
-            conn = pyodbc.connect(self.connection_string)
-            conn.close()
-            logger.info("✅ Подключение к базе данных успешно")
+            # Открываем стартовые подключения пула и проверяем одно из них
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self._executor, self.pool.open)
+            await self._query("init_db.ping", "SELECT 1", fetch=True)
+            for statement in self._schema_statements():
+                await self._query("init_db.schema", statement)
+            # Справочники загружаются сразу, чтобы первые пользователи не ждали запросов
+            await self.get_vacancies()
+            await self.get_shifts()
+            logger.info(f"✅ Подключение к базе данных успешно, пул: {self.pool.stats()}")
         except Exception as e:
             logger.error(f"❌ Ошибка подключения к БД: {e}")
             raise
+
+    async def close(self):
+        """Остановка потоков БД и закрытие пула подключений"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self.pool.close()
+        logger.info(f"Пул подключений закрыт: {self.pool.stats()}")
+
+    async def ping(self, timeout: float = 2) -> bool:
+        """Быстрая проверка доступности БД (для health-проверок)"""
+        try:
+            await self._query("ping", "SELECT 1", fetch=True, timeout=timeout)
+            return True
+        except Exception:
+            return False
+
+    def _publish(self, kind: str, key=None):
+        if self.invalidation_listener is not None:
+            self.invalidation_listener(kind, key)
+
+    def apply_invalidation(self, kind: str, key=None):
+        """Сброс кэша по сигналу из другого процесса"""
+        if kind == CacheSignal.USER:
+            self.user_cache.invalidate(key)
+        elif kind == CacheSignal.VACANCIES:
+            self.vacancies_cache.invalidate()
+        elif kind == CacheSignal.SHIFTS:
+            self.shifts_cache.invalidate()
+        elif kind == CacheSignal.HANDBOOK:
+            self.handbook_cache.invalidate()
+        elif kind == CacheSignal.SLOTS:
+            self.slot_inventory.invalidate(key)
+
+    def get_pool_stats(self) -> Dict[str, int]:
+        """Статистика пула подключений"""
+        return self.pool.stats()
+
+    def get_cache_stats(self) -> Dict[str, Dict[str, int]]:
+        """Статистика кэшей"""
+        return {
+            'slots': self.slot_inventory.stats(),
+            'vacancies': self.vacancies_cache.stats(),
+            'shifts': self.shifts_cache.stats(),
+            'handbook': self.handbook_cache.stats(),
+            'users': self.user_cache.stats(),
+        }
     
-    def _execute_query(self, query: str, params: tuple = None, fetch: bool = False):
+    async def _query(self, name: str, query: str, params: tuple = None, fetch: bool = False, timeout: float = None):
+        """Выполнение SQL запроса в потоке БД с таймаутом и отменой
+        
+        name — имя запроса для метрик, журнала медленных запросов и
+        счетчика запросов текущего обновления.
+        """
+        return await self._run(
+            name, lambda handle, timeout: self._execute_query(query, params, fetch, handle, timeout),
+            params, timeout, query
+        )
+    
+    async def _run(self, name: str, work: Callable, params: tuple = None, timeout: float = None,
+                   description: str = None):
+        """Выполнение work(handle, timeout) в потоке БД с таймаутом, отменой и учетом как запроса name"""
+        if timeout is None:
+            timeout = Config.DB_QUERY_TIMEOUT
+        started = time.perf_counter()
+        handle = _QueryHandle()
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, work, handle, timeout)
+        try:
+            result = await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError as e:
+            handle.cancel()
+            observe_query(name, started, error=e)
+            record_query(name, started, params)
+            logger.error(f"Превышено время выполнения запроса {name} ({timeout} сек): {description or name}")
+            raise
+        except asyncio.CancelledError:
+            # Обработчик отменен — прерываем запрос и на стороне сервера
+            handle.cancel()
+            raise
+        except Exception as e:
+            observe_query(name, started, error=e)
+            record_query(name, started, params)
+            raise
+        observe_query(name, started, rows=len(result) if isinstance(result, list) else None)
+        record_query(name, started, params)
+        return result
+
+    def _execute_query(self, query: str, params: tuple = None, fetch: bool = False,
+                       handle: _QueryHandle = None, timeout: float = None):
         """Выполнение SQL запроса"""
         try:
-            conn = pyodbc.connect(self.connection_string)
-            cursor = conn.cursor()
-            
-            if params:
-                cursor.execute(query, params)
-            else:
-                cursor.execute(query)
-            
-            if fetch:
-                if query.strip().upper().startswith('SELECT'):
-                    columns = [column[0] for column in cursor.description]
-                    rows = cursor.fetchall()
-                    result = [dict(zip(columns, row)) for row in rows]
-                else:
-                    result = cursor.fetchone()
-                    conn.commit()
-            else:
+            with self.pool.connection() as conn:
+                if timeout:
+                    conn.timeout = math.ceil(timeout)
+                cursor = conn.cursor()
+                if handle:
+                    handle.attach(cursor)
+                
+                try:
+                    if params:
+                        cursor.execute(query, params)
+                    else:
+                        cursor.execute(query)
+                finally:
+                    if handle:
+                        handle.detach()
+                
                 result = None
+                if fetch:
+                    # Пакет из нескольких инструкций может вернуть набор строк не первым
+                    while cursor.description is None and cursor.nextset():
+                        pass
+                    if cursor.description is not None:
+                        columns = [column[0] for column in cursor.description]
+                        rows = cursor.fetchall()
+                        result = [dict(zip(columns, row)) for row in rows]
+                    else:
+                        result = []
                 conn.commit()
+                
+                return result
             
-            conn.close()
-            return result
-            
-        except pyodbc.Error as e:
+        except self.pool.errors as e:
             logger.error(f"Ошибка выполнения запроса: {e}")
             logger.error(f"Запрос: {query}")
             logger.error(f"Параметры: {params}")
             raise
     
+    async def _bulk(self, name: str, columns: List[Tuple[str, str]], rows: List[tuple], statement: str,
+                    params: tuple = (), fetch: bool = False):
+        """Пакетная операция одной транзакцией
+        
+        Строки загружаются во временную таблицу BATCH_TABLE (columns — имя
+        и SQL-тип столбца) одним executemany, затем statement обрабатывает
+        их одной инструкцией. Размер пакета не ограничен числом параметров
+        запроса (2100 в SQL Server).
+        """
+        return await self._run(
+            name,
+            lambda handle, timeout: self._execute_bulk(columns, rows, statement, params, fetch, handle, timeout),
+            (len(rows), *params), description=statement
+        )
+    
+    def _execute_bulk(self, columns: List[Tuple[str, str]], rows: List[tuple], statement: str, params: tuple,
+                      fetch: bool, handle: _QueryHandle, timeout: float):
+        definition = ", ".join(f"{column} {sql_type}" for column, sql_type in columns)
+        placeholders = ", ".join("?" * len(columns))
+        try:
+            with self.pool.connection() as conn:
+                if timeout:
+                    conn.timeout = math.ceil(timeout)
+                cursor = conn.cursor()
+                cursor.execute(f"CREATE TABLE {self.BATCH_TABLE} ({definition})")
+                
+                # fast_executemany передает все строки одним массивом параметров, а не запросом на строку
+                loader = conn.cursor()
+                loader.fast_executemany = True
+                loader.setinputsizes([_input_size(sql_type) for _, sql_type in columns])
+                handle.attach(loader)
+                try:
+                    if rows:
+                        loader.executemany(f"INSERT INTO {self.BATCH_TABLE} VALUES ({placeholders})", rows)
+                finally:
+                    handle.detach()
+                    loader.close()
+                
+                handle.attach(cursor)
+                try:
+                    cursor.execute(statement, params)
+                    result = None
+                    if fetch:
+                        while cursor.description is None and cursor.nextset():
+                            pass
+                        columns_out = [column[0] for column in cursor.description]
+                        result = [dict(zip(columns_out, row)) for row in cursor.fetchall()]
+                finally:
+                    handle.detach()
+                # Таблица создана в транзакции: при ошибке ее удалит откат
+                cursor.execute(f"DROP TABLE {self.BATCH_TABLE}")
+                conn.commit()
+                return result
+        except self.pool.errors as e:
+            logger.error(f"Ошибка пакетной операции ({len(rows)} строк): {e}")
+            logger.error(f"Запрос: {statement}")
+            raise
+    
     # === ПОЛЬЗОВАТЕЛИ ===
     
     async def get_user(self, tg_id: int) -> Optional[Dict]:
         """Получение пользователя по Telegram ID"""
+        cached = self.user_cache.get(tg_id)
+        if cached is not TTLCache.MISSING:
+            return cached
         query = """
         SELECT tg_id, full_name, phone, username, is_admin, is_banned, is_blocked, date_of_reg
         FROM Users 
         WHERE tg_id = ?
         """
-        result = self._execute_query(query, (tg_id,), fetch=True)
-        return result[0] if result else None
+        result = await self._query("get_user", query, (tg_id,), fetch=True)
+        user = result[0] if result else None
+        self.user_cache.set(tg_id, user)
+        return user
     
     async def register_user(self, tg_id: int, full_name: str, phone: str, username: str):
         """Регистрация нового пользователя"""
@@ -80,7 +691,9 @@ class DatabaseManager:
         INSERT INTO Users (tg_id, full_name, phone, username, is_admin, is_banned, is_blocked, date_of_reg)
         VALUES (?, ?, ?, ?, 0, 0, 0, ?)
         """
-        self._execute_query(query, (tg_id, full_name, phone, username, datetime.now()))
+        await self._query("register_user", query, (tg_id, full_name, phone, username, datetime.now()))
+        self.user_cache.invalidate(tg_id)
+        self._publish(CacheSignal.USER, tg_id)
         logger.info(f"Зарегистрирован новый пользователь: {full_name} ({tg_id})")
     
     async def get_all_users(self) -> List[Dict]:
@@ -92,13 +705,136 @@ class DatabaseManager:
         LEFT JOIN tb_Reservation r ON u.tg_id = r.id_user 
         ORDER BY u.date_of_reg DESC
         """
-        return self._execute_query(query, fetch=True) or []
+        return await self._query("get_all_users", query, fetch=True) or []
     
-    async def update_user_status(self, tg_id: int, is_banned: bool = None, is_blocked: bool = None):
-        """Обновление статуса пользователя"""
+    async def search_users(self, text: str, limit: int = 5, offset: int = 0) -> Tuple[List[Dict], int]:
+        """Поиск пользователей по ID, телефону или ФИО
+        
+        Фильтрация выполняется в БД: точное совпадение tg_id, телефон по
+        нормализованному виду +7XXXXXXXXXX (или фрагменту цифр), ФИО по
+        вхождению — сначала совпадения с начала строки. Регистр не
+        учитывается за счет CI-collation столбца. Возвращает страницу
+        пользователей и общее количество найденных.
+        """
+        text = text.strip()
+        digits = re.sub(r"\D", "", text)
+        params = []
+        if digits and re.fullmatch(r"[\d\s+()-]+", text):
+            conditions = ["u.phone LIKE ?"]
+            # Полный номер приводим к виду +7XXXXXXXXXX: 8916..., 7916..., 916...
+            if len(digits) == 11 and digits[0] in "78":
+                params.append("+7" + digits[1:])
+            elif len(digits) == 10 and digits[0] == "9":
+                params.append("+7" + digits)
+            else:
+                params.append("%" + digits + "%")
+            if text.isdigit():
+                conditions.insert(0, "u.tg_id = ?")
+                params.insert(0, int(text))
+            where = " OR ".join(conditions)
+            order = "CASE WHEN u.tg_id = ? THEN 0 ELSE 1 END, u.full_name"
+            params.append(int(digits) if text.isdigit() else -1)
+        else:
+            # Экранируем спецсимволы LIKE во введенном тексте
+            pattern = self._escape_like(text)
+            where = self._like("u.full_name")
+            order = f"CASE WHEN {self._like('u.full_name')} THEN 0 ELSE 1 END, u.full_name"
+            params.extend(["%" + pattern + "%", pattern + "%"])
+        
+        page, page_params = self._page(offset, limit)
+        query = f"""
+        SELECT u.tg_id, u.full_name, u.phone, u.username, u.is_admin, u.is_banned, u.is_blocked, u.date_of_reg,
+               CASE WHEN EXISTS (SELECT 1 FROM tb_Reservation r WHERE r.id_user = u.tg_id) THEN 1 ELSE 0 END as has_reservation,
+               COUNT(*) OVER () as total_count
+        FROM Users u
+        WHERE {where}
+        ORDER BY {order}
+        {page}
+        """
+        rows = await self._query("search_users", query, (*params, *page_params), fetch=True) or []
+        total = rows[0]['total_count'] if rows else 0
+        for row in rows:
+            del row['total_count']
+        return rows, total
+    
+    async def list_users(self, filter_name: str = "all", after: int = None, before: int = None,
+                         limit: int = 10, date_from: date = None, date_to: date = None) -> Dict:
+        """Страница пользователей с keyset-пагинацией по (date_of_reg, tg_id)
+        
+        Пользователи отсортированы от новых к старым. after — tg_id последней
+        строки текущей страницы (следующая страница), before — tg_id первой
+        строки (предыдущая); ключ (date_of_reg, tg_id) берется из самой строки,
+        поэтому точность datetime не теряется при передаче через callback.
+        Если этой строки уже нет, возвращается первая страница.
+        Фильтры: all, today, week, banned, blocked, reserved; date_from/date_to
+        дополнительно ограничивают дату регистрации.
+        Возвращает {'users', 'has_next', 'has_prev'}.
+        """
+        conditions = []
+        params = []
+        today = date.today()
+        if filter_name == "today":
+            date_from = today
+        elif filter_name == "week":
+            date_from = today - timedelta(days=6)
+        elif filter_name == "banned":
+            conditions.append("u.is_banned = 1")
+        elif filter_name == "blocked":
+            conditions.append("u.is_blocked = 1")
+        elif filter_name == "reserved":
+            conditions.append("EXISTS (SELECT 1 FROM tb_Reservation r WHERE r.id_user = u.tg_id)")
+        if date_from:
+            conditions.append("u.date_of_reg >= ?")
+            params.append(datetime.combine(date_from, datetime.min.time()))
+        if date_to:
+            conditions.append("u.date_of_reg < ?")
+            params.append(datetime.combine(date_to + timedelta(days=1), datetime.min.time()))
+        
+        backwards = before is not None
+        cursor_join = ""
+        cursor_params = []
+        if after is not None or backwards:
+            sign = ">" if backwards else "<"
+            cursor_join = "CROSS JOIN (SELECT date_of_reg, tg_id FROM Users WHERE tg_id = ?) c"
+            cursor_params.append(before if backwards else after)
+            conditions.append(
+                f"(u.date_of_reg {sign} c.date_of_reg OR (u.date_of_reg = c.date_of_reg AND u.tg_id {sign} c.tg_id))"
+            )
+        
+        where = "WHERE " + " AND ".join(conditions) if conditions else ""
+        order = "ASC" if backwards else "DESC"
+        # Лишняя строка показывает, есть ли страница дальше в том же направлении
+        page, page_params = self._page(0, limit + 1)
+        query = f"""
+        SELECT u.tg_id, u.full_name, u.phone, u.username, u.is_admin, u.is_banned, u.is_blocked, u.date_of_reg,
+               CASE WHEN EXISTS (SELECT 1 FROM tb_Reservation r WHERE r.id_user = u.tg_id) THEN 1 ELSE 0 END as has_reservation
+        FROM Users u
+        {cursor_join}
+        {where}
+        ORDER BY u.date_of_reg {order}, u.tg_id {order}
+        {page}
+        """
+        rows = await self._query("list_users", query, (*cursor_params, *params, *page_params), fetch=True) or []
+        if not rows and cursor_params:
+            # Пользователя на краю страницы удалили — курсора больше нет, начинаем с первой страницы
+            return await self.list_users(filter_name, limit=limit, date_from=date_from, date_to=date_to)
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if backwards:
+            rows.reverse()
+            return {'users': rows, 'has_next': True, 'has_prev': has_more}
+        return {'users': rows, 'has_next': has_more, 'has_prev': after is not None}
+    
+    @staticmethod
+    def _status_updates(is_banned: bool = None, is_blocked: bool = None,
+                        is_admin: bool = None) -> Tuple[List[str], List[int]]:
         updates = []
         params = []
         
+        if is_admin is not None:
+            updates.append("is_admin = ?")
+            params.append(1 if is_admin else 0)
+        
         if is_banned is not None:
             updates.append("is_banned = ?")
             params.append(1 if is_banned else 0)
@@ -107,44 +843,179 @@ class DatabaseManager:
             updates.append("is_blocked = ?")
             params.append(1 if is_blocked else 0)
         
+        return updates, params
+    
+    async def update_user_status(self, tg_id: int, is_banned: bool = None, is_blocked: bool = None):
+        """Обновление статуса пользователя"""
+        updates, params = self._status_updates(is_banned, is_blocked)
         if updates:
             params.append(tg_id)
             query = f"UPDATE Users SET {', '.join(updates)} WHERE tg_id = ?"
-            self._execute_query(query, tuple(params))
+            await self._query("update_user_status", query, tuple(params))
+            self.user_cache.invalidate(tg_id)
+            self._publish(CacheSignal.USER, tg_id)
+    
+    async def set_users_status(self, tg_ids: List[int], is_banned: bool = None, is_blocked: bool = None,
+                               is_admin: bool = None) -> int:
+        """Бан/разбан, блокировка/разблокировка и права администратора многих пользователей одной транзакцией
+        
+        Возвращает число найденных пользователей.
+        """
+        updates, params = self._status_updates(is_banned, is_blocked, is_admin)
+        if not updates or not tg_ids:
+            return 0
+        statement = f"""
+        UPDATE u SET {', '.join(updates)}
+        OUTPUT INSERTED.tg_id
+        FROM Users u
+        INNER JOIN {self.BATCH_TABLE} b ON b.tg_id = u.tg_id
+        """
+        rows = [(tg_id,) for tg_id in set(tg_ids)]
+        changed = await self._bulk("set_users_status", [("tg_id", "BIGINT")], rows, statement, tuple(params), fetch=True)
+        self._invalidate_users(row['tg_id'] for row in changed)
+        return len(changed)
+    
+    # Столбцы пакета import_users
+    USER_IMPORT_COLUMNS = [
+        ("tg_id", "BIGINT"), ("full_name", "NVARCHAR(200)"), ("phone", "NVARCHAR(50)"), ("username", "NVARCHAR(100)"),
+    ]
+    
+    async def import_users(self, users: List[Tuple[int, str, str, Optional[str]]]) -> int:
+        """Регистрация многих пользователей одной транзакцией
+        
+        users — (tg_id, ФИО, телефон, username); уже зарегистрированные
+        пропускаются. Возвращает число добавленных.
+        """
+        rows = list({user[0]: tuple(user) for user in users}.values())
+        if not rows:
+            return 0
+        statement = f"""
+        INSERT INTO Users (tg_id, full_name, phone, username, is_admin, is_banned, is_blocked, date_of_reg)
+        OUTPUT INSERTED.tg_id
+        SELECT b.tg_id, b.full_name, b.phone, b.username, 0, 0, 0, ?
+        FROM {self.BATCH_TABLE} b
+        WHERE NOT EXISTS (SELECT 1 FROM Users u WITH (UPDLOCK, HOLDLOCK) WHERE u.tg_id = b.tg_id)
+        """
+        added = await self._bulk(
+            "import_users", self.USER_IMPORT_COLUMNS, rows, statement, (datetime.now(),), fetch=True
+        )
+        self._invalidate_users(row['tg_id'] for row in added)
+        logger.info(f"Импортировано пользователей: {len(added)} из {len(rows)}")
+        return len(added)
+    
+    async def delete_users(self, tg_ids: List[int]):
+        """Удаление пользователей вместе с их записями одной транзакцией"""
+        if not tg_ids:
+            return
+        statement = f"""
+        SET NOCOUNT ON;
+        DECLARE @released TABLE (date_reservation DATE, id_shift INT, id_vacancy INT);
+        
+        DELETE r
+        OUTPUT DELETED.date_reservation, DELETED.id_shift, DELETED.id_vacancy INTO @released
+        FROM tb_Reservation r
+        INNER JOIN {self.BATCH_TABLE} b ON b.tg_id = r.id_user;
+        
+        DELETE u
+        FROM Users u
+        INNER JOIN {self.BATCH_TABLE} b ON b.tg_id = u.tg_id;
+        
+        SELECT date_reservation, id_shift, id_vacancy FROM @released;
+        """
+        rows = [(tg_id,) for tg_id in set(tg_ids)]
+        released = await self._bulk("delete_users", [("tg_id", "BIGINT")], rows, statement, fetch=True)
+        self._release_slots(released)
+        self._invalidate_users(tg_id for tg_id, in rows)
+        logger.info(f"Удалено пользователей: {len(rows)}, их записей: {len(released)}")
+    
+    def _invalidate_users(self, tg_ids):
+        for tg_id in tg_ids:
+            self.user_cache.invalidate(tg_id)
+            self._publish(CacheSignal.USER, tg_id)
     
     # === СПРАВОЧНИКИ ===
     
     async def get_vacancies(self) -> List[Dict]:
         """Получение всех вакансий"""
-        query = "SELECT id, name FROM spr_Vacancies ORDER BY name"
-        return self._execute_query(query, fetch=True) or []
+        return await self._get_reference(self.vacancies_cache, "spr_Vacancies")
     
     async def get_shifts(self) -> List[Dict]:
         """Получение всех смен"""
-        query = "SELECT id, name FROM spr_Shifts ORDER BY name"
-        return self._execute_query(query, fetch=True) or []
+        return await self._get_reference(self.shifts_cache, "spr_Shifts")
+    
+    async def _get_reference(self, cache: VersionedCache, table: str) -> List[Dict]:
+        """Справочник из кэша с периодической сверкой версии таблицы"""
+        if cache.is_fresh():
+            cache.hits += 1
+            return list(cache.value)
+        
+        version_expr = self.REFERENCE_VERSION_EXPR
+        if cache.loaded:
+            probe = await self._query(f"{table}.version", f"SELECT {version_expr} FROM {table}", fetch=True)
+            version = (probe[0]['version_count'], probe[0]['version_checksum'])
+            if version == cache.version:
+                cache.mark_checked()
+                cache.hits += 1
+                return list(cache.value)
+        
+        cache.misses += 1
+        query = f"""
+        SELECT t.id, t.name, ver.version_count, ver.version_checksum
+        FROM {table} t
+        CROSS JOIN (SELECT {version_expr} FROM {table}) ver
+        ORDER BY t.name
+        """
+        rows = await self._query(f"{table}.load", query, fetch=True) or []
+        version = (rows[0]['version_count'], rows[0]['version_checksum']) if rows else (0, None)
+        cache.set([{'id': row['id'], 'name': row['name']} for row in rows], version)
+        return list(cache.value)
     
     async def add_vacancy(self, name: str) -> int:
         """Добавление новой вакансии"""
         query = "INSERT INTO spr_Vacancies (name) OUTPUT INSERTED.id VALUES (?)"
-        result = self._execute_query(query, (name,), fetch=True)
-        return result['id'] if result else None
+        result = await self._query("add_vacancy", query, (name,), fetch=True)
+        self.vacancies_cache.invalidate()
+        self._publish(CacheSignal.VACANCIES)
+        return result[0]['id'] if result else None
     
     async def add_shift(self, name: str) -> int:
         """Добавление новой смены"""
         query = "INSERT INTO spr_Shifts (name) OUTPUT INSERTED.id VALUES (?)"
-        result = self._execute_query(query, (name,), fetch=True)
-        return result['id'] if result else None
+        result = await self._query("add_shift", query, (name,), fetch=True)
+        self.shifts_cache.invalidate()
+        self._publish(CacheSignal.SHIFTS)
+        return result[0]['id'] if result else None
     
     async def delete_vacancy(self, vacancy_id: int):
         """Удаление вакансии"""
         query = "DELETE FROM spr_Vacancies WHERE id = ?"
-        self._execute_query(query, (vacancy_id,))
+        await self._query("delete_vacancy", query, (vacancy_id,))
+        self.vacancies_cache.invalidate()
+        self.slot_inventory.invalidate()
+        self._publish(CacheSignal.VACANCIES)
+        self._publish(CacheSignal.SLOTS)
     
     async def delete_shift(self, shift_id: int):
         """Удаление смены"""
         query = "DELETE FROM spr_Shifts WHERE id = ?"
-        self._execute_query(query, (shift_id,))
+        await self._query("delete_shift", query, (shift_id,))
+        self.shifts_cache.invalidate()
+        self.slot_inventory.invalidate()
+        self._publish(CacheSignal.SHIFTS)
+        self._publish(CacheSignal.SLOTS)
+    
+    async def delete_need_cells(self, shift_ids: List[int], vacancy_ids: List[int]):
+        """Удаление потребности по всем датам для сочетаний данных смен и вакансий"""
+        if not shift_ids or not vacancy_ids:
+            return
+        query = f"""
+        DELETE FROM tb_NeedWorkers
+        WHERE id_shift IN ({", ".join("?" * len(shift_ids))})
+          AND id_vacancy IN ({", ".join("?" * len(vacancy_ids))})
+        """
+        await self._query("delete_need_cells", query, (*shift_ids, *vacancy_ids))
+        self.slot_inventory.invalidate()
+        self._publish(CacheSignal.SLOTS)
     
     # === ПЛАНИРОВАНИЕ РАБОТЫ ===
     
@@ -155,7 +1026,7 @@ class DatabaseManager:
         SELECT id FROM tb_NeedWorkers 
         WHERE date = ? AND id_shift = ? AND id_vacancy = ?
         """
-        existing = self._execute_query(check_query, (work_date, shift_id, vacancy_id), fetch=True)
+        existing = await self._query("add_need_workers.check", check_query, (work_date, shift_id, vacancy_id), fetch=True)
         
         if existing:
             # Обновляем существующую запись
@@ -164,14 +1035,217 @@ class DatabaseManager:
             SET need_count = ? 
             WHERE date = ? AND id_shift = ? AND id_vacancy = ?
             """
-            self._execute_query(update_query, (need_count, work_date, shift_id, vacancy_id))
+            await self._query("add_need_workers.update", update_query, (need_count, work_date, shift_id, vacancy_id))
         else:
             # Создаем новую запись
             insert_query = """
             INSERT INTO tb_NeedWorkers (date, id_shift, id_vacancy, need_count)
             VALUES (?, ?, ?, ?)
             """
-            self._execute_query(insert_query, (work_date, shift_id, vacancy_id, need_count))
+            await self._query("add_need_workers.insert", insert_query, (work_date, shift_id, vacancy_id, need_count))
+        
+        self.slot_inventory.set_need(work_date, shift_id, vacancy_id, need_count)
+        self._publish(CacheSignal.SLOTS, work_date)
+    
+    async def apply_need_matrix(self, cells: List[Tuple[date, int, int, int]]) -> List[Dict]:
+        """Применение матрицы потребности
+        
+        cells — список (дата, id смены, id вакансии, количество). Возвращает
+        только фактически измененные ячейки: old_count (None для новых),
+        new_count, названия смены и вакансии и число записей на слот.
+        """
+        return await self._merge_need_cells("apply_need_matrix", cells)
+    
+    async def upsert_need_cells(self, cells: List[Tuple[date, int, int, int]], overwrite: bool = True) -> int:
+        """Запись любого числа ячеек потребности
+        
+        cells — (дата, id смены, id вакансии, количество); без overwrite
+        заполняются только пустые ячейки. Возвращает число измененных.
+        """
+        return len(await self._merge_need_cells("upsert_need_cells", cells, overwrite))
+    
+    # Столбцы пакета ячеек потребности
+    NEED_CELL_COLUMNS = [("date", "DATE"), ("id_shift", "INT"), ("id_vacancy", "INT"), ("need_count", "INT")]
+    
+    async def _merge_need_cells(self, name: str, cells: List[Tuple[date, int, int, int]],
+                                overwrite: bool = True) -> List[Dict]:
+        """Один MERGE ячеек из пакета #batch; повторы ячейки сводятся к максимуму"""
+        if not cells:
+            return []
+        statement = f"""
+        SET NOCOUNT ON;
+        DECLARE @changes TABLE (date DATE, id_shift INT, id_vacancy INT, old_count INT, new_count INT);
+        
+        MERGE tb_NeedWorkers WITH (HOLDLOCK) AS nw
+        USING (
+            SELECT date, id_shift, id_vacancy, MAX(need_count) as need_count
+            FROM {self.BATCH_TABLE}
+            GROUP BY date, id_shift, id_vacancy
+        ) AS src
+            ON nw.date = src.date AND nw.id_shift = src.id_shift AND nw.id_vacancy = src.id_vacancy
+        WHEN MATCHED AND ? = 1 AND nw.need_count <> src.need_count THEN
+            UPDATE SET need_count = src.need_count
+        WHEN NOT MATCHED THEN
+            INSERT (date, id_shift, id_vacancy, need_count)
+            VALUES (src.date, src.id_shift, src.id_vacancy, src.need_count)
+        OUTPUT INSERTED.date, INSERTED.id_shift, INSERTED.id_vacancy, DELETED.need_count, INSERTED.need_count
+            INTO @changes;
+        
+        SELECT c.date, c.id_shift, c.id_vacancy, c.old_count, c.new_count,
+               s.name as shift_name, v.name as vacancy_name,
+               (SELECT COUNT(*) FROM tb_Reservation r
+                WHERE r.date_reservation = c.date AND r.id_shift = c.id_shift
+                AND r.id_vacancy = c.id_vacancy) as reserved_count
+        FROM @changes c
+        INNER JOIN spr_Shifts s ON c.id_shift = s.id
+        INNER JOIN spr_Vacancies v ON c.id_vacancy = v.id
+        """
+        changes = await self._bulk(
+            name, self.NEED_CELL_COLUMNS, [tuple(cell) for cell in cells], statement, (int(overwrite),), fetch=True
+        )
+        self._apply_need_changes(changes)
+        return changes
+    
+    def _apply_need_changes(self, changes: List[Dict]):
+        """Запись новых счетчиков измененных слотов в кэш"""
+        for c in changes:
+            self.slot_inventory.set_counts(c['date'], c['id_shift'], c['id_vacancy'], c['new_count'], c['reserved_count'])
+        for work_date in {c['date'] for c in changes}:
+            self._publish(CacheSignal.SLOTS, work_date)
+    
+    def _invalidate_need_dates(self, rows: List[Dict]):
+        """Сброс дат кэша слотов после массового изменения потребности"""
+        for work_date in {row['date'] for row in rows}:
+            self.slot_inventory.invalidate(work_date)
+            self._publish(CacheSignal.SLOTS, work_date)
+    
+    async def copy_need_week(self, source_start: date, target_start: date, overwrite: bool = True) -> int:
+        """Копирование потребности за 7 дней с source_start на неделю с target_start одним MERGE"""
+        query = """
+        SET NOCOUNT ON;
+        MERGE tb_NeedWorkers WITH (HOLDLOCK) AS nw
+        USING (
+            SELECT DATEADD(day, ?, date) as date, id_shift, id_vacancy, MAX(need_count) as need_count
+            FROM tb_NeedWorkers
+            WHERE date >= ? AND date <= ?
+            GROUP BY date, id_shift, id_vacancy
+        ) AS src
+            ON nw.date = src.date AND nw.id_shift = src.id_shift AND nw.id_vacancy = src.id_vacancy
+        WHEN MATCHED AND ? = 1 AND nw.need_count <> src.need_count THEN
+            UPDATE SET need_count = src.need_count
+        WHEN NOT MATCHED THEN
+            INSERT (date, id_shift, id_vacancy, need_count)
+            VALUES (src.date, src.id_shift, src.id_vacancy, src.need_count)
+        OUTPUT INSERTED.date;
+        """
+        params = ((target_start - source_start).days, source_start, source_start + timedelta(days=6), int(overwrite))
+        changed = await self._query("copy_need_week", query, params, fetch=True)
+        self._invalidate_need_dates(changed)
+        return len(changed)
+    
+    # === ШАБЛОНЫ ПОТРЕБНОСТИ ===
+    
+    async def get_need_templates(self) -> List[Dict]:
+        """Шаблоны недели с числом ячеек"""
+        query = """
+        SELECT t.id, t.name, t.is_auto, COUNT(i.id_template) as items
+        FROM tb_NeedTemplate t
+        LEFT JOIN tb_NeedTemplateItem i ON i.id_template = t.id
+        GROUP BY t.id, t.name, t.is_auto
+        ORDER BY t.name
+        """
+        return await self._query("get_need_templates", query, fetch=True) or []
+    
+    async def save_need_template(self, name: str, week_start: date) -> Dict:
+        """Сохранение потребности 7 дней с week_start как шаблона (существующий перезаписывается)
+        
+        День недели хранится как 0 = понедельник: 01.01.1900 — понедельник,
+        поэтому расчет не зависит от SET DATEFIRST.
+        """
+        query = """
+        SET NOCOUNT ON;
+        SET XACT_ABORT ON;
+        BEGIN TRANSACTION;
+        
+        DECLARE @id INT, @items INT;
+        SELECT @id = id FROM tb_NeedTemplate WITH (UPDLOCK, HOLDLOCK) WHERE name = ?;
+        IF @id IS NULL
+        BEGIN
+            INSERT INTO tb_NeedTemplate (name) VALUES (?);
+            SET @id = SCOPE_IDENTITY();
+        END
+        ELSE
+            DELETE FROM tb_NeedTemplateItem WHERE id_template = @id;
+        
+        INSERT INTO tb_NeedTemplateItem (id_template, weekday, id_shift, id_vacancy, need_count)
+        SELECT @id, DATEDIFF(day, '19000101', date) % 7, id_shift, id_vacancy, MAX(need_count)
+        FROM tb_NeedWorkers
+        WHERE date >= ? AND date <= ? AND need_count > 0
+        GROUP BY date, id_shift, id_vacancy;
+        SET @items = @@ROWCOUNT;
+        
+        COMMIT;
+        SELECT @id as id, @items as items;
+        """
+        result = await self._query("save_need_template", query, (name, name, week_start, week_start + timedelta(days=6)), fetch=True)
+        return result[0]
+    
+    async def delete_need_template(self, template_id: int):
+        """Удаление шаблона"""
+        query = """
+        DELETE FROM tb_NeedTemplateItem WHERE id_template = ?;
+        DELETE FROM tb_NeedTemplate WHERE id = ?;
+        """
+        await self._query("delete_need_template", query, (template_id, template_id))
+    
+    async def set_need_template_auto(self, template_id: int, is_auto: bool):
+        """Включение автозаполнения календаря шаблоном (активным может быть только один)"""
+        query = """
+        UPDATE tb_NeedTemplate
+        SET is_auto = CASE WHEN id = ? THEN ? ELSE 0 END
+        WHERE id = ? OR is_auto = 1
+        """
+        await self._query("set_need_template_auto", query, (template_id, int(is_auto), template_id))
+    
+    async def apply_need_template(self, template_id: int, start_date: date, end_date: date,
+                                  overwrite: bool = True) -> int:
+        """Применение шаблона к периоду одним MERGE, возвращает число измененных ячеек"""
+        return await self._merge_need_template("i.id_template = ?", (template_id,), start_date, end_date, overwrite)
+    
+    async def materialize_need_templates(self, start_date: date, end_date: date) -> int:
+        """Заполнение пустых ячеек периода активным шаблоном; заданные вручную значения не меняются"""
+        return await self._merge_need_template("t.is_auto = 1", (), start_date, end_date, overwrite=False)
+    
+    async def _merge_need_template(self, condition: str, condition_params: tuple,
+                                   start_date: date, end_date: date, overwrite: bool) -> int:
+        query = f"""
+        SET NOCOUNT ON;
+        WITH days AS (
+            SELECT CAST(? AS DATE) as date
+            UNION ALL
+            SELECT DATEADD(day, 1, date) FROM days WHERE date < ?
+        )
+        MERGE tb_NeedWorkers WITH (HOLDLOCK) AS nw
+        USING (
+            SELECT d.date, i.id_shift, i.id_vacancy, i.need_count
+            FROM days d
+            INNER JOIN tb_NeedTemplateItem i ON i.weekday = DATEDIFF(day, '19000101', d.date) % 7
+            INNER JOIN tb_NeedTemplate t ON t.id = i.id_template
+            WHERE {condition}
+        ) AS src
+            ON nw.date = src.date AND nw.id_shift = src.id_shift AND nw.id_vacancy = src.id_vacancy
+        WHEN MATCHED AND ? = 1 AND nw.need_count <> src.need_count THEN
+            UPDATE SET need_count = src.need_count
+        WHEN NOT MATCHED THEN
+            INSERT (date, id_shift, id_vacancy, need_count)
+            VALUES (src.date, src.id_shift, src.id_vacancy, src.need_count)
+        OUTPUT INSERTED.date
+        OPTION (MAXRECURSION 366);
+        """
+        params = (start_date, end_date, *condition_params, int(overwrite))
+        changed = await self._query("merge_need_template", query, params, fetch=True)
+        self._invalidate_need_dates(changed)
+        return len(changed)
     
     async def get_need_workers(self, start_date: date = None, end_date: date = None) -> List[Dict]:
         """Получение потребности в работниках"""
@@ -190,58 +1264,130 @@ class DatabaseManager:
         WHERE nw.date >= ? AND nw.date <= ?
         ORDER BY nw.date, s.name, v.name
         """
-        return self._execute_query(query, (start_date, end_date), fetch=True) or []
+        return await self._query("get_need_workers", query, (start_date, end_date), fetch=True) or []
     
     async def get_available_slots(self, work_date: date) -> List[Dict]:
         """Получение доступных слотов для записи на определенную дату"""
+        slots_by_date = await self.get_available_slots_range(work_date, work_date)
+        return slots_by_date.get(work_date, [])
+    
+    async def get_available_slots_range(self, start_date: date, end_date: date) -> Dict[date, List[Dict]]:
+        """Получение доступных слотов за период, сгруппированных по датам
+        
+        Слоты берутся из кэша; недостающие даты догружаются одним запросом
+        сразу на окно календаря.
+        """
+        missing = self.slot_inventory.missing_dates(start_date, end_date)
+        if missing:
+            load_start = missing[0]
+            load_end = max(missing[-1], load_start + timedelta(days=Config.CALENDAR_DAYS_AHEAD - 1))
+            version = self.slot_inventory.begin_load()
+            rows = await self._load_slots(load_start, load_end)
+            self.slot_inventory.load(load_start, load_end, rows, version)
+            if self.slot_inventory.begin_load() != version or not self.slot_inventory.covers(start_date, end_date):
+                # Кэш изменился или более ранние даты периода истекли во время загрузки —
+                # отвечаем по свежим данным из БД
+                if load_start > start_date:
+                    rows = await self._load_slots(start_date, end_date)
+                return self._group_available([row for row in rows if start_date <= row['date'] <= end_date])
+        return self.slot_inventory.available(start_date, end_date)
+    
+    async def _load_slots(self, start_date: date, end_date: date) -> List[Dict]:
+        """Потребность и количество записей по всем слотам периода"""
         query = """
         SELECT nw.id, nw.date, nw.need_count, nw.id_vacancy, nw.id_shift,
                v.name as vacancy_name, s.name as shift_name,
-               ISNULL(r.reserved_count, 0) as reserved_count,
-               (nw.need_count - ISNULL(r.reserved_count, 0)) as available_count
+               COALESCE(r.reserved_count, 0) as reserved_count,
+               (nw.need_count - COALESCE(r.reserved_count, 0)) as available_count
         FROM tb_NeedWorkers nw
         INNER JOIN spr_Vacancies v ON nw.id_vacancy = v.id
         INNER JOIN spr_Shifts s ON nw.id_shift = s.id
         LEFT JOIN (
             SELECT id_vacancy, id_shift, date_reservation, COUNT(*) as reserved_count
             FROM tb_Reservation
-            WHERE date_reservation = ?
+            WHERE date_reservation >= ? AND date_reservation <= ?
             GROUP BY id_vacancy, id_shift, date_reservation
         ) r ON nw.id_vacancy = r.id_vacancy AND nw.id_shift = r.id_shift AND nw.date = r.date_reservation
-        WHERE nw.date = ? AND (nw.need_count - ISNULL(r.reserved_count, 0)) > 0
-        ORDER BY s.name, v.name
+        WHERE nw.date >= ? AND nw.date <= ?
+        ORDER BY nw.date, s.name, v.name
         """
-        return self._execute_query(query, (work_date, work_date), fetch=True) or []
+        return await self._query("load_slots", query, (start_date, end_date, start_date, end_date), fetch=True) or []
+    
+    @staticmethod
+    def _group_available(rows: List[Dict]) -> Dict[date, List[Dict]]:
+        slots_by_date = {}
+        for row in rows:
+            if row['available_count'] > 0:
+                slots_by_date.setdefault(row['date'], []).append(row)
+        return slots_by_date
     
     # === РЕЗЕРВАЦИИ ===
     
-    async def make_reservation(self, user_id: int, work_date: date, shift_id: int, vacancy_id: int) -> Optional[int]:
-        """Создание резервации"""
-        # Проверяем, нет ли уже записи пользователя на эту дату
-        check_query = """
-        SELECT id FROM tb_Reservation 
-        WHERE id_user = ? AND date_reservation = ?
+    async def make_reservation(self, user_id: int, work_date: date, shift_id: int, vacancy_id: int) -> Dict:
+        """Создание резервации
+        
+        Проверка записи пользователя на дату, проверка свободных мест и вставка
+        выполняются одной транзакцией с блокировкой строки потребности, поэтому
+        параллельные записи не могут превысить need_count.
+        Возвращает словарь со статусом (ReservationStatus) и данными слота.
         """
-        existing = self._execute_query(check_query, (user_id, work_date), fetch=True)
+        query = """
+        SET NOCOUNT ON;
+        SET XACT_ABORT ON;
+        DECLARE @user_id BIGINT = ?, @date DATE = ?, @shift_id INT = ?, @vacancy_id INT = ?, @event_time DATETIME = ?;
+        DECLARE @status VARCHAR(20), @reservation_id INT = NULL, @need INT = NULL, @reserved INT = 0;
         
-        if existing:
-            return None  # Пользователь уже записан на эту дату
+        BEGIN TRANSACTION;
         
-        # Проверяем доступность места
-        slots = await self.get_available_slots(work_date)
-        available_slot = next((s for s in slots if s['id_shift'] == shift_id and s['id_vacancy'] == vacancy_id), None)
+        IF EXISTS (
+            SELECT 1 FROM tb_Reservation WITH (UPDLOCK, HOLDLOCK)
+            WHERE id_user = @user_id AND date_reservation = @date
+        )
+            SET @status = 'already_booked';
+        ELSE
+        BEGIN
+            -- Блокировка строки потребности выстраивает параллельные записи на слот в очередь
+            SELECT @need = need_count
+            FROM tb_NeedWorkers WITH (UPDLOCK, HOLDLOCK)
+            WHERE date = @date AND id_shift = @shift_id AND id_vacancy = @vacancy_id;
+            
+            SELECT @reserved = COUNT(*)
+            FROM tb_Reservation
+            WHERE date_reservation = @date AND id_shift = @shift_id AND id_vacancy = @vacancy_id;
+            
+            IF ISNULL(@need, 0) - @reserved > 0
+            BEGIN
+                INSERT INTO tb_Reservation (date_time_event, date_reservation, id_user, id_shift, id_vacancy)
+                VALUES (@event_time, @date, @user_id, @shift_id, @vacancy_id);
+                SET @reservation_id = SCOPE_IDENTITY();
+                SET @reserved = @reserved + 1;
+                SET @status = 'created';
+            END
+            ELSE
+                SET @status = 'full';
+        END
         
-        if not available_slot or available_slot['available_count'] <= 0:
-            return None  # Нет свободных мест
+        COMMIT TRANSACTION;
         
-        # Создаем резервацию
-        query = """
-        INSERT INTO tb_Reservation (date_time_event, date_reservation, id_user, id_shift, id_vacancy)
-        OUTPUT INSERTED.id
-        VALUES (?, ?, ?, ?, ?)
+        SELECT @status as status, @reservation_id as reservation_id,
+               v.name as vacancy_name, s.name as shift_name,
+               ISNULL(@need, 0) as need_count, @reserved as reserved_count,
+               ISNULL(@need, 0) - @reserved as available_count
+        FROM (SELECT 1 as dummy) d
+        LEFT JOIN spr_Vacancies v ON v.id = @vacancy_id
+        LEFT JOIN spr_Shifts s ON s.id = @shift_id;
         """
-        result = self._execute_query(query, (datetime.now(), work_date, user_id, shift_id, vacancy_id), fetch=True)
-        return result[0] if result else None
+        params = (user_id, work_date, shift_id, vacancy_id, datetime.now())
+        result = await self._query("make_reservation", query, params, fetch=True)
+        outcome = result[0]
+        if outcome['status'] != ReservationStatus.ALREADY_BOOKED:
+            self.slot_inventory.set_counts(
+                work_date, shift_id, vacancy_id, outcome['need_count'], outcome['reserved_count']
+            )
+            self._publish(CacheSignal.SLOTS, work_date)
+        if outcome['status'] == ReservationStatus.CREATED:
+            logger.info(f"Создана резервация {outcome['reservation_id']}: пользователь {user_id}, {work_date}")
+        return outcome
     
     async def get_user_reservations(self, user_id: int) -> List[Dict]:
         """Получение резерваций пользователя"""
@@ -255,12 +1401,24 @@ class DatabaseManager:
         WHERE r.id_user = ? AND r.date_reservation >= ?
         ORDER BY r.date_reservation
         """
-        return self._execute_query(query, (user_id, date.today()), fetch=True) or []
+        return await self._query("get_user_reservations", query, (user_id, date.today()), fetch=True) or []
     
     async def delete_reservation(self, reservation_id: int):
         """Удаление резервации"""
-        query = "DELETE FROM tb_Reservation WHERE id = ?"
-        self._execute_query(query, (reservation_id,))
+        query = """
+        DELETE FROM tb_Reservation
+        OUTPUT DELETED.date_reservation, DELETED.id_shift, DELETED.id_vacancy
+        WHERE id = ?
+        """
+        deleted = await self._query("delete_reservation", query, (reservation_id,), fetch=True)
+        self._release_slots(deleted)
+    
+    def _release_slots(self, deleted: List[Dict]):
+        """Освобождение мест в кэше слотов по удаленным резервациям"""
+        for row in deleted:
+            self.slot_inventory.release(row['date_reservation'], row['id_shift'], row['id_vacancy'])
+        for work_date in {row['date_reservation'] for row in deleted}:
+            self._publish(CacheSignal.SLOTS, work_date)
     
     async def confirm_reservation(self, reservation_id: int):
         """Подтверждение резервации"""
@@ -268,7 +1426,7 @@ class DatabaseManager:
         UPDATE tb_Reservation
         SET confirmed = 1
         WHERE id = ?"""
-        self._execute_query(query, (reservation_id,))
+        await self._query("confirm_reservation", query, (reservation_id,))
     
     async def get_pending_reservations(self) -> List[Dict]:
         """Получение неподтвержденных резерваций для админа"""
@@ -284,7 +1442,110 @@ class DatabaseManager:
         AND r.confirmed = 0
         ORDER BY r.date_time_event
         """
-        return self._execute_query(query, (date.today(),), fetch=True) or []
+        return await self._query("get_pending_reservations", query, (date.today(),), fetch=True) or []
+    
+    async def get_pending_reservations_page(self, offset: int = 0, limit: int = 10) -> Tuple[List[Dict], int]:
+        """Страница неподтвержденных резерваций и их общее количество"""
+        page, page_params = self._page(offset, limit)
+        query = f"""
+        SELECT r.id, r.date_time_event, r.date_reservation,
+               u.full_name, u.phone, u.tg_id,
+               v.name as vacancy_name, s.name as shift_name,
+               COUNT(*) OVER () as total_count
+        FROM tb_Reservation r
+        INNER JOIN Users u ON r.id_user = u.tg_id
+        INNER JOIN spr_Vacancies v ON r.id_vacancy = v.id
+        INNER JOIN spr_Shifts s ON r.id_shift = s.id
+        WHERE r.date_reservation >= ?
+        AND r.confirmed = 0
+        ORDER BY r.date_time_event, r.id
+        {page}
+        """
+        rows = await self._query("get_pending_reservations_page", query, (date.today(), *page_params), fetch=True) or []
+        total = rows[0]['total_count'] if rows else 0
+        for row in rows:
+            del row['total_count']
+        return rows, total
+    
+    async def confirm_reservations(self, reservation_ids: List[int]) -> int:
+        """Подтверждение любого числа резерваций одной транзакцией"""
+        if not reservation_ids:
+            return 0
+        statement = f"""
+        UPDATE r SET confirmed = 1
+        OUTPUT INSERTED.id
+        FROM tb_Reservation r
+        INNER JOIN {self.BATCH_TABLE} b ON b.id = r.id
+        WHERE r.confirmed = 0
+        """
+        rows = [(reservation_id,) for reservation_id in set(reservation_ids)]
+        result = await self._bulk("confirm_reservations", [("id", "INT")], rows, statement, fetch=True)
+        return len(result)
+    
+    async def delete_reservations(self, reservation_ids: List[int]) -> int:
+        """Удаление любого числа резерваций одной транзакцией"""
+        if not reservation_ids:
+            return 0
+        statement = f"""
+        DELETE r
+        OUTPUT DELETED.date_reservation, DELETED.id_shift, DELETED.id_vacancy
+        FROM tb_Reservation r
+        INNER JOIN {self.BATCH_TABLE} b ON b.id = r.id
+        """
+        rows = [(reservation_id,) for reservation_id in set(reservation_ids)]
+        deleted = await self._bulk("delete_reservations", [("id", "INT")], rows, statement, fetch=True)
+        self._release_slots(deleted)
+        return len(deleted)
+    
+    # === СОСТОЯНИЯ FSM ===
+    
+    async def get_fsm_record(self, storage_key: str) -> Optional[Dict]:
+        """Состояние и данные FSM (data — сериализованная строка); просроченные не возвращаются"""
+        query = """
+        SELECT state, data FROM tb_FSMState
+        WHERE storage_key = ? AND (expires_at IS NULL OR expires_at > GETDATE())
+        """
+        result = await self._query("get_fsm_record", query, (storage_key,), fetch=True)
+        return result[0] if result else None
+    
+    async def set_fsm_field(self, storage_key: str, field: str, value: Optional[str], ttl: int):
+        """Запись состояния (field='state') или данных (field='data') FSM
+        
+        Пустая запись удаляется. Срок жизни отсчитывается заново при
+        каждой записи; у просроченной записи второе поле сбрасывается.
+        """
+        if field not in ("state", "data"):
+            raise ValueError(f"Неизвестное поле FSM: {field}")
+        other = "data" if field == "state" else "state"
+        query = f"""
+        SET NOCOUNT ON;
+        DECLARE @key VARCHAR(200) = ?, @value NVARCHAR(MAX) = ?, @ttl INT = ?;
+        DECLARE @expires DATETIME = CASE WHEN @ttl > 0 THEN DATEADD(second, @ttl, GETDATE()) END;
+        
+        UPDATE tb_FSMState WITH (UPDLOCK, HOLDLOCK)
+        SET {field} = @value,
+            {other} = CASE WHEN expires_at IS NULL OR expires_at > GETDATE() THEN {other} END,
+            expires_at = @expires
+        WHERE storage_key = @key;
+        
+        IF @@ROWCOUNT = 0
+        BEGIN
+            IF @value IS NOT NULL
+                INSERT INTO tb_FSMState (storage_key, {field}, expires_at) VALUES (@key, @value, @expires);
+        END
+        ELSE
+            DELETE FROM tb_FSMState WHERE storage_key = @key AND state IS NULL AND data IS NULL;
+        """
+        await self._query("set_fsm_field", query, (storage_key, value, ttl))
+    
+    async def delete_expired_fsm(self) -> int:
+        """Удаление брошенных состояний FSM"""
+        result = await self._query(
+            "delete_expired_fsm",
+            "DELETE FROM tb_FSMState OUTPUT DELETED.storage_key WHERE expires_at <= GETDATE()",
+            fetch=True
+        )
+        return len(result)
     
     # === СТАТИСТИКА ===
 
@@ -293,7 +1554,7 @@ class DatabaseManager:
         query = "SELECT DISTINCT date FROM tb_NeedWorkers WHERE date >= ? AND date <= ? ORDER BY date"
         today = date.today()
         end_date = today + timedelta(days=7)
-        rows = self._execute_query(query, (today, end_date), fetch=True)
+        rows = await self._query("get_dates_reservation", query, (today, end_date), fetch=True)
         return [r['date'] for r in rows] if rows else []
     
     async def get_statistics(self, start_date: date = None, end_date: date = None) -> List[Dict]:
@@ -306,9 +1567,9 @@ class DatabaseManager:
         query = """
         SELECT nw.date, v.name as vacancy_name, s.name as shift_name,
                nw.need_count, 
-               ISNULL(r.reserved_count, 0) as reserved_count,
+               COALESCE(r.reserved_count, 0) as reserved_count,
                CASE 
-                   WHEN nw.need_count > 0 THEN CAST(ISNULL(r.reserved_count, 0) * 100.0 / nw.need_count AS DECIMAL(5,2))
+                   WHEN nw.need_count > 0 THEN CAST(COALESCE(r.reserved_count, 0) * 100.0 / nw.need_count AS DECIMAL(5,2))
                    ELSE 0 
                END as fill_percentage
         FROM tb_NeedWorkers nw
@@ -323,7 +1584,158 @@ class DatabaseManager:
         WHERE nw.date >= ? AND nw.date <= ?
         ORDER BY nw.date, s.name, v.name
         """
-        return self._execute_query(query, (start_date, end_date, start_date, end_date), fetch=True) or []
+        return await self._query("get_statistics", query, (start_date, end_date, start_date, end_date), fetch=True) or []
+    
+    # === РАССЫЛКИ ===
+    
+    async def create_broadcast_job(self, text: str, admin_chat_id: int) -> Dict:
+        """Создание задания рассылки со списком получателей"""
+        query = f"""
+        SET NOCOUNT ON;
+        SET XACT_ABORT ON;
+        DECLARE @job_id INT, @total INT;
+        
+        BEGIN TRANSACTION;
+        INSERT INTO tb_BroadcastJob (text, status, admin_chat_id)
+        VALUES (?, '{BroadcastStatus.RUNNING}', ?);
+        SET @job_id = SCOPE_IDENTITY();
+        
+        INSERT INTO tb_BroadcastDelivery (id_job, tg_id, status)
+        SELECT DISTINCT @job_id, tg_id, {DeliveryStatus.PENDING}
+        FROM Users
+        WHERE is_blocked = 0;
+        SET @total = @@ROWCOUNT;
+        
+        UPDATE tb_BroadcastJob SET total = @total WHERE id = @job_id;
+        COMMIT TRANSACTION;
+        
+        SELECT {BROADCAST_JOB_COLUMNS} FROM tb_BroadcastJob WHERE id = @job_id;
+        """
+        result = await self._query("create_broadcast_job", query, (text, admin_chat_id), fetch=True)
+        job = result[0]
+        logger.info(f"Создано задание рассылки {job['id']}, получателей: {job['total']}")
+        return job
+    
+    async def get_broadcast_job(self, job_id: int) -> Optional[Dict]:
+        """Получение задания рассылки"""
+        query = f"SELECT {BROADCAST_JOB_COLUMNS} FROM tb_BroadcastJob WHERE id = ?"
+        result = await self._query("get_broadcast_job", query, (job_id,), fetch=True)
+        return result[0] if result else None
+    
+    async def get_unfinished_broadcast_jobs(self) -> List[Dict]:
+        """Задания рассылки, которые выполняются или стоят на паузе"""
+        query = f"""
+        SELECT {BROADCAST_JOB_COLUMNS} FROM tb_BroadcastJob
+        WHERE status IN ('{BroadcastStatus.RUNNING}', '{BroadcastStatus.PAUSED}')
+        ORDER BY id
+        """
+        return await self._query("get_unfinished_broadcast_jobs", query, fetch=True) or []
+    
+    async def set_broadcast_progress_message(self, job_id: int, message_id: int):
+        """Сохранение сообщения, в котором показывается ход рассылки"""
+        query = "UPDATE tb_BroadcastJob SET progress_message_id = ? WHERE id = ?"
+        await self._query("set_broadcast_progress_message", query, (message_id, job_id))
+    
+    async def set_broadcast_status(self, job_id: int, status: str) -> Optional[Dict]:
+        """Смена статуса задания; завершенные задания не меняются"""
+        query = f"""
+        SET NOCOUNT ON;
+        UPDATE tb_BroadcastJob
+        SET status = ?,
+            finished_at = CASE WHEN ? IN ('{BroadcastStatus.DONE}', '{BroadcastStatus.CANCELLED}')
+                               THEN GETDATE() ELSE finished_at END
+        WHERE id = ? AND status NOT IN ('{BroadcastStatus.DONE}', '{BroadcastStatus.CANCELLED}');
+        IF @@ROWCOUNT > 0
+            SELECT {BROADCAST_JOB_COLUMNS} FROM tb_BroadcastJob WHERE id = ?;
+        """
+        result = await self._query("set_broadcast_status", query, (status, status, job_id, job_id), fetch=True)
+        return result[0] if result else None
+    
+    async def claim_broadcast_job(self, job_id: int, owner: str, lease_seconds: float) -> bool:
+        """Захват выполняемого задания процессом owner
+        
+        Удается, если у задания нет владельца, владелец — owner или его
+        аренда истекла. Так одно задание рассылает только один процесс.
+        """
+        query = f"""
+        UPDATE tb_BroadcastJob
+        SET owner = ?, lease_until = DATEADD(SECOND, ?, GETDATE())
+        OUTPUT INSERTED.id
+        WHERE id = ? AND status = '{BroadcastStatus.RUNNING}'
+          AND (owner IS NULL OR owner = ? OR lease_until < GETDATE())
+        """
+        params = (owner, math.ceil(lease_seconds), job_id, owner)
+        return bool(await self._query("claim_broadcast_job", query, params, fetch=True))
+    
+    async def release_broadcast_job(self, job_id: int, owner: str, only_stopped: bool = True) -> bool:
+        """Снятие владельца задания
+        
+        При only_stopped задание, которое снова запустили (resume), пока
+        владелец останавливался, остается за ним: возвращается False, и
+        владелец продолжает рассылку.
+        """
+        condition = f" AND status <> '{BroadcastStatus.RUNNING}'" if only_stopped else ""
+        query = f"""
+        UPDATE tb_BroadcastJob
+        SET owner = NULL, lease_until = NULL
+        OUTPUT INSERTED.id
+        WHERE id = ? AND owner = ?{condition}
+        """
+        return bool(await self._query("release_broadcast_job", query, (job_id, owner), fetch=True))
+    
+    async def get_broadcast_recipients(self, job_id: int, limit: int) -> List[int]:
+        """Очередная пачка получателей, которым рассылка еще не отправлялась"""
+        page, page_params = self._page(0, limit)
+        query = f"""
+        SELECT tg_id FROM tb_BroadcastDelivery
+        WHERE id_job = ? AND status = {DeliveryStatus.PENDING}
+        ORDER BY tg_id
+        {page}
+        """
+        rows = await self._query("get_broadcast_recipients", query, (job_id, *page_params), fetch=True) or []
+        return [row['tg_id'] for row in rows]
+    
+    async def checkpoint_broadcast(self, job_id: int, results: Dict[int, int], owner: str = None,
+                                   lease_seconds: float = 0) -> Dict:
+        """Сохранение результатов пачки отправок одной транзакцией
+        
+        results — {tg_id: DeliveryStatus}. Пользователи, заблокировавшие
+        бота, помечаются is_blocked. Аренда задания владельцем owner
+        продлевается на lease_seconds. Возвращает обновленное задание.
+        """
+        statement = f"""
+        SET NOCOUNT ON;
+        DECLARE @changed TABLE (status TINYINT);
+        
+        UPDATE d SET status = b.status
+        OUTPUT INSERTED.status INTO @changed
+        FROM tb_BroadcastDelivery d
+        INNER JOIN {self.BATCH_TABLE} b ON b.tg_id = d.tg_id
+        WHERE d.id_job = ? AND d.status = {DeliveryStatus.PENDING};
+        
+        UPDATE u SET is_blocked = 1
+        FROM Users u
+        INNER JOIN {self.BATCH_TABLE} b ON b.tg_id = u.tg_id
+        WHERE b.status = {DeliveryStatus.BLOCKED};
+        
+        UPDATE tb_BroadcastJob
+        SET delivered = delivered + (SELECT COUNT(*) FROM @changed WHERE status = {DeliveryStatus.DELIVERED}),
+            failed = failed + (SELECT COUNT(*) FROM @changed
+                               WHERE status IN ({DeliveryStatus.FAILED}, {DeliveryStatus.BLOCKED})),
+            blocked = blocked + (SELECT COUNT(*) FROM @changed WHERE status = {DeliveryStatus.BLOCKED}),
+            lease_until = CASE WHEN owner = ? THEN DATEADD(SECOND, ?, GETDATE()) ELSE lease_until END
+        WHERE id = ?;
+        
+        SELECT {BROADCAST_JOB_COLUMNS} FROM tb_BroadcastJob WHERE id = ?;
+        """
+        rows = list(results.items())
+        params = (job_id, owner, math.ceil(lease_seconds), job_id, job_id)
+        result = await self._bulk(
+            "checkpoint_broadcast", [("tg_id", "BIGINT"), ("status", "INT")], rows, statement, params, fetch=True
+        )
+        blocked_ids = [tg_id for tg_id, status in rows if status == DeliveryStatus.BLOCKED]
+        self._invalidate_users(blocked_ids)
+        return result[0]
     
     # === СПРАВОЧНИК ===
     
@@ -331,20 +1743,49 @@ class DatabaseManager:
         """Установка текста справочника"""
         # Если таблица пустая — вставить, иначе — обновить
         check_query = "SELECT TOP 1 id FROM spr_Handbook"
-        existing = self._execute_query(check_query, fetch=True)
+        existing = await self._query("set_handbook.check", check_query, fetch=True)
         if existing:
-            update_query = "UPDATE spr_Handbook SET text=?, updated_at=GETDATE() WHERE id=?"
-            self._execute_query(update_query, (text, existing[0]['id']))
+            update_query = "UPDATE spr_Handbook SET text=?, updated_at=GETDATE() OUTPUT INSERTED.updated_at WHERE id=?"
+            result = await self._query("set_handbook.update", update_query, (text, existing[0]['id']), fetch=True)
         else:
-            insert_query = "INSERT INTO spr_Handbook (text) VALUES (?)"
-            self._execute_query(insert_query, (text,))
+            insert_query = "INSERT INTO spr_Handbook (text) OUTPUT INSERTED.updated_at VALUES (?)"
+            result = await self._query("set_handbook.insert", insert_query, (text,), fetch=True)
+        # Кэш обновляется сразу, без повторного чтения
+        self.handbook_cache.set(text, result[0]['updated_at'] if result else None)
+        self._publish(CacheSignal.HANDBOOK)
         logger.info("Справочник обновлен в БД")
     
     async def get_handbook(self) -> str:
-        """Получение текста справочника"""
-        query = "SELECT TOP 1 text FROM spr_Handbook ORDER BY updated_at DESC"
-        result = self._execute_query(query, fetch=True)
-        return result[0]['text'] if result else ""
+        """Получение текста справочника
+        
+        Текст хранится в памяти вместе с версией (updated_at); раз в
+        HANDBOOK_CHECK_INTERVAL секунд версия сверяется дешевым запросом.
+        """
+        cache = self.handbook_cache
+        if cache.is_fresh():
+            cache.hits += 1
+            return cache.value
+        
+        page, page_params = self._page(0, 1)
+        if cache.loaded:
+            probe = await self._query(
+                "get_handbook.version",
+                f"SELECT updated_at as version FROM spr_Handbook ORDER BY updated_at DESC {page}",
+                page_params, fetch=True
+            )
+            if (probe[0]['version'] if probe else None) == cache.version:
+                cache.mark_checked()
+                cache.hits += 1
+                return cache.value
+        
+        cache.misses += 1
+        query = f"SELECT text, updated_at FROM spr_Handbook ORDER BY updated_at DESC {page}"
+        result = await self._query("get_handbook.load", query, page_params, fetch=True)
+        if result:
+            cache.set(result[0]['text'], result[0]['updated_at'])
+        else:
+            cache.set("", None)
+        return cache.value
     
     # === УТИЛИТЫ ===
     
@@ -353,28 +1794,41 @@ class DatabaseManager:
         today = date.today()
         end_date = today + timedelta(days=7)
         
-        need_workers = await self.get_need_workers(today, end_date)
-        calendar_status = {}
-        
-        for nw in need_workers:
-            date_str = nw['date'].strftime('%Y-%m-%d')
-            if date_str not in calendar_status:
-                calendar_status[date_str] = {'filled': False, 'total_needed': 0, 'total_reserved': 0}
-            
-            # Получаем количество зарезервированных мест для этой даты/смены/вакансии
-            query = """
-            SELECT COUNT(*) as reserved_count
+        # Потребность и записи сводятся по дням одним запросом
+        query = """
+        SELECT nw.date,
+               SUM(nw.need_count) as total_needed,
+               SUM(COALESCE(r.reserved_count, 0)) as total_reserved,
+               MAX(CASE WHEN COALESCE(r.reserved_count, 0) >= nw.need_count THEN 1 ELSE 0 END) as filled
+        FROM tb_NeedWorkers nw
+        INNER JOIN spr_Vacancies v ON nw.id_vacancy = v.id
+        INNER JOIN spr_Shifts s ON nw.id_shift = s.id
+        LEFT JOIN (
+            SELECT id_vacancy, id_shift, date_reservation, COUNT(*) as reserved_count
             FROM tb_Reservation
-            WHERE date_reservation = ? AND id_shift = ? AND id_vacancy = ?
-            """
-            reserved_result = self._execute_query(query, (nw['date'], nw['id_shift'], nw['id_vacancy']), fetch=True)
-            reserved_count = reserved_result[0]['reserved_count'] if reserved_result else 0
-            
-            calendar_status[date_str]['total_needed'] += nw['need_count']
-            calendar_status[date_str]['total_reserved'] += reserved_count
-            
-            # Проверяем заполненность
-            if reserved_count >= nw['need_count']:
-                calendar_status[date_str]['filled'] = True
+            WHERE date_reservation >= ? AND date_reservation <= ?
+            GROUP BY id_vacancy, id_shift, date_reservation
+        ) r ON nw.id_vacancy = r.id_vacancy AND nw.id_shift = r.id_shift AND nw.date = r.date_reservation
+        WHERE nw.date >= ? AND nw.date <= ?
+        GROUP BY nw.date
+        """
+        rows = await self._query("get_calendar_status", query, (today, end_date, today, end_date), fetch=True) or []
         
-        return calendar_status
\ No newline at end of file
+        calendar_status = {}
+        for row in rows:
+            date_str = row['date'].strftime('%Y-%m-%d')
+            calendar_status[date_str] = {
+                'filled': bool(row['filled']),
+                'total_needed': row['total_needed'],
+                'total_reserved': row['total_reserved'],
+            }
+        
+        return calendar_status
+
+
+def create_database() -> DatabaseManager:
+    """DatabaseManager для Config.DB_BACKEND"""
+    if Config.DB_BACKEND == "sqlite":
+        from database_sqlite import SQLiteDatabaseManager
+        return SQLiteDatabaseManager(Config.DB_SQLITE_PATH)
+    return DatabaseManager()
@@ -0,0 +1,719 @@
+import logging
+import sqlite3
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+from config import Config
+from database import (
+    BROADCAST_JOB_COLUMNS, BroadcastStatus, CacheSignal, ConnectionPool, DatabaseManager, DeliveryStatus,
+    ReservationStatus, _QueryHandle,
+)
+
+logger = logging.getLogger(__name__)
+
+# Даты хранятся текстом ISO 8601: сравнение строк совпадает с хронологическим.
+# Обратное преобразование — по объявленному типу столбца (DATE, DATETIME).
+sqlite3.register_adapter(date, lambda value: value.isoformat())
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(" "))
+sqlite3.register_converter("DATE", lambda value: date.fromisoformat(value.decode()))
+sqlite3.register_converter("DATETIME", lambda value: datetime.fromisoformat(value.decode()))
+
+# Те же таблицы, что в schema.sql и SCHEMA_STATEMENTS, создаются при каждом запуске
+SQLITE_SCHEMA_STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS Users (
+        tg_id INTEGER PRIMARY KEY,
+        full_name TEXT NOT NULL,
+        phone TEXT NOT NULL,
+        username TEXT,
+        is_admin INTEGER NOT NULL DEFAULT 0,
+        is_banned INTEGER NOT NULL DEFAULT 0,
+        is_blocked INTEGER NOT NULL DEFAULT 0,
+        date_of_reg DATETIME NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS IX_Users_phone ON Users (phone)",
+    "CREATE INDEX IF NOT EXISTS IX_Users_date_of_reg ON Users (date_of_reg DESC, tg_id DESC)",
+    "CREATE TABLE IF NOT EXISTS spr_Vacancies (id INTEGER PRIMARY KEY, name TEXT NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS spr_Shifts (id INTEGER PRIMARY KEY, name TEXT NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS spr_Handbook (id INTEGER PRIMARY KEY, text TEXT NOT NULL, updated_at DATETIME NOT NULL)",
+    """
+    CREATE TABLE IF NOT EXISTS tb_NeedWorkers (
+        id INTEGER PRIMARY KEY,
+        date DATE NOT NULL,
+        id_shift INTEGER NOT NULL,
+        id_vacancy INTEGER NOT NULL,
+        need_count INTEGER NOT NULL,
+        UNIQUE (date, id_shift, id_vacancy)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS tb_Reservation (
+        id INTEGER PRIMARY KEY,
+        id_user INTEGER NOT NULL,
+        date_time_event DATETIME NOT NULL,
+        date_reservation DATE NOT NULL,
+        id_vacancy INTEGER NOT NULL,
+        id_shift INTEGER NOT NULL,
+        confirmed INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS IX_tb_Reservation_id_user ON tb_Reservation (id_user, date_reservation)",
+    "CREATE INDEX IF NOT EXISTS IX_tb_Reservation_slot ON tb_Reservation (date_reservation, id_shift, id_vacancy)",
+    """
+    CREATE TABLE IF NOT EXISTS tb_BroadcastJob (
+        id INTEGER PRIMARY KEY,
+        text TEXT NOT NULL,
+        status TEXT NOT NULL,
+        admin_chat_id INTEGER NOT NULL,
+        progress_message_id INTEGER,
+        total INTEGER NOT NULL DEFAULT 0,
+        delivered INTEGER NOT NULL DEFAULT 0,
+        failed INTEGER NOT NULL DEFAULT 0,
+        blocked INTEGER NOT NULL DEFAULT 0,
+        created_at DATETIME NOT NULL,
+        finished_at DATETIME,
+        owner TEXT,
+        lease_until DATETIME
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS tb_BroadcastDelivery (
+        id_job INTEGER NOT NULL,
+        tg_id INTEGER NOT NULL,
+        status INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (id_job, tg_id)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS tb_FSMState (
+        storage_key TEXT PRIMARY KEY,
+        state TEXT,
+        data TEXT,
+        expires_at DATETIME
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS tb_NeedTemplate (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE,
+        is_auto INTEGER NOT NULL DEFAULT 0,
+        created_at DATETIME NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS tb_NeedTemplateItem (
+        id_template INTEGER NOT NULL,
+        weekday INTEGER NOT NULL,
+        id_shift INTEGER NOT NULL,
+        id_vacancy INTEGER NOT NULL,
+        need_count INTEGER NOT NULL,
+        PRIMARY KEY (id_template, weekday, id_shift, id_vacancy)
+    ) WITHOUT ROWID
+    """,
+]
+
+
+def _rows(cursor: sqlite3.Cursor) -> List[Dict]:
+    if cursor.description is None:
+        return []
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def _casefold(value: Optional[str]) -> Optional[str]:
+    return value.casefold() if value is not None else None
+
+
+class _Interrupt:
+    """Отмена запроса SQLite для _QueryHandle: прерывает текущую операцию подключения"""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def cancel(self):
+        self.conn.interrupt()
+
+
+def _upsert_needs(conn: sqlite3.Connection, cells, overwrite: bool = True) -> List[Dict]:
+    """Запись ячеек потребности (дата, смена, вакансия, количество)
+
+    Возвращает только измененные ячейки с прежним (old_count, None для
+    новых) и новым значением. Без overwrite заполняются только пустые ячейки.
+    """
+    changes = []
+    for work_date, shift_id, vacancy_id, need_count in cells:
+        row = conn.execute(
+            "SELECT need_count FROM tb_NeedWorkers WHERE date = ? AND id_shift = ? AND id_vacancy = ?",
+            (work_date, shift_id, vacancy_id)
+        ).fetchone()
+        old_count = row[0] if row else None
+        if row is None:
+            conn.execute(
+                "INSERT INTO tb_NeedWorkers (date, id_shift, id_vacancy, need_count) VALUES (?, ?, ?, ?)",
+                (work_date, shift_id, vacancy_id, need_count)
+            )
+        elif overwrite and old_count != need_count:
+            conn.execute(
+                "UPDATE tb_NeedWorkers SET need_count = ? WHERE date = ? AND id_shift = ? AND id_vacancy = ?",
+                (need_count, work_date, shift_id, vacancy_id)
+            )
+        else:
+            continue
+        changes.append({
+            'date': work_date, 'id_shift': shift_id, 'id_vacancy': vacancy_id,
+            'old_count': old_count, 'new_count': need_count,
+        })
+    return changes
+
+
+@contextmanager
+def _batch(conn: sqlite3.Connection, columns: List[Tuple[str, str]], rows: List[tuple]):
+    """Временная таблица temp.batch со строками пакета на время блока"""
+    definition = ", ".join(f"{column} {sql_type}" for column, sql_type in columns)
+    conn.execute(f"CREATE TEMP TABLE batch ({definition})")
+    try:
+        conn.executemany(f"INSERT INTO temp.batch VALUES ({', '.join('?' * len(columns))})", rows)
+        yield
+    finally:
+        conn.execute("DROP TABLE temp.batch")
+
+
+def _select_job(conn: sqlite3.Connection, job_id: int) -> Optional[Dict]:
+    rows = _rows(conn.execute(f"SELECT {BROADCAST_JOB_COLUMNS} FROM tb_BroadcastJob WHERE id = ?", (job_id,)))
+    return rows[0] if rows else None
+
+
+class SQLiteDatabaseManager(DatabaseManager):
+    """Встроенная база SQLite с тем же API, что у DatabaseManager
+
+    Для небольших площадок (один сервер, без SQL Server) и воспроизводимых
+    замеров. Файл в режиме WAL: читатели не ждут писателя, записи
+    выстраиваются в очередь блокировкой БД (busy timeout). Инструкции
+    T-SQL из нескольких шагов (MERGE, OUTPUT, переменные) заменены
+    транзакциями BEGIN IMMEDIATE на одном подключении, таблицы создаются
+    при запуске.
+    """
+
+    REFERENCE_VERSION_EXPR = "COUNT(*) as version_count, group_concat(id || ':' || name, '|') as version_checksum"
+    BATCH_TABLE = "temp.batch"
+
+    def __init__(self, path: str):
+        self.path = path
+        super().__init__()
+
+    def _create_pool(self) -> ConnectionPool:
+        return ConnectionPool(
+            self._connect,
+            min_size=Config.DB_POOL_MIN_SIZE,
+            max_size=Config.DB_POOL_MAX_SIZE,
+            acquire_timeout=Config.DB_POOL_ACQUIRE_TIMEOUT,
+            idle_timeout=Config.DB_POOL_IDLE_TIMEOUT,
+            ping_interval=Config.DB_POOL_PING_INTERVAL,
+            errors=(sqlite3.Error,),
+            # Закрытое подключение — единственный случай, когда его нельзя вернуть в пул
+            is_disconnect=lambda error: isinstance(error, sqlite3.ProgrammingError),
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.path,
+            timeout=Config.DB_QUERY_TIMEOUT,  # Ожидание блокировки записи другим подключением
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            isolation_level=None,  # Транзакции открываются явно в _transaction
+            check_same_thread=False,  # Подключение переходит между потоками БД через пул
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.create_function("casefold", 1, _casefold, deterministic=True)
+        return conn
+
+    def _schema_statements(self) -> List[str]:
+        return SQLITE_SCHEMA_STATEMENTS
+
+    @staticmethod
+    def _page(offset: int, limit: int) -> Tuple[str, tuple]:
+        return "LIMIT ? OFFSET ?", (limit, offset)
+
+    @staticmethod
+    def _like(column: str) -> str:
+        # LIKE в SQLite не учитывает регистр только для латиницы
+        return f"casefold({column}) LIKE casefold(?) ESCAPE '\\'"
+
+    @staticmethod
+    def _escape_like(text: str) -> str:
+        return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+    def _execute_query(self, query: str, params: tuple = None, fetch: bool = False,
+                       handle: _QueryHandle = None, timeout: float = None):
+        """Выполнение одной инструкции SQL (в автокоммите)"""
+        try:
+            with self.pool.connection() as conn:
+                if handle:
+                    handle.attach(_Interrupt(conn))
+                try:
+                    cursor = conn.execute(query, params or ())
+                    return _rows(cursor) if fetch else None
+                finally:
+                    if handle:
+                        handle.detach()
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка выполнения запроса: {e}")
+            logger.error(f"Запрос: {query}")
+            logger.error(f"Параметры: {params}")
+            raise
+
+    async def _transaction(self, name: str, work: Callable[[sqlite3.Connection], object], params: tuple = None):
+        """Выполнение work(conn) одной транзакцией с блокировкой записи на время транзакции"""
+        return await self._run(name, lambda handle, timeout: self._execute_transaction(work, handle), params)
+
+    def _execute_transaction(self, work: Callable[[sqlite3.Connection], object], handle: _QueryHandle):
+        with self.pool.connection() as conn:
+            handle.attach(_Interrupt(conn))
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    result = work(conn)
+                except BaseException:
+                    conn.rollback()
+                    raise
+                conn.commit()
+                return result
+            finally:
+                handle.detach()
+
+    def _execute_bulk(self, columns: List[Tuple[str, str]], rows: List[tuple], statement: str, params: tuple,
+                      fetch: bool, handle: _QueryHandle, timeout: float):
+        def work(conn):
+            with _batch(conn, columns, rows):
+                cursor = conn.execute(statement, params)
+                return _rows(cursor) if fetch else None
+
+        try:
+            return self._execute_transaction(work, handle)
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка пакетной операции ({len(rows)} строк): {e}")
+            logger.error(f"Запрос: {statement}")
+            raise
+
+    # === ПОЛЬЗОВАТЕЛИ ===
+
+    async def set_users_status(self, tg_ids: List[int], is_banned: bool = None, is_blocked: bool = None,
+                               is_admin: bool = None) -> int:
+        updates, params = self._status_updates(is_banned, is_blocked, is_admin)
+        if not updates or not tg_ids:
+            return 0
+        statement = f"""
+        UPDATE Users SET {', '.join(updates)}
+        WHERE tg_id IN (SELECT tg_id FROM {self.BATCH_TABLE})
+        RETURNING tg_id
+        """
+        rows = [(tg_id,) for tg_id in set(tg_ids)]
+        changed = await self._bulk("set_users_status", [("tg_id", "INTEGER")], rows, statement, tuple(params), fetch=True)
+        self._invalidate_users(row['tg_id'] for row in changed)
+        return len(changed)
+
+    async def import_users(self, users: List[Tuple[int, str, str, Optional[str]]]) -> int:
+        rows = list({user[0]: tuple(user) for user in users}.values())
+        if not rows:
+            return 0
+        # Транзакция BEGIN IMMEDIATE уже исключает параллельную вставку тех же tg_id
+        statement = f"""
+        INSERT INTO Users (tg_id, full_name, phone, username, is_admin, is_banned, is_blocked, date_of_reg)
+        SELECT b.tg_id, b.full_name, b.phone, b.username, 0, 0, 0, ?
+        FROM {self.BATCH_TABLE} b
+        WHERE NOT EXISTS (SELECT 1 FROM Users u WHERE u.tg_id = b.tg_id)
+        RETURNING tg_id
+        """
+        columns = [("tg_id", "INTEGER"), ("full_name", "TEXT"), ("phone", "TEXT"), ("username", "TEXT")]
+        added = await self._bulk("import_users", columns, rows, statement, (datetime.now(),), fetch=True)
+        self._invalidate_users(row['tg_id'] for row in added)
+        logger.info(f"Импортировано пользователей: {len(added)} из {len(rows)}")
+        return len(added)
+
+    async def delete_users(self, tg_ids: List[int]):
+        if not tg_ids:
+            return
+        rows = [(tg_id,) for tg_id in set(tg_ids)]
+
+        def work(conn):
+            with _batch(conn, [("tg_id", "INTEGER")], rows):
+                released = _rows(conn.execute(f"""
+                DELETE FROM tb_Reservation WHERE id_user IN (SELECT tg_id FROM {self.BATCH_TABLE})
+                RETURNING date_reservation, id_shift, id_vacancy
+                """))
+                conn.execute(f"DELETE FROM Users WHERE tg_id IN (SELECT tg_id FROM {self.BATCH_TABLE})")
+                return released
+
+        released = await self._transaction("delete_users", work, (len(rows),))
+        self._release_slots(released)
+        self._invalidate_users(tg_id for tg_id, in rows)
+        logger.info(f"Удалено пользователей: {len(rows)}, их записей: {len(released)}")
+
+    # === СПРАВОЧНИКИ ===
+
+    async def add_vacancy(self, name: str) -> int:
+        result = await self._query(
+            "add_vacancy", "INSERT INTO spr_Vacancies (name) VALUES (?) RETURNING id", (name,), fetch=True
+        )
+        self.vacancies_cache.invalidate()
+        self._publish(CacheSignal.VACANCIES)
+        return result[0]['id'] if result else None
+
+    async def add_shift(self, name: str) -> int:
+        result = await self._query(
+            "add_shift", "INSERT INTO spr_Shifts (name) VALUES (?) RETURNING id", (name,), fetch=True
+        )
+        self.shifts_cache.invalidate()
+        self._publish(CacheSignal.SHIFTS)
+        return result[0]['id'] if result else None
+
+    # === ПЛАНИРОВАНИЕ РАБОТЫ ===
+
+    async def _merge_need_cells(self, name: str, cells: List[Tuple[date, int, int, int]],
+                                overwrite: bool = True) -> List[Dict]:
+        if not cells:
+            return []
+        # Повторы ячейки сводятся к максимуму, как в MERGE базового класса
+        counts = {}
+        for work_date, shift_id, vacancy_id, need_count in cells:
+            key = (work_date, shift_id, vacancy_id)
+            counts[key] = max(need_count, counts.get(key, need_count))
+        merged = [(*key, need_count) for key, need_count in counts.items()]
+
+        def work(conn):
+            changes = []
+            for change in _upsert_needs(conn, merged, overwrite):
+                names = conn.execute("""
+                SELECT s.name, v.name,
+                       (SELECT COUNT(*) FROM tb_Reservation r
+                        WHERE r.date_reservation = ? AND r.id_shift = s.id AND r.id_vacancy = v.id)
+                FROM spr_Shifts s, spr_Vacancies v
+                WHERE s.id = ? AND v.id = ?
+                """, (change['date'], change['id_shift'], change['id_vacancy'])).fetchone()
+                if names:
+                    changes.append({**change, 'shift_name': names[0], 'vacancy_name': names[1],
+                                    'reserved_count': names[2]})
+            return changes
+
+        changes = await self._transaction(name, work, (len(merged), overwrite))
+        self._apply_need_changes(changes)
+        return changes
+
+    async def copy_need_week(self, source_start: date, target_start: date, overwrite: bool = True) -> int:
+        offset = timedelta(days=(target_start - source_start).days)
+
+        def work(conn):
+            rows = conn.execute("""
+            SELECT date, id_shift, id_vacancy, MAX(need_count)
+            FROM tb_NeedWorkers
+            WHERE date >= ? AND date <= ?
+            GROUP BY date, id_shift, id_vacancy
+            """, (source_start, source_start + timedelta(days=6))).fetchall()
+            return _upsert_needs(conn, [(row[0] + offset, row[1], row[2], row[3]) for row in rows], overwrite)
+
+        changed = await self._transaction("copy_need_week", work, (source_start, target_start, overwrite))
+        self._invalidate_need_dates(changed)
+        return len(changed)
+
+    # === ШАБЛОНЫ ПОТРЕБНОСТИ ===
+
+    async def save_need_template(self, name: str, week_start: date) -> Dict:
+        def work(conn):
+            row = conn.execute("SELECT id FROM tb_NeedTemplate WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                template_id = conn.execute(
+                    "INSERT INTO tb_NeedTemplate (name, is_auto, created_at) VALUES (?, 0, ?)", (name, datetime.now())
+                ).lastrowid
+            else:
+                template_id = row[0]
+                conn.execute("DELETE FROM tb_NeedTemplateItem WHERE id_template = ?", (template_id,))
+            needs = conn.execute("""
+            SELECT date, id_shift, id_vacancy, MAX(need_count)
+            FROM tb_NeedWorkers
+            WHERE date >= ? AND date <= ? AND need_count > 0
+            GROUP BY date, id_shift, id_vacancy
+            """, (week_start, week_start + timedelta(days=6))).fetchall()
+            conn.executemany(
+                "INSERT INTO tb_NeedTemplateItem (id_template, weekday, id_shift, id_vacancy, need_count) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(template_id, work_date.weekday(), shift_id, vacancy_id, count)
+                 for work_date, shift_id, vacancy_id, count in needs]
+            )
+            return {'id': template_id, 'items': len(needs)}
+
+        return await self._transaction("save_need_template", work, (name, week_start))
+
+    async def delete_need_template(self, template_id: int):
+        def work(conn):
+            conn.execute("DELETE FROM tb_NeedTemplateItem WHERE id_template = ?", (template_id,))
+            conn.execute("DELETE FROM tb_NeedTemplate WHERE id = ?", (template_id,))
+
+        await self._transaction("delete_need_template", work, (template_id,))
+
+    async def _merge_need_template(self, condition: str, condition_params: tuple,
+                                   start_date: date, end_date: date, overwrite: bool) -> int:
+        def work(conn):
+            items = conn.execute(f"""
+            SELECT i.weekday, i.id_shift, i.id_vacancy, i.need_count
+            FROM tb_NeedTemplateItem i
+            INNER JOIN tb_NeedTemplate t ON t.id = i.id_template
+            WHERE {condition}
+            """, condition_params).fetchall()
+            by_weekday = {}
+            for weekday, shift_id, vacancy_id, need_count in items:
+                by_weekday.setdefault(weekday, []).append((shift_id, vacancy_id, need_count))
+            cells = []
+            day = start_date
+            while day <= end_date:
+                cells.extend((day, *item) for item in by_weekday.get(day.weekday(), []))
+                day += timedelta(days=1)
+            return _upsert_needs(conn, cells, overwrite)
+
+        changed = await self._transaction(
+            "merge_need_template", work, (start_date, end_date, *condition_params, overwrite)
+        )
+        self._invalidate_need_dates(changed)
+        return len(changed)
+
+    # === РЕЗЕРВАЦИИ ===
+
+    async def make_reservation(self, user_id: int, work_date: date, shift_id: int, vacancy_id: int) -> Dict:
+        """Создание резервации
+
+        Проверки и вставка выполняются в транзакции BEGIN IMMEDIATE: она
+        берет блокировку записи сразу, поэтому параллельные записи на слот
+        выполняются по очереди и не превышают need_count.
+        """
+        def work(conn):
+            need, reserved, reservation_id = None, 0, None
+            booked = conn.execute(
+                "SELECT 1 FROM tb_Reservation WHERE id_user = ? AND date_reservation = ?", (user_id, work_date)
+            ).fetchone()
+            if booked:
+                status = ReservationStatus.ALREADY_BOOKED
+            else:
+                row = conn.execute(
+                    "SELECT need_count FROM tb_NeedWorkers WHERE date = ? AND id_shift = ? AND id_vacancy = ?",
+                    (work_date, shift_id, vacancy_id)
+                ).fetchone()
+                need = row[0] if row else None
+                reserved = conn.execute(
+                    "SELECT COUNT(*) FROM tb_Reservation WHERE date_reservation = ? AND id_shift = ? AND id_vacancy = ?",
+                    (work_date, shift_id, vacancy_id)
+                ).fetchone()[0]
+                if (need or 0) - reserved > 0:
+                    reservation_id = conn.execute(
+                        "INSERT INTO tb_Reservation (date_time_event, date_reservation, id_user, id_shift, id_vacancy) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (datetime.now(), work_date, user_id, shift_id, vacancy_id)
+                    ).lastrowid
+                    reserved += 1
+                    status = ReservationStatus.CREATED
+                else:
+                    status = ReservationStatus.FULL
+            vacancy_name, shift_name = conn.execute(
+                "SELECT (SELECT name FROM spr_Vacancies WHERE id = ?), (SELECT name FROM spr_Shifts WHERE id = ?)",
+                (vacancy_id, shift_id)
+            ).fetchone()
+            return {
+                'status': status, 'reservation_id': reservation_id,
+                'vacancy_name': vacancy_name, 'shift_name': shift_name,
+                'need_count': need or 0, 'reserved_count': reserved, 'available_count': (need or 0) - reserved,
+            }
+
+        outcome = await self._transaction("make_reservation", work, (user_id, work_date, shift_id, vacancy_id))
+        if outcome['status'] != ReservationStatus.ALREADY_BOOKED:
+            self.slot_inventory.set_counts(
+                work_date, shift_id, vacancy_id, outcome['need_count'], outcome['reserved_count']
+            )
+            self._publish(CacheSignal.SLOTS, work_date)
+        if outcome['status'] == ReservationStatus.CREATED:
+            logger.info(f"Создана резервация {outcome['reservation_id']}: пользователь {user_id}, {work_date}")
+        return outcome
+
+    async def delete_reservation(self, reservation_id: int):
+        query = "DELETE FROM tb_Reservation WHERE id = ? RETURNING date_reservation, id_shift, id_vacancy"
+        self._release_slots(await self._query("delete_reservation", query, (reservation_id,), fetch=True))
+
+    async def confirm_reservations(self, reservation_ids: List[int]) -> int:
+        if not reservation_ids:
+            return 0
+        statement = f"""
+        UPDATE tb_Reservation SET confirmed = 1
+        WHERE confirmed = 0 AND id IN (SELECT id FROM {self.BATCH_TABLE})
+        RETURNING id
+        """
+        rows = [(reservation_id,) for reservation_id in set(reservation_ids)]
+        return len(await self._bulk("confirm_reservations", [("id", "INTEGER")], rows, statement, fetch=True))
+
+    async def delete_reservations(self, reservation_ids: List[int]) -> int:
+        if not reservation_ids:
+            return 0
+        statement = f"""
+        DELETE FROM tb_Reservation WHERE id IN (SELECT id FROM {self.BATCH_TABLE})
+        RETURNING date_reservation, id_shift, id_vacancy
+        """
+        rows = [(reservation_id,) for reservation_id in set(reservation_ids)]
+        deleted = await self._bulk("delete_reservations", [("id", "INTEGER")], rows, statement, fetch=True)
+        self._release_slots(deleted)
+        return len(deleted)
+
+    # === СОСТОЯНИЯ FSM ===
+
+    async def get_fsm_record(self, storage_key: str) -> Optional[Dict]:
+        query = """
+        SELECT state, data FROM tb_FSMState
+        WHERE storage_key = ? AND (expires_at IS NULL OR expires_at > ?)
+        """
+        result = await self._query("get_fsm_record", query, (storage_key, datetime.now()), fetch=True)
+        return result[0] if result else None
+
+    async def set_fsm_field(self, storage_key: str, field: str, value: Optional[str], ttl: int):
+        if field not in ("state", "data"):
+            raise ValueError(f"Неизвестное поле FSM: {field}")
+        other = "data" if field == "state" else "state"
+        now = datetime.now()
+        expires_at = now + timedelta(seconds=ttl) if ttl > 0 else None
+
+        def work(conn):
+            updated = conn.execute(f"""
+            UPDATE tb_FSMState
+            SET {field} = ?,
+                {other} = CASE WHEN expires_at IS NULL OR expires_at > ? THEN {other} END,
+                expires_at = ?
+            WHERE storage_key = ?
+            """, (value, now, expires_at, storage_key)).rowcount
+            if updated:
+                conn.execute(
+                    "DELETE FROM tb_FSMState WHERE storage_key = ? AND state IS NULL AND data IS NULL", (storage_key,)
+                )
+            elif value is not None:
+                conn.execute(
+                    f"INSERT INTO tb_FSMState (storage_key, {field}, expires_at) VALUES (?, ?, ?)",
+                    (storage_key, value, expires_at)
+                )
+
+        await self._transaction("set_fsm_field", work, (storage_key, value, ttl))
+
+    async def delete_expired_fsm(self) -> int:
+        result = await self._query(
+            "delete_expired_fsm",
+            "DELETE FROM tb_FSMState WHERE expires_at <= ? RETURNING storage_key",
+            (datetime.now(),), fetch=True
+        )
+        return len(result)
+
+    # === СТАТИСТИКА ===
+
+    async def get_statistics(self, start_date: date = None, end_date: date = None) -> List[Dict]:
+        rows = await super().get_statistics(start_date, end_date)
+        for row in rows:
+            # CAST AS DECIMAL(5,2) в SQLite не округляет
+            row['fill_percentage'] = round(row['fill_percentage'], 2)
+        return rows
+
+    # === РАССЫЛКИ ===
+
+    async def create_broadcast_job(self, text: str, admin_chat_id: int) -> Dict:
+        def work(conn):
+            job_id = conn.execute(
+                "INSERT INTO tb_BroadcastJob (text, status, admin_chat_id, created_at) VALUES (?, ?, ?, ?)",
+                (text, BroadcastStatus.RUNNING, admin_chat_id, datetime.now())
+            ).lastrowid
+            total = conn.execute(
+                "INSERT INTO tb_BroadcastDelivery (id_job, tg_id, status) "
+                "SELECT DISTINCT ?, tg_id, ? FROM Users WHERE is_blocked = 0",
+                (job_id, DeliveryStatus.PENDING)
+            ).rowcount
+            conn.execute("UPDATE tb_BroadcastJob SET total = ? WHERE id = ?", (total, job_id))
+            return _select_job(conn, job_id)
+
+        job = await self._transaction("create_broadcast_job", work, (admin_chat_id,))
+        logger.info(f"Создано задание рассылки {job['id']}, получателей: {job['total']}")
+        return job
+
+    async def set_broadcast_status(self, job_id: int, status: str) -> Optional[Dict]:
+        finished = (BroadcastStatus.DONE, BroadcastStatus.CANCELLED)
+        query = f"""
+        UPDATE tb_BroadcastJob
+        SET status = ?, finished_at = COALESCE(?, finished_at)
+        WHERE id = ? AND status NOT IN (?, ?)
+        RETURNING {BROADCAST_JOB_COLUMNS}
+        """
+        params = (status, datetime.now() if status in finished else None, job_id, *finished)
+        result = await self._query("set_broadcast_status", query, params, fetch=True)
+        return result[0] if result else None
+
+    async def claim_broadcast_job(self, job_id: int, owner: str, lease_seconds: float) -> bool:
+        now = datetime.now()
+        query = """
+        UPDATE tb_BroadcastJob SET owner = ?, lease_until = ?
+        WHERE id = ? AND status = ? AND (owner IS NULL OR owner = ? OR lease_until < ?)
+        RETURNING id
+        """
+        params = (owner, now + timedelta(seconds=lease_seconds), job_id, BroadcastStatus.RUNNING, owner, now)
+        return bool(await self._query("claim_broadcast_job", query, params, fetch=True))
+
+    async def release_broadcast_job(self, job_id: int, owner: str, only_stopped: bool = True) -> bool:
+        condition = " AND status <> ?" if only_stopped else ""
+        params = (job_id, owner, BroadcastStatus.RUNNING) if only_stopped else (job_id, owner)
+        query = f"UPDATE tb_BroadcastJob SET owner = NULL, lease_until = NULL WHERE id = ? AND owner = ?{condition} RETURNING id"
+        return bool(await self._query("release_broadcast_job", query, params, fetch=True))
+
+    async def checkpoint_broadcast(self, job_id: int, results: Dict[int, int], owner: str = None,
+                                   lease_seconds: float = 0) -> Dict:
+        rows = list(results.items())
+
+        def work(conn):
+            with _batch(conn, [("tg_id", "INTEGER PRIMARY KEY"), ("status", "INTEGER")], rows):
+                changed = conn.execute(f"""
+                UPDATE tb_BroadcastDelivery
+                SET status = (SELECT b.status FROM {self.BATCH_TABLE} b WHERE b.tg_id = tb_BroadcastDelivery.tg_id)
+                WHERE id_job = ? AND status = ? AND tg_id IN (SELECT tg_id FROM {self.BATCH_TABLE})
+                RETURNING status
+                """, (job_id, DeliveryStatus.PENDING)).fetchall()
+                conn.execute(
+                    f"UPDATE Users SET is_blocked = 1 "
+                    f"WHERE tg_id IN (SELECT tg_id FROM {self.BATCH_TABLE} WHERE status = ?)",
+                    (DeliveryStatus.BLOCKED,)
+                )
+            counts = {status: 0 for status in (DeliveryStatus.DELIVERED, DeliveryStatus.FAILED, DeliveryStatus.BLOCKED)}
+            for (status,) in changed:
+                counts[status] += 1
+            conn.execute("""
+            UPDATE tb_BroadcastJob
+            SET delivered = delivered + ?, failed = failed + ?, blocked = blocked + ?,
+                lease_until = CASE WHEN owner = ? THEN ? ELSE lease_until END
+            WHERE id = ?
+            """, (
+                counts[DeliveryStatus.DELIVERED],
+                counts[DeliveryStatus.FAILED] + counts[DeliveryStatus.BLOCKED],
+                counts[DeliveryStatus.BLOCKED],
+                owner,
+                datetime.now() + timedelta(seconds=lease_seconds),
+                job_id,
+            ))
+            return _select_job(conn, job_id)
+
+        job = await self._transaction("checkpoint_broadcast", work, (job_id, len(results)))
+        self._invalidate_users(tg_id for tg_id, status in rows if status == DeliveryStatus.BLOCKED)
+        return job
+
+    # === СПРАВОЧНИК ===
+
+    async def set_handbook(self, text: str):
+        updated_at = datetime.now()
+
+        def work(conn):
+            row = conn.execute("SELECT id FROM spr_Handbook ORDER BY id LIMIT 1").fetchone()
+            if row:
+                conn.execute("UPDATE spr_Handbook SET text = ?, updated_at = ? WHERE id = ?", (text, updated_at, row[0]))
+            else:
+                conn.execute("INSERT INTO spr_Handbook (text, updated_at) VALUES (?, ?)", (text, updated_at))
+
+        await self._transaction("set_handbook", work)
+        self.handbook_cache.set(text, updated_at)
+        self._publish(CacheSignal.HANDBOOK)
+        logger.info("Справочник обновлен в БД")
@@ -0,0 +1,331 @@
+"""Нагрузочный тест бота без Telegram и рабочей БД
+
+    python loadtest.py --users 200 --rounds 3
+    DB_BACKEND=mssql DB_SERVER=localhost DB_NAME=tgbot_loadtest python loadtest.py --allow-server --bootstrap
+
+Бот работает в этом же процессе с теми же обработчиками и middleware:
+обновления синтетических пользователей подаются в диспетчер напрямую,
+а все вызовы Bot API уходят на встроенную заглушку Telegram. БД по
+умолчанию — встроенная SQLite-база во временном каталоге (воспроизводимые
+замеры, удаляется после теста; DB_SQLITE_PATH задает свой файл). SQL Server
+(DB_BACKEND=mssql, параметры DB_* из окружения) используется только с
+--allow-server, чтобы тест не попал в рабочую базу из окружения бота;
+--bootstrap создает таблицы из schema.sql. Тест заводит свои вакансии и
+смены с префиксом «Нагрузка:» и потребность только по ним, а после прогона
+удаляет их вместе с синтетическими пользователями и их записями.
+
+Пользователи проходят запись user_reserve → user_date_ → user_vacancy_ →
+user_shift_ → user_confirm_ и отменяют ее, администраторы параллельно
+открывают календарь, очередь подтверждения, пользователей и отчеты.
+В конце печатаются p50/p99 по шагам, обновлений в секунду и запросов к БД
+на обновление. Состояния FSM хранятся так же, как в работе (FSM_STORAGE,
+по умолчанию tb_FSMState той же БД), поэтому их запросы входят в замеры.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Dict, List, Optional
+
+from aiohttp import web
+
+# Синтетические пользователи занимают отдельный диапазон tg_id и удаляются после теста
+LOADTEST_USER_BASE = 9_000_000_000
+LOADTEST_PHONE = "+70000000000"
+# Справочники теста; реальные вакансии и смены тест не использует и не меняет
+LOADTEST_PREFIX = "Нагрузка: "
+
+logger = logging.getLogger("loadtest")
+
+
+class FakeTelegram:
+    """Заглушка Bot API: отвечает как Telegram и запоминает последнюю клавиатуру в каждом чате"""
+
+    def __init__(self):
+        self.calls: Dict[str, int] = defaultdict(int)
+        self.keyboards: Dict[int, List[str]] = {}  # chat_id -> callback_data кнопок последнего сообщения
+        self._message_ids = itertools.count(1)
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        return app
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        payload = await request.post()
+        chat_id = int(payload["chat_id"]) if "chat_id" in payload else None
+        if "reply_markup" in payload and chat_id is not None:
+            markup = json.loads(payload["reply_markup"])
+            self.keyboards[chat_id] = [
+                button["callback_data"]
+                for row in markup.get("inline_keyboard", [])
+                for button in row
+                if "callback_data" in button
+            ]
+        elif method in ("sendMessage", "editMessageText") and chat_id is not None:
+            self.keyboards[chat_id] = []  # Сообщение без клавиатуры заменяет предыдущее
+
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Load test", "username": "loadtest_bot"}
+        elif method in ("sendMessage", "sendDocument", "editMessageText", "editMessageReplyMarkup"):
+            message_id = int(payload.get("message_id") or next(self._message_ids))
+            result = {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": payload.get("text", ""),
+            }
+        else:
+            result = True  # answerCallbackQuery, deleteMessage, setWebhook и т. п.
+        return web.json_response({"ok": True, "result": result})
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+class LoadTest:
+    """Синтетические пользователи и сбор замеров"""
+
+    def __init__(self, dp, bot, telegram: FakeTelegram, concurrency: int, think_time: float):
+        from middlewares import callback_prefix
+        self.dp = dp
+        self.bot = bot
+        self.telegram = telegram
+        self.callback_prefix = callback_prefix
+        self.active = asyncio.Semaphore(concurrency)  # Пользователей, одновременно проходящих сценарий
+        self.think_time = think_time
+        self.samples: Dict[str, List[tuple]] = defaultdict(list)  # шаг -> [(длительность, запросов)]
+        self.errors: Dict[str, int] = defaultdict(int)
+        self._update_ids = itertools.count(1)
+
+    async def feed(self, tg_id: int, step: str, update: Dict):
+        from querystats import track_queries
+        started = time.perf_counter()
+        with track_queries(f"loadtest.{step}") as queries:
+            try:
+                await self.dp.feed_raw_update(self.bot, update)
+            except Exception as e:
+                self.errors[step] += 1
+                logger.warning(f"Ошибка на шаге {step} у {tg_id}: {e}")
+        self.samples[step].append((time.perf_counter() - started, queries.count))
+
+    async def click(self, tg_id: int, data: str):
+        """Нажатие inline-кнопки в последнем сообщении бота"""
+        user = {"id": tg_id, "is_bot": False, "first_name": f"Load {tg_id}"}
+        update = {
+            "update_id": next(self._update_ids),
+            "callback_query": {
+                "id": str(next(self._update_ids)),
+                "from": user,
+                "chat_instance": str(tg_id),
+                "data": data,
+                "message": {
+                    "message_id": 1,
+                    "date": int(time.time()),
+                    "chat": {"id": tg_id, "type": "private"},
+                    "from": {"id": 1, "is_bot": True, "first_name": "Load test"},
+                    "text": "",
+                },
+            },
+        }
+        await self.feed(tg_id, self.callback_prefix(data), update)
+        if self.think_time:
+            await asyncio.sleep(random.uniform(0, self.think_time))
+
+    def pick(self, tg_id: int, prefix: str, parts: Optional[int] = None) -> Optional[str]:
+        """Случайная кнопка последней клавиатуры с данным префиксом (и числом полей через _)"""
+        options = [
+            data for data in self.telegram.keyboards.get(tg_id, [])
+            if data.startswith(prefix) and (parts is None or len(data.split("_")) == parts)
+        ]
+        return random.choice(options) if options else None
+
+    async def user_session(self, tg_id: int, rounds: int):
+        """Запись на смену и отмена записи, rounds раз"""
+        async with self.active:
+            for _ in range(rounds):
+                await self.click(tg_id, "user_reserve")
+                steps = (("user_date_", 3), ("user_vacancy_", 4), ("user_shift_", 5), ("user_confirm_", 5))
+                for prefix, parts in steps:
+                    data = self.pick(tg_id, prefix, parts)
+                    if data is None:
+                        self.errors[f"{prefix}нет кнопки"] += 1
+                        break
+                    await self.click(tg_id, data)
+                else:
+                    await self.cancel_reservation(tg_id)
+
+    async def cancel_reservation(self, tg_id: int):
+        await self.click(tg_id, "user_edit")
+        for prefix in ("user_edit_reservation_", "user_cancel_reservation_", "user_confirm_cancel_"):
+            data = self.pick(tg_id, prefix)
+            if data is None:
+                self.errors[f"{prefix}нет кнопки"] += 1
+                return
+            await self.click(tg_id, data)
+
+    async def admin_session(self, tg_id: int, until: asyncio.Event):
+        """Разделы админки по кругу, пока идут пользовательские сценарии"""
+        while not until.is_set():
+            await self.click(tg_id, "admin_calendar")
+            data = self.pick(tg_id, "admin_cal_date_")
+            if data:
+                await self.click(tg_id, data)
+            await self.click(tg_id, "admin_confirmations")
+            data = self.pick(tg_id, "admin_cq_all_")
+            if data:
+                await self.click(tg_id, data)
+            await self.click(tg_id, "admin_users")
+            await self.click(tg_id, "admin_reports")
+            await self.click(tg_id, "admin_report_overall")
+
+    def report(self, elapsed: float) -> str:
+        lines = [f"{'Шаг':<28}{'обн.':>8}{'p50, мс':>10}{'p99, мс':>10}{'запр./обн.':>12}{'ошибок':>8}"]
+        for step in sorted(self.samples):
+            samples = self.samples[step]
+            durations = [duration for duration, _ in samples]
+            queries = sum(count for _, count in samples) / len(samples)
+            lines.append(
+                f"{step:<28}{len(samples):>8}{percentile(durations, 0.5) * 1000:>10.1f}"
+                f"{percentile(durations, 0.99) * 1000:>10.1f}{queries:>12.2f}{self.errors.get(step, 0):>8}"
+            )
+        all_samples = [sample for samples in self.samples.values() for sample in samples]
+        durations = [duration for duration, _ in all_samples]
+        total = len(all_samples)
+        lines.append("")
+        lines.append(
+            f"Итого: {total} обновлений за {elapsed:.1f} с — {total / elapsed if elapsed else 0:.1f} обн./с, "
+            f"p50 {percentile(durations, 0.5) * 1000:.1f} мс, p99 {percentile(durations, 0.99) * 1000:.1f} мс, "
+            f"запросов на обновление {sum(count for _, count in all_samples) / total if total else 0:.2f}, "
+            f"ошибок {sum(self.errors.values())}"
+        )
+        missing = {step: count for step, count in self.errors.items() if step not in self.samples}
+        if missing:
+            lines.append(f"Сценарий прерван (нет нужной кнопки): {missing}")
+        lines.append("Вызовы Bot API: " + ", ".join(
+            f"{method}={count}" for method, count in sorted(self.telegram.calls.items())
+        ))
+        lines.append(f"Очередь обновлений: {self.dp.scheduler.stats()}")
+        return "\n".join(lines)
+
+
+async def seed(db, users: int, admins: int, rounds: int, vacancies: int, shifts: int) -> List[int]:
+    """Свои справочники, потребность с запасом мест и синтетические пользователи"""
+    from config import Config
+
+    tg_ids = [LOADTEST_USER_BASE + i for i in range(users + admins)]
+    # Остатки прошлого прогона (--keep-data) удаляются, чтобы все начинали без записей
+    await cleanup(db, tg_ids)
+
+    vacancy_ids = [await db.add_vacancy(f"{LOADTEST_PREFIX}вакансия {i + 1}") for i in range(vacancies)]
+    shift_ids = [await db.add_shift(f"{LOADTEST_PREFIX}смена {i + 1}") for i in range(shifts)]
+    # Мест хватает всем: сценарий проверяет скорость, а не поведение при заполненных слотах
+    need = users * rounds
+    today = date.today()
+    await db.upsert_need_cells([
+        (today + timedelta(days=day), shift_id, vacancy_id, need)
+        for day in range(Config.CALENDAR_DAYS_AHEAD)
+        for shift_id in shift_ids
+        for vacancy_id in vacancy_ids
+    ])
+
+    await db.import_users([(tg_id, f"Нагрузка {tg_id}", LOADTEST_PHONE, f"loadtest_{tg_id}") for tg_id in tg_ids])
+    await db.set_users_status(tg_ids[users:], is_admin=True)
+    return tg_ids
+
+
+async def cleanup(db, tg_ids: List[int]):
+    """Удаление синтетических пользователей с их записями, справочников теста и потребности по ним"""
+    await db.delete_users(tg_ids)
+    vacancy_ids = [v['id'] for v in await db.get_vacancies() if v['name'].startswith(LOADTEST_PREFIX)]
+    shift_ids = [s['id'] for s in await db.get_shifts() if s['name'].startswith(LOADTEST_PREFIX)]
+    await db.delete_need_cells(shift_ids, vacancy_ids)
+    for vacancy_id in vacancy_ids:
+        await db.delete_vacancy(vacancy_id)
+    for shift_id in shift_ids:
+        await db.delete_shift(shift_id)
+
+
+async def run(args):
+    telegram = FakeTelegram()
+    runner = web.AppRunner(telegram.app())
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.port).start()
+
+    # Модули бота читают конфигурацию при импорте, поэтому импортируются после настройки окружения
+    from main import bot, db, dp
+
+    try:
+        await db.init_db()
+        tg_ids = await seed(db, args.users, args.admins, args.rounds, args.vacancies, args.shifts)
+        test = LoadTest(dp, bot, telegram, args.concurrency, args.think_time)
+        users_done = asyncio.Event()
+        await dp.emit_startup(bot=bot)
+
+        started = time.perf_counter()
+        admin_tasks = [
+            asyncio.create_task(test.admin_session(tg_id, users_done)) for tg_id in tg_ids[args.users:]
+        ]
+        await asyncio.gather(*(test.user_session(tg_id, args.rounds) for tg_id in tg_ids[:args.users]))
+        users_done.set()
+        await asyncio.gather(*admin_tasks)
+        elapsed = time.perf_counter() - started
+
+        await dp.emit_shutdown(bot=bot)
+        print(test.report(elapsed))
+        if not args.keep_data:
+            await cleanup(db, tg_ids)
+    finally:
+        await dp.storage.close()
+        await db.close()
+        await bot.session.close()
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота с заглушкой Telegram и локальной БД")
+    parser.add_argument("--users", type=int, default=100, help="синтетических пользователей")
+    parser.add_argument("--admins", type=int, default=2, help="синтетических администраторов")
+    parser.add_argument("--rounds", type=int, default=3, help="записей и отмен на пользователя")
+    parser.add_argument("--concurrency", type=int, default=50, help="пользователей, одновременно проходящих сценарий")
+    parser.add_argument("--think-time", type=float, default=0, help="случайная пауза между нажатиями до N сек")
+    parser.add_argument("--vacancies", type=int, default=3, help="вакансий в справочнике")
+    parser.add_argument("--shifts", type=int, default=2, help="смен в справочнике")
+    parser.add_argument("--port", type=int, default=8089, help="порт заглушки Bot API")
+    parser.add_argument("--allow-server", action="store_true",
+                        help="разрешить тест на SQL Server из DB_* (по умолчанию только SQLite)")
+    parser.add_argument("--bootstrap", action="store_true", help="создать таблицы из schema.sql")
+    parser.add_argument("--keep-data", action="store_true", help="не удалять данные теста")
+    args = parser.parse_args()
+
+    # Окружение бота по умолчанию указывает на рабочий SQL Server — тест идет на нем только явно
+    backend = os.environ.setdefault("DB_BACKEND", "sqlite")
+    if backend != "sqlite" and not args.allow_server:
+        parser.error(f"DB_BACKEND={backend}: тест на SQL Server запускается только с --allow-server")
+
+    os.environ["TELEGRAM_API_SERVER"] = f"http://127.0.0.1:{args.port}"
+    os.environ.setdefault("BOT_TOKEN", "123456:loadtest")
+    os.environ.setdefault("METRICS_PORT", "0")
+    os.environ.setdefault("SLOW_QUERY_THRESHOLD", "0")
+    if args.bootstrap:
+        os.environ["DB_BOOTSTRAP"] = "1"
+    with tempfile.TemporaryDirectory(prefix="loadtest_") as workdir:
+        os.environ.setdefault("DB_SQLITE_PATH", os.path.join(workdir, "loadtest.sqlite3"))
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
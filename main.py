@@ -3,15 +3,19 @@ import logging
 from datetime import datetime
 from os import getenv
 
-from aiogram import Bot, Dispatcher, types, F
+from aiogram import Bot, types, F
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 
-from database import DatabaseManager
+from database import create_database
 from config import Config
+from middlewares import HandlerMetricsMiddleware, QueryBudgetMiddleware, TelegramMetricsMiddleware, UserAccessMiddleware
+from storage import create_fsm_storage
+from scheduling import OrderedDispatcher
 
 
 
@@ -20,15 +24,41 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Инициализация бота
-bot = Bot(token=Config.BOT_TOKEN)
-dp = Dispatcher(storage=MemoryStorage())
-db = DatabaseManager()
+# Свой Bot API сервер (локальный или тестовая заглушка Telegram) задается в TELEGRAM_API_SERVER
+session = AiohttpSession(api=TelegramAPIServer.from_base(Config.TELEGRAM_API_SERVER)) if Config.TELEGRAM_API_SERVER else None
+bot = Bot(token=Config.BOT_TOKEN, session=session)
+bot.session.middleware(TelegramMetricsMiddleware())
+db = create_database()
+# Состояния сценариев переживают перезапуск и доступны всем экземплярам бота
+# Обновления одного пользователя обрабатываются по порядку, разных — параллельно в пределах лимита
+dp = OrderedDispatcher(storage=create_fsm_storage(db), concurrency=Config.UPDATE_CONCURRENCY)
+
+# Время обработки замеряется первым, чтобы учесть и загрузку пользователя
+handler_metrics = HandlerMetricsMiddleware()
+dp.message.outer_middleware(handler_metrics)
+dp.callback_query.outer_middleware(handler_metrics)
+
+# Пользователь загружается один раз на апдейт, там же проверяются права
+user_access = UserAccessMiddleware(db)
+dp.message.outer_middleware(user_access)
+dp.callback_query.outer_middleware(user_access)
+
+# Лимиты запросов, объявленные обработчиками через max_queries
+query_budget = QueryBudgetMiddleware()
+dp.message.middleware(query_budget)
+dp.callback_query.middleware(query_budget)
 
 from user_handlers import register_user_handlers
 register_user_handlers(dp, db)
 
+from broadcast import BroadcastEngine
+broadcaster = BroadcastEngine(db)
+
+from planning import NeedTemplateScheduler
+need_scheduler = NeedTemplateScheduler(db)
+
 from admin_handlers import register_admin_handlers
-register_admin_handlers(dp, db)
+register_admin_handlers(dp, db, broadcaster)
 
 
 # FSM состояния
@@ -102,13 +132,8 @@ def get_calendar_keyboard(year, month, reserved_dates=None):
 
 # Стартовая команда
 @dp.message(Command("start"))
-async def cmd_start(message: types.Message):
-    user_id = message.from_user.id
-    username = message.from_user.username or ""
-    
-    # Проверяем регистрацию пользователя
-    user = await db.get_user(user_id)
-    
+async def cmd_start(message: types.Message, user: dict = None):
+    # Пользователь уже загружен UserAccessMiddleware
     if not user:
         # Новый пользователь - предлагаем регистрацию
         keyboard = InlineKeyboardMarkup(inline_keyboard=[
@@ -123,11 +148,7 @@ async def cmd_start(message: types.Message):
             reply_markup=keyboard
         )
     else:
-        # Проверяем статус пользователя
-        if user['is_blocked']:
-            await message.answer("❌ Ваш аккаунт заблокирован. Обратитесь к администратору.")
-            return
-        
+        # Заблокированных останавливает UserAccessMiddleware
         if user['is_banned']:
             await message.answer("⚠️ Ваш аккаунт забанен. Некоторые функции недоступны.")
         
@@ -195,12 +216,9 @@ async def process_phone(message: types.Message, state: FSMContext):
 
 # Обработка кнопки "Назад"
 @dp.callback_query(F.data == "back_to_main")
-async def back_to_main(callback: types.CallbackQuery, state: FSMContext):
+async def back_to_main(callback: types.CallbackQuery, state: FSMContext, user: dict = None):
     await state.clear()
     
-    user_id = callback.from_user.id
-    user = await db.get_user(user_id)
-    
     if not user:
         keyboard = InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text="📝 Зарегистрироваться", callback_data="register")],
@@ -245,17 +263,90 @@ async def cmd_handbook(message: types.Message):
     
     await message.answer(f"📖 Справочник вакансий\n\n{handbook_text}")
 
+# Процессы-обработчики (WORKERS > 1)
+def run_worker(index: int, inbox, signals):
+    """Точка входа процесса-обработчика"""
+    asyncio.run(worker_main(index, inbox, signals))
+
+async def worker_main(index: int, inbox, signals):
+    from cluster import serve_worker
+    from webserver import start_metrics_server
+    metrics_runner = None
+    try:
+        await db.init_db()
+        if Config.METRICS_PORT:
+            metrics_runner = await start_metrics_server(dp, db, Config.METRICS_PORT + index)
+        # Фоновые задачи выполняет только первый процесс
+        if index == 0:
+            await broadcaster.resume_unfinished(bot)
+            need_scheduler.start()
+        await serve_worker(index, inbox, signals, dp, bot, db)
+    except Exception as e:
+        logger.error(f"Ошибка процесса-обработчика {index}: {e}")
+    finally:
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await need_scheduler.stop()
+        await dp.storage.close()
+        await db.close()
+        await bot.session.close()
+
+async def run_supervisor():
+    """Прием обновлений и распределение их по процессам-обработчикам"""
+    from cluster import Supervisor
+    supervisor = Supervisor(run_worker, Config.WORKERS)
+    supervisor.start()
+    watch = asyncio.create_task(supervisor.watch())
+    try:
+        if Config.BOT_MODE == "webhook":
+            from webserver import register_webhook, serve
+            await register_webhook(dp, bot)
+            await serve(supervisor.webhook_app())
+        else:
+            await supervisor.run_polling(bot, dp.resolve_used_update_types())
+    finally:
+        watch.cancel()
+        supervisor.stop()
+        await bot.session.close()
+
 # Запуск бота
 async def main():
+    if not Config.validate():
+        return
+    if Config.WORKERS > 1:
+        # Супервизор не работает с БД: подключения открывают процессы-обработчики
+        await run_supervisor()
+        return
+    from webserver import start_metrics_server
+    metrics_runner = None
     try:
         # Инициализация базы данных
         await db.init_db()
         
-        # Запуск поллинга
-        await dp.start_polling(bot)
+        if Config.METRICS_PORT:
+            metrics_runner = await start_metrics_server(dp, db, Config.METRICS_PORT)
+        
+        # Продолжаем рассылки, прерванные перезапуском
+        await broadcaster.resume_unfinished(bot)
+        
+        # Календарь заранее заполняется активным шаблоном недели
+        need_scheduler.start()
+        
+        if Config.BOT_MODE == "webhook":
+            from webserver import run_webhook
+            await run_webhook(dp, bot, db)
+        else:
+            # Оставшийся от режима webhook вебхук не дает получать обновления поллингом
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
     except Exception as e:
         logger.error(f"Ошибка при запуске бота: {e}")
     finally:
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await need_scheduler.stop()
+        await dp.storage.close()
+        await db.close()
         await bot.session.close()
 
 if __name__ == "__main__":
@@ -0,0 +1,177 @@
+import time
+from typing import Callable, Dict, Iterable, Optional, Sequence, Tuple
+
+# Метрики в текстовом формате Prometheus без внешних зависимостей.
+# Все значения изменяются из event loop, поэтому блокировки не нужны.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+ROW_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50)
+
+Sample = Tuple[str, Dict[str, str], float]  # имя, метки, значение
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, int):
+        return str(int(value))
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> Iterable[Sample]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> Iterable[Sample]:
+        for key, value in self._values.items():
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Tuple[str, ...], list] = {}  # метки -> [счетчики по корзинам, сумма, количество]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        entry = self._values.get(key)
+        if entry is None:
+            entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                entry[0][i] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def samples(self) -> Iterable[Sample]:
+        for key, (counts, total, count) in self._values.items():
+            labels = dict(zip(self.labelnames, key))
+            for bound, bucket_count in zip(self.buckets, counts):
+                yield f"{self.name}_bucket", {**labels, "le": _format_value(float(bound))}, bucket_count
+            yield f"{self.name}_bucket", {**labels, "le": "+Inf"}, count
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, count
+
+
+class GaugeCollector(_Metric):
+    """Значения, снимаемые в момент запроса метрик (статистика пула, кэшей, очереди)"""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, collect: Callable[[], Iterable[Tuple[Dict[str, str], float]]]):
+        super().__init__(name, documentation)
+        self.collect = collect
+
+    def samples(self) -> Iterable[Sample]:
+        for labels, value in self.collect():
+            yield self.name, labels, value
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HANDLER_DURATION = REGISTRY.register(Histogram(
+    "tgbot_handler_duration_seconds", "Время обработки обновления", ("event", "handler")
+))
+HANDLER_ERRORS = REGISTRY.register(Counter(
+    "tgbot_handler_errors_total", "Исключения в обработчиках", ("event", "handler")
+))
+UPDATE_QUERIES = REGISTRY.register(Histogram(
+    "tgbot_update_queries", "Запросов к БД на одно обновление", ("event", "handler"), buckets=QUERY_COUNT_BUCKETS
+))
+UPDATE_QUERY_TIME = REGISTRY.register(Histogram(
+    "tgbot_update_query_seconds", "Суммарное время запросов к БД на одно обновление", ("event", "handler")
+))
+DB_QUERY_DURATION = REGISTRY.register(Histogram(
+    "tgbot_db_query_duration_seconds", "Время запроса к БД, включая ожидание подключения", ("query",)
+))
+DB_QUERY_ROWS = REGISTRY.register(Histogram(
+    "tgbot_db_query_rows", "Строк в результате запроса", ("query",), buckets=ROW_BUCKETS
+))
+DB_QUERY_ERRORS = REGISTRY.register(Counter(
+    "tgbot_db_query_errors_total", "Ошибки и таймауты запросов к БД", ("query", "error")
+))
+TELEGRAM_REQUEST_DURATION = REGISTRY.register(Histogram(
+    "tgbot_telegram_request_duration_seconds", "Время вызова Bot API", ("method",)
+))
+TELEGRAM_REQUEST_ERRORS = REGISTRY.register(Counter(
+    "tgbot_telegram_request_errors_total", "Ошибки вызовов Bot API", ("method", "error")
+))
+
+
+def register_stats(name: str, documentation: str, stats: Callable[[], Dict], label: Optional[str] = None):
+    """Gauge из статистики компонента: {поле: число} или, с label, {значение метки: {поле: число}}"""
+
+    def collect():
+        groups = stats() if label else {None: stats()}
+        for label_value, fields in groups.items():
+            labels = {label: label_value} if label else {}
+            for field, value in fields.items():
+                yield {**labels, "field": field}, value
+
+    REGISTRY.register(GaugeCollector(name, documentation, collect))
+
+
+def observe_query(query: str, started: float, rows: Optional[int] = None, error: Optional[BaseException] = None):
+    DB_QUERY_DURATION.observe(time.perf_counter() - started, query=query)
+    if rows is not None:
+        DB_QUERY_ROWS.observe(rows, query=query)
+    if error is not None:
+        DB_QUERY_ERRORS.inc(query=query, error=type(error).__name__)
+
+
+def render() -> str:
+    return REGISTRY.render()
@@ -0,0 +1,181 @@
+import re
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramAPIError
+from aiogram.methods import TelegramMethod
+from aiogram.types import CallbackQuery, Message, TelegramObject
+
+from config import Emoji
+from database import DatabaseManager
+from metrics import (
+    HANDLER_DURATION, HANDLER_ERRORS, TELEGRAM_REQUEST_DURATION, TELEGRAM_REQUEST_ERRORS,
+    UPDATE_QUERIES, UPDATE_QUERY_TIME,
+)
+from querystats import check_budget, track_queries
+
+# Действия, доступные без регистрации
+PUBLIC_CALLBACKS = {"register", "user_handbook", "back_to_main"}
+PUBLIC_COMMANDS = {"/start", "/handbook"}
+PUBLIC_STATE_PREFIXES = ("UserRegistration:",)
+
+# Админская зона: callback'и и FSM-состояния админских сценариев
+ADMIN_CALLBACK_PREFIXES = ("admin_", "back_to_admin")
+ADMIN_STATE_PREFIXES = ("Admin",)
+
+# Шаги записи на работу, закрытые для забаненных
+RESERVE_CALLBACK_PREFIXES = ("user_reserve", "user_date_", "user_vacancy_", "user_shift_", "user_confirm_")
+RESERVE_CALLBACK_EXCEPTIONS = ("user_confirm_cancel_",)
+
+
+class UserAccessMiddleware(BaseMiddleware):
+    """Загрузка пользователя один раз на апдейт и общие проверки доступа
+
+    Запись из Users (или None для незарегистрированных) передается
+    обработчикам как аргумент user.
+    """
+
+    def __init__(self, db: DatabaseManager):
+        self.db = db
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        from_user = data.get("event_from_user")
+        if from_user is None:
+            return await handler(event, data)
+
+        user = await self.db.get_user(from_user.id)
+        data["user"] = user
+
+        denial = self._check_access(event, user, data.get("raw_state"))
+        if denial:
+            await event.answer(denial)
+            return None
+        return await handler(event, data)
+
+    @staticmethod
+    def _check_access(event: TelegramObject, user: Optional[Dict], raw_state: Optional[str]) -> Optional[str]:
+        """Текст отказа или None, если действие разрешено"""
+        callback_data = (event.data or "") if isinstance(event, CallbackQuery) else ""
+        command = ""
+        if isinstance(event, Message) and event.text and event.text.startswith("/"):
+            command = event.text.split()[0].split("@")[0]
+        state = raw_state or ""
+
+        is_admin_zone = callback_data.startswith(ADMIN_CALLBACK_PREFIXES) or state.startswith(ADMIN_STATE_PREFIXES)
+        if is_admin_zone:
+            if not user or not user['is_admin']:
+                return f"{Emoji.ERROR} Доступ запрещен."
+            return None
+
+        is_public = (
+            callback_data in PUBLIC_CALLBACKS
+            or command in PUBLIC_COMMANDS
+            or state.startswith(PUBLIC_STATE_PREFIXES)
+        )
+        if not user:
+            if is_public or not callback_data.startswith("user_"):
+                return None
+            return f"{Emoji.ERROR} Сначала необходимо зарегистрироваться!"
+
+        if user['is_blocked']:
+            return f"{Emoji.ERROR} Ваш аккаунт заблокирован. Обратитесь к администратору."
+
+        if user['is_banned'] and callback_data.startswith(RESERVE_CALLBACK_PREFIXES) \
+                and not callback_data.startswith(RESERVE_CALLBACK_EXCEPTIONS):
+            return f"{Emoji.WARNING} Ваш аккаунт забанен. Функция недоступна."
+
+        return None
+
+
+# Части callback_data после первой части с цифрой — идентификаторы и даты
+_ID_PART = re.compile(r"\d")
+
+
+def callback_prefix(data: Optional[str]) -> str:
+    """Префикс callback_data без идентификаторов: user_date_2025-01-01 -> user_date_"""
+    if not data:
+        return ""
+    parts = data.split("_")
+    for i, part in enumerate(parts):
+        if _ID_PART.search(part):
+            return "_".join(parts[:i]) + "_"
+    return data
+
+
+def handler_label(event: TelegramObject, data: Dict[str, Any]) -> Tuple[str, str]:
+    if isinstance(event, CallbackQuery):
+        return "callback_query", callback_prefix(event.data)
+    if isinstance(event, Message):
+        text = event.text or ""
+        if text.startswith("/"):
+            return "message", text.split()[0].split("@")[0]
+        return "message", data.get("raw_state") or "message"
+    return type(event).__name__, ""
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Время обработки по типу события и префиксу callback (или команде/состоянию FSM)"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        event_type, label = handler_label(event, data)
+        started = time.perf_counter()
+        with track_queries(label or event_type) as queries:
+            try:
+                return await handler(event, data)
+            except Exception:
+                HANDLER_ERRORS.inc(event=event_type, handler=label)
+                raise
+            finally:
+                HANDLER_DURATION.observe(time.perf_counter() - started, event=event_type, handler=label)
+                UPDATE_QUERIES.observe(queries.count, event=event_type, handler=label)
+                UPDATE_QUERY_TIME.observe(queries.time, event=event_type, handler=label)
+
+
+class QueryBudgetMiddleware(BaseMiddleware):
+    """Проверка объявленного через max_queries лимита запросов обработчика
+
+    Регистрируется как внутренний middleware: выбранный обработчик уже
+    известен (data["handler"]), а загрузка пользователя в лимит не входит.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        handler_object = data.get("handler")
+        limit = getattr(getattr(handler_object, "callback", None), "max_queries", None)
+        if limit is None:
+            return await handler(event, data)
+        with track_queries(budget=True) as queries:
+            result = await handler(event, data)
+        check_budget(queries, limit, handler_object.callback.__qualname__)
+        return result
+
+
+class TelegramMetricsMiddleware(BaseRequestMiddleware):
+    """Время и ошибки вызовов Bot API по методам"""
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot, method: TelegramMethod):
+        name = method.__api_method__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except TelegramAPIError as e:
+            TELEGRAM_REQUEST_ERRORS.inc(method=name, error=type(e).__name__)
+            raise
+        finally:
+            TELEGRAM_REQUEST_DURATION.observe(time.perf_counter() - started, method=name)
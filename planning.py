@@ -0,0 +1,214 @@
+import asyncio
+import csv
+import io
+import logging
+import re
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Tuple
+
+from config import Config, Emoji
+from database import DatabaseManager
+
+logger = logging.getLogger(__name__)
+
+MATRIX_HEADER = ("Смена", "Должность")
+
+
+class NeedMatrixError(ValueError):
+    """Матрица потребности не прошла проверку; errors — список ошибок по строкам"""
+
+    def __init__(self, errors: List[str]):
+        super().__init__("\n".join(errors))
+        self.errors = errors
+
+
+def _parse_header_date(value: str, today: date) -> date:
+    """Дата в заголовке: ГГГГ-ММ-ДД, ДД.ММ.ГГГГ или ДД.ММ (ближайшая будущая)"""
+    value = value.strip()
+    for fmt in ("%Y-%m-%d", "%d.%m.%Y"):
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            pass
+    match = re.fullmatch(r"(\d{1,2})\.(\d{1,2})", value)
+    if not match:
+        raise ValueError(value)
+    day, month = int(match.group(1)), int(match.group(2))
+    result = date(today.year, month, day)
+    if result < today:
+        result = date(today.year + 1, month, day)
+    return result
+
+
+def _detect_delimiter(line: str) -> str:
+    for delimiter in (";", "\t", ","):
+        if delimiter in line:
+            return delimiter
+    return ";"
+
+
+def parse_need_matrix(text: str, shifts: List[Dict], vacancies: List[Dict],
+                      today: date = None) -> List[Tuple[date, int, int, int]]:
+    """Разбор матрицы потребности на неделю
+
+    Первая строка — заголовок: «Смена;Должность;дата;дата;...», далее по
+    строке на пару смена × должность с количеством работников по датам.
+    Пустая ячейка или «-» оставляет значение без изменений. Разделитель —
+    «;», табуляция или запятая. Все ошибки собираются сразу и передаются
+    в NeedMatrixError; при ошибках ничего не применяется.
+    Возвращает список (дата, id смены, id вакансии, количество).
+    """
+    today = today or date.today()
+    lines = [line for line in text.strip().splitlines() if line.strip()]
+    if len(lines) < 2:
+        raise NeedMatrixError(["Нужны строка заголовка и хотя бы одна строка с данными."])
+
+    rows = list(csv.reader(lines, delimiter=_detect_delimiter(lines[0])))
+    header = [cell.strip() for cell in rows[0]]
+    errors = []
+
+    dates = []
+    for column, value in enumerate(header[2:], 3):
+        try:
+            work_date = _parse_header_date(value, today)
+        except ValueError:
+            errors.append(f"Заголовок, столбец {column}: «{value}» — не дата")
+            continue
+        if work_date < today:
+            errors.append(f"Заголовок, столбец {column}: дата {work_date.strftime('%d.%m.%Y')} уже прошла")
+        if work_date in dates:
+            errors.append(f"Заголовок, столбец {column}: дата {work_date.strftime('%d.%m.%Y')} повторяется")
+        dates.append(work_date)
+    if not dates and not errors:
+        errors.append("В заголовке нет ни одной даты.")
+    if errors:
+        raise NeedMatrixError(errors)
+
+    shift_ids = {s['name'].strip().lower(): s['id'] for s in shifts}
+    vacancy_ids = {v['name'].strip().lower(): v['id'] for v in vacancies}
+    cells = {}
+    for line_no, row in enumerate(rows[1:], 2):
+        row = [cell.strip() for cell in row]
+        if len(row) < 2:
+            errors.append(f"Строка {line_no}: нужны смена и должность")
+            continue
+        shift_name, vacancy_name, values = row[0], row[1], row[2:]
+        shift_id = shift_ids.get(shift_name.lower())
+        vacancy_id = vacancy_ids.get(vacancy_name.lower())
+        if shift_id is None:
+            errors.append(f"Строка {line_no}: неизвестная смена «{shift_name}»")
+        if vacancy_id is None:
+            errors.append(f"Строка {line_no}: неизвестная должность «{vacancy_name}»")
+        if len(values) > len(dates):
+            errors.append(f"Строка {line_no}: значений больше, чем дат в заголовке")
+        if shift_id is None or vacancy_id is None:
+            continue
+
+        for column, (work_date, value) in enumerate(zip(dates, values), 3):
+            if value in ("", "-"):
+                continue
+            if not value.isdigit():
+                errors.append(f"Строка {line_no}, столбец {column}: «{value}» — не целое неотрицательное число")
+                continue
+            key = (work_date, shift_id, vacancy_id)
+            if key in cells:
+                errors.append(f"Строка {line_no}: пара «{shift_name} — {vacancy_name}» уже указана выше")
+                break
+            cells[key] = int(value)
+
+    if not errors and not cells:
+        errors.append("В матрице нет ни одного значения.")
+    if errors:
+        raise NeedMatrixError(errors)
+    return [(work_date, shift_id, vacancy_id, count) for (work_date, shift_id, vacancy_id), count in cells.items()]
+
+
+def format_need_matrix(start_date: date, days: int, shifts: List[Dict], vacancies: List[Dict],
+                       needs: List[Dict]) -> str:
+    """Текущая потребность в формате матрицы (CSV с разделителем «;»)"""
+    dates = [start_date + timedelta(days=i) for i in range(days)]
+    current = {(n['date'], n['id_shift'], n['id_vacancy']): n['need_count'] for n in needs}
+    output = io.StringIO()
+    writer = csv.writer(output, delimiter=";", lineterminator="\n")
+    writer.writerow([*MATRIX_HEADER, *(d.strftime("%d.%m") for d in dates)])
+    for shift in shifts:
+        for vacancy in vacancies:
+            writer.writerow([
+                shift['name'], vacancy['name'],
+                *(current.get((d, shift['id'], vacancy['id']), "") for d in dates)
+            ])
+    return output.getvalue()
+
+
+def format_need_diff(changes: List[Dict], limit: int = 30) -> str:
+    """Сводка изменений после применения матрицы"""
+    added = [c for c in changes if c['old_count'] is None]
+    updated = [c for c in changes if c['old_count'] is not None]
+    text = (
+        f"{Emoji.SUCCESS} План применен.\n"
+        f"Добавлено ячеек: {len(added)}\n"
+        f"Изменено ячеек: {len(updated)}\n"
+    )
+    if not changes:
+        return text + "\nВсе значения совпадают с текущими."
+    text += "\n"
+    changes = sorted(changes, key=lambda c: (c['date'], c['shift_name'], c['vacancy_name']))
+    for c in changes[:limit]:
+        old = "—" if c['old_count'] is None else c['old_count']
+        line = f"{c['date'].strftime('%d.%m')} {c['shift_name']} — {c['vacancy_name']}: {old} → {c['new_count']}"
+        if c['reserved_count'] > c['new_count']:
+            line += f" {Emoji.WARNING} записано {c['reserved_count']}"
+        text += line + "\n"
+    if len(changes) > limit:
+        text += f"… и еще {len(changes) - limit}"
+    return text.rstrip()
+
+
+def week_start(day: date) -> date:
+    """Понедельник недели, в которую входит day"""
+    return day - timedelta(days=day.weekday())
+
+
+class NeedTemplateScheduler:
+    """Фоновое заполнение календаря активным шаблоном недели
+
+    Раз в NEED_TEMPLATE_CHECK_INTERVAL секунд пустые ячейки потребности на
+    CALENDAR_DAYS_AHEAD + NEED_TEMPLATE_LEAD_DAYS дней вперед заполняются
+    одним MERGE. Значения, заданные вручную, не меняются.
+    """
+
+    def __init__(self, db: DatabaseManager):
+        self.db = db
+        self._task: asyncio.Task = None
+
+    def start(self):
+        if Config.NEED_TEMPLATE_CHECK_INTERVAL <= 0 or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def materialize(self) -> int:
+        start = date.today()
+        end = start + timedelta(days=Config.CALENDAR_DAYS_AHEAD + Config.NEED_TEMPLATE_LEAD_DAYS - 1)
+        return await self.db.materialize_need_templates(start, end)
+
+    async def _run(self):
+        while True:
+            try:
+                added = await self.materialize()
+                if added:
+                    logger.info(f"Календарь заполнен по шаблону: добавлено ячеек {added}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка заполнения календаря по шаблону: {e}")
+            await asyncio.sleep(Config.NEED_TEMPLATE_CHECK_INTERVAL)
@@ -0,0 +1,131 @@
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, List, Optional, Tuple
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+slow_query_logger = logging.getLogger("slow_queries")
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Обработчик выполнил больше запросов к БД, чем объявил"""
+
+
+class UpdateQueryStats:
+    """Запросы к БД, выполненные при обработке одного обновления"""
+
+    def __init__(self, handler: str = "", parent: "UpdateQueryStats" = None, budget: bool = False):
+        self.handler = handler or (parent.handler if parent else "")
+        self.parent = parent
+        self.budget = budget  # Учет для проверки лимита max_queries/assert_max_queries
+        self.count = 0
+        self.time = 0.0
+        self.queries: List[Tuple[str, float]] = []  # (имя, длительность) в порядке выполнения
+
+    def add(self, name: str, duration: float):
+        self.count += 1
+        self.time += duration
+        self.queries.append((name, duration))
+        if self.parent is not None:
+            self.parent.add(name, duration)
+
+    def summary(self) -> str:
+        names = ", ".join(name for name, _ in self.queries)
+        return f"{self.count} запросов за {self.time * 1000:.1f} мс: {names}"
+
+
+_current: ContextVar[Optional[UpdateQueryStats]] = ContextVar("update_query_stats", default=None)
+
+
+def current_stats() -> Optional[UpdateQueryStats]:
+    return _current.get()
+
+
+@contextmanager
+def track_queries(handler: str = "", budget: bool = False):
+    """Учет запросов в пределах блока (обработка обновления, обработчик, тест)
+
+    Вложенный учет передает запросы и во внешний.
+    """
+    stats = UpdateQueryStats(handler, parent=_current.get(), budget=budget)
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def outside_budget():
+    """Запросы блока не входят в лимиты обработчика
+
+    Для служебных запросов инфраструктуры (хранилище FSM): они учитываются
+    в статистике обновления, но не в max_queries и assert_max_queries.
+    """
+    stats = _current.get()
+    while stats is not None and stats.budget:
+        stats = stats.parent
+    token = _current.set(stats)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def detach_tracking():
+    """Отвязка фоновой задачи от учета запросов обновления, в котором она создана"""
+    _current.set(None)
+
+
+def record_query(name: str, started: float, params: tuple = None):
+    """Учет выполненного запроса; вызывается DatabaseManager._query"""
+    duration = time.perf_counter() - started
+    stats = _current.get()
+    if stats is not None:
+        stats.add(name, duration)
+    if Config.SLOW_QUERY_THRESHOLD and duration >= Config.SLOW_QUERY_THRESHOLD:
+        handler = stats.handler if stats is not None else "-"
+        slow_query_logger.warning(
+            f"Медленный запрос {name}: {duration * 1000:.0f} мс "
+            f"(порог {Config.SLOW_QUERY_THRESHOLD * 1000:.0f} мс), обработчик {handler}, параметры {params!r}"
+        )
+
+
+def max_queries(limit: int) -> Callable:
+    """Объявление максимума запросов к БД для обработчика
+
+    Проверяется QueryBudgetMiddleware: при QUERY_BUDGET_STRICT (в тестах)
+    превышение вызывает QueryBudgetExceeded, иначе пишется в лог.
+    """
+
+    def decorator(handler: Callable) -> Callable:
+        handler.max_queries = limit
+        return handler
+
+    return decorator
+
+
+def check_budget(stats: UpdateQueryStats, limit: int, where: str):
+    if stats.count <= limit:
+        return
+    message = f"{where}: выполнено {stats.summary()}, объявлено не больше {limit}"
+    if Config.QUERY_BUDGET_STRICT:
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
+
+
+@contextmanager
+def assert_max_queries(limit: int):
+    """Проверка в тестах: блок выполняет не больше limit запросов
+
+        with assert_max_queries(1):
+            await db.get_calendar_status()
+    """
+    with track_queries("assert_max_queries", budget=True) as stats:
+        yield stats
+    if stats.count > limit:
+        raise QueryBudgetExceeded(f"Выполнено {stats.summary()}, ожидалось не больше {limit}")
+
@@ -0,0 +1,108 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+
+class UpdateScheduler:
+    """Порядок и параллельность обработки обновлений
+
+    Обновления одного пользователя выполняются строго по очереди (FIFO
+    через asyncio.Lock, который будит ожидающих в порядке прихода), разных
+    пользователей — параллельно, но не больше limit одновременно. Слот
+    общего лимита занимается только после очереди пользователя, поэтому
+    пользователь, ждущий свой предыдущий апдейт, не держит слот.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = max(1, limit)
+        self._semaphore = asyncio.Semaphore(self.limit)
+        self._users: Dict[int, list] = {}  # id пользователя -> [lock, обновлений в очереди и в работе]
+        self.in_flight = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.processed = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    async def run(self, user_id: Optional[int], handler: Callable[[], Awaitable[Any]]) -> Any:
+        started = time.monotonic()
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+        entry = None
+        if user_id is not None:
+            entry = self._users.setdefault(user_id, [asyncio.Lock(), 0])
+            entry[1] += 1
+        started_handler = False
+        try:
+            if entry is not None:
+                await entry[0].acquire()
+            try:
+                async with self._semaphore:
+                    waited = time.monotonic() - started
+                    started_handler = True
+                    self.waiting -= 1
+                    self.wait_time_total += waited
+                    self.wait_time_max = max(self.wait_time_max, waited)
+                    self.in_flight += 1
+                    try:
+                        return await handler()
+                    finally:
+                        self.in_flight -= 1
+                        self.processed += 1
+            finally:
+                if entry is not None:
+                    entry[0].release()
+        finally:
+            if not started_handler:
+                self.waiting -= 1  # Отменен в очереди
+            if entry is not None:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._users[user_id]
+
+    def stats(self) -> Dict[str, float]:
+        """Метрики очереди: нагрузка и время ожидания слота"""
+        return {
+            'limit': self.limit,
+            'in_flight': self.in_flight,
+            'waiting': self.waiting,
+            'max_waiting': self.max_waiting,
+            'users_active': len(self._users),
+            'processed': self.processed,
+            'wait_time_avg': self.wait_time_total / self.processed if self.processed else 0.0,
+            'wait_time_max': self.wait_time_max,
+        }
+
+
+def update_user_id(update: Update) -> Optional[int]:
+    """Пользователь (или чат), к которому относится обновление"""
+    try:
+        event = update.event
+    except Exception:
+        return None
+    user = getattr(event, "from_user", None) or getattr(event, "user", None)
+    if user is not None:
+        return user.id
+    chat = getattr(event, "chat", None)
+    return chat.id if chat is not None else None
+
+
+class OrderedDispatcher(Dispatcher):
+    """Dispatcher, пропускающий каждое обновление через UpdateScheduler
+
+    feed_update вызывается и при polling, и в вебхуке, и в процессах
+    супервизора, поэтому порядок и лимит действуют во всех режимах.
+    """
+
+    def __init__(self, *, concurrency: int, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.scheduler = UpdateScheduler(concurrency)
+
+    async def feed_update(self, bot: Bot, update: Update, **kwargs: Any) -> Any:
+        return await self.scheduler.run(
+            update_user_id(update),
+            lambda: super(OrderedDispatcher, self).feed_update(bot, update, **kwargs),
+        )
@@ -0,0 +1,66 @@
+-- Основные таблицы бота для новой (локальной, тестовой) базы.
+-- Рабочая база уже содержит эти таблицы: скрипт выполняется только при
+-- DB_BOOTSTRAP=1 и не изменяет существующие таблицы.
+-- Служебные таблицы (рассылки, FSM, шаблоны) создает DatabaseManager.init_db.
+
+IF OBJECT_ID('Users', 'U') IS NULL
+CREATE TABLE Users (
+    tg_id BIGINT NOT NULL PRIMARY KEY,
+    full_name NVARCHAR(200) NOT NULL,
+    phone NVARCHAR(50) NOT NULL,
+    username NVARCHAR(100) NULL,
+    is_admin BIT NOT NULL DEFAULT 0,
+    is_banned BIT NOT NULL DEFAULT 0,
+    is_blocked BIT NOT NULL DEFAULT 0,
+    date_of_reg DATETIME NOT NULL DEFAULT GETDATE()
+)
+GO
+
+IF OBJECT_ID('spr_Vacancies', 'U') IS NULL
+CREATE TABLE spr_Vacancies (
+    id INT IDENTITY(1,1) PRIMARY KEY,
+    name NVARCHAR(200) NOT NULL
+)
+GO
+
+IF OBJECT_ID('spr_Shifts', 'U') IS NULL
+CREATE TABLE spr_Shifts (
+    id INT IDENTITY(1,1) PRIMARY KEY,
+    name NVARCHAR(200) NOT NULL
+)
+GO
+
+IF OBJECT_ID('spr_Handbook', 'U') IS NULL
+CREATE TABLE spr_Handbook (
+    id INT IDENTITY(1,1) PRIMARY KEY,
+    text NVARCHAR(MAX) NOT NULL,
+    updated_at DATETIME NOT NULL DEFAULT GETDATE()
+)
+GO
+
+IF OBJECT_ID('tb_NeedWorkers', 'U') IS NULL
+CREATE TABLE tb_NeedWorkers (
+    id INT IDENTITY(1,1) PRIMARY KEY,
+    date DATE NOT NULL,
+    id_shift INT NOT NULL,
+    id_vacancy INT NOT NULL,
+    need_count INT NOT NULL,
+    CONSTRAINT UQ_tb_NeedWorkers_slot UNIQUE (date, id_shift, id_vacancy)
+)
+GO
+
+IF OBJECT_ID('tb_Reservation', 'U') IS NULL
+CREATE TABLE tb_Reservation (
+    id INT IDENTITY(1,1) PRIMARY KEY,
+    id_user BIGINT NOT NULL,
+    date_time_event DATETIME NOT NULL DEFAULT GETDATE(),
+    date_reservation DATE NOT NULL,
+    id_vacancy INT NOT NULL,
+    id_shift INT NOT NULL,
+    confirmed BIT NOT NULL DEFAULT 0
+)
+GO
+
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_tb_Reservation_slot' AND object_id = OBJECT_ID('tb_Reservation'))
+CREATE INDEX IX_tb_Reservation_slot ON tb_Reservation (date_reservation, id_shift, id_vacancy)
+GO
@@ -0,0 +1,201 @@
+import json
+import logging
+import sqlite3
+import time
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from cache import TTLCache
+from config import Config
+from database import DatabaseManager
+from querystats import outside_budget
+
+logger = logging.getLogger(__name__)
+
+
+def _storage_key(key: StorageKey) -> str:
+    return ":".join(str(part) if part is not None else "" for part in (
+        key.bot_id, key.chat_id, key.user_id, key.thread_id, key.business_connection_id, key.destiny
+    ))
+
+
+def _state_name(state: StateType) -> Optional[str]:
+    return state.state if isinstance(state, State) else state
+
+
+def _dumps(data: Dict[str, Any]) -> Optional[str]:
+    # Компактный JSON: данные сценариев — строки, числа и списки id
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")) if data else None
+
+
+def _loads(raw: Optional[str]) -> Dict[str, Any]:
+    return json.loads(raw) if raw else {}
+
+
+class _ExpiringStorage(BaseStorage):
+    """Общая часть хранилищ с временем жизни состояний
+
+    Срок жизни записи продлевается при каждой записи; просроченные
+    записи не читаются и периодически удаляются во время записи.
+    """
+
+    def __init__(self, ttl: int, cleanup_interval: float):
+        self.ttl = ttl
+        self.cleanup_interval = cleanup_interval
+        self._next_cleanup = time.monotonic() + cleanup_interval
+
+    async def _set_field(self, key: str, field: str, value: Optional[str]):
+        raise NotImplementedError
+
+    async def _get_record(self, key: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+    async def _delete_expired(self) -> int:
+        raise NotImplementedError
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await self._set_field(_storage_key(key), "state", _state_name(state))
+        await self._maybe_cleanup()
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        record = await self._get_record(_storage_key(key))
+        return record['state'] if record else None
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await self._set_field(_storage_key(key), "data", _dumps(data))
+        await self._maybe_cleanup()
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        record = await self._get_record(_storage_key(key))
+        return _loads(record['data']) if record else {}
+
+    async def _maybe_cleanup(self):
+        if self.ttl <= 0 or time.monotonic() < self._next_cleanup:
+            return
+        self._next_cleanup = time.monotonic() + self.cleanup_interval
+        try:
+            deleted = await self._delete_expired()
+            if deleted:
+                logger.info(f"Удалено просроченных состояний FSM: {deleted}")
+        except Exception as e:
+            logger.warning(f"Не удалось удалить просроченные состояния FSM: {e}")
+
+
+class SqlFSMStorage(_ExpiringStorage):
+    """Состояния FSM в таблице tb_FSMState основной БД (общие для всех экземпляров бота)
+
+    Middleware FSM читает состояние на каждом обновлении. При cache_ttl > 0
+    записи (и их отсутствие) кэшируются на cache_ttl секунд и обновляются
+    при записи. Кэш допустим, только когда таблицей пользуется один
+    экземпляр бота: обновления пользователя тогда обрабатывает один процесс
+    (WORKERS), и его кэш не расходится с БД. Если обновления одного
+    пользователя попадают в разные экземпляры, кэш отдал бы устаревший шаг
+    сценария, поэтому по умолчанию он выключен.
+
+    Запросы хранилища выполняются вне лимитов max_queries: их число зависит
+    от кэша и от того, как обработчик меняет состояние, а не от его логики.
+    """
+
+    def __init__(self, db: DatabaseManager, ttl: int, cleanup_interval: float,
+                 cache_ttl: float = 0, cache_size: int = 10000):
+        super().__init__(ttl, cleanup_interval)
+        self.db = db
+        self.cache = TTLCache(maxsize=cache_size, ttl=cache_ttl) if cache_ttl > 0 else None
+
+    async def _set_field(self, key: str, field: str, value: Optional[str]):
+        with outside_budget():
+            await self.db.set_fsm_field(key, field, value, self.ttl)
+        if self.cache is None:
+            return
+        record = self.cache.get(key)
+        if record is TTLCache.MISSING:
+            self.cache.invalidate(key)  # Второе поле неизвестно — следующее чтение возьмет запись из БД
+            return
+        record = {'state': None, 'data': None, **(record or {}), field: value}
+        self.cache.set(key, record if record['state'] is not None or record['data'] is not None else None)
+
+    async def _get_record(self, key: str) -> Optional[Dict]:
+        if self.cache is not None:
+            record = self.cache.get(key)
+            if record is not TTLCache.MISSING:
+                return record
+        with outside_budget():
+            record = await self.db.get_fsm_record(key)
+        if self.cache is not None:
+            self.cache.set(key, record)
+        return record
+
+    async def _delete_expired(self) -> int:
+        with outside_budget():
+            return await self.db.delete_expired_fsm()
+
+    async def close(self) -> None:
+        pass  # Подключениями владеет DatabaseManager
+
+
+class SQLiteFSMStorage(_ExpiringStorage):
+    """Состояния FSM во встроенной SQLite-базе (один экземпляр бота)
+
+    Запросы по первичному ключу к локальному файлу в режиме WAL занимают
+    доли миллисекунды, поэтому выполняются прямо в event loop.
+    """
+
+    def __init__(self, path: str, ttl: int, cleanup_interval: float):
+        super().__init__(ttl, cleanup_interval)
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS fsm_state (
+                storage_key TEXT PRIMARY KEY,
+                state TEXT,
+                data TEXT,
+                expires_at REAL
+            ) WITHOUT ROWID
+            """)
+
+    async def _set_field(self, key: str, field: str, value: Optional[str]):
+        other = "data" if field == "state" else "state"
+        now = time.time()
+        expires_at = now + self.ttl if self.ttl > 0 else None
+        with self._conn:
+            self._conn.execute(f"""
+            INSERT INTO fsm_state (storage_key, {field}, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT (storage_key) DO UPDATE SET
+                {field} = excluded.{field},
+                {other} = CASE WHEN expires_at IS NULL OR expires_at > ? THEN {other} END,
+                expires_at = excluded.expires_at
+            """, (key, value, expires_at, now))
+            self._conn.execute(
+                "DELETE FROM fsm_state WHERE storage_key = ? AND state IS NULL AND data IS NULL", (key,)
+            )
+
+    async def _get_record(self, key: str) -> Optional[Dict]:
+        row = self._conn.execute(
+            "SELECT state, data FROM fsm_state WHERE storage_key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (key, time.time())
+        ).fetchone()
+        return {'state': row[0], 'data': row[1]} if row else None
+
+    async def _delete_expired(self) -> int:
+        with self._conn:
+            return self._conn.execute("DELETE FROM fsm_state WHERE expires_at <= ?", (time.time(),)).rowcount
+
+    async def close(self) -> None:
+        self._conn.close()
+
+
+def create_fsm_storage(db: DatabaseManager) -> BaseStorage:
+    """Хранилище FSM по Config.FSM_STORAGE"""
+    if Config.FSM_STORAGE == "memory":
+        return MemoryStorage()
+    if Config.FSM_STORAGE == "sqlite":
+        return SQLiteFSMStorage(Config.FSM_SQLITE_PATH, Config.FSM_STATE_TTL, Config.FSM_CLEANUP_INTERVAL)
+    return SqlFSMStorage(
+        db, Config.FSM_STATE_TTL, Config.FSM_CLEANUP_INTERVAL,
+        cache_ttl=Config.FSM_CACHE_TTL, cache_size=Config.FSM_CACHE_MAX_SIZE
+    )
@@ -0,0 +1,68 @@
+import asyncio
+from datetime import date, timedelta
+
+import pytest
+
+from config import Config
+from database_sqlite import SQLiteDatabaseManager
+from querystats import (
+    QueryBudgetExceeded, assert_max_queries, check_budget, outside_budget, track_queries,
+)
+
+
+@pytest.fixture
+def db(tmp_path):
+    manager = SQLiteDatabaseManager(str(tmp_path / "budget.sqlite3"))
+    asyncio.run(manager.init_db())
+    return manager
+
+
+def test_calendar_status_single_query(db):
+    async def scenario():
+        with assert_max_queries(1):
+            await db.get_calendar_status()
+
+    asyncio.run(scenario())
+
+
+def test_cached_slots_range_no_queries(db):
+    async def scenario():
+        start = date.today()
+        end = start + timedelta(days=Config.CALENDAR_DAYS_AHEAD - 1)
+        await db.get_available_slots_range(start, end)
+        with assert_max_queries(0):
+            await db.get_available_slots_range(start, end)
+
+    asyncio.run(scenario())
+
+
+def test_budget_exceeded(db):
+    async def scenario():
+        with assert_max_queries(1):
+            await db.get_calendar_status()
+            await db.get_calendar_status()
+
+    with pytest.raises(QueryBudgetExceeded):
+        asyncio.run(scenario())
+
+
+def test_outside_budget_counted_in_update(db):
+    async def scenario():
+        with track_queries("update") as update:
+            with assert_max_queries(0) as handler:
+                with outside_budget():
+                    await db.set_fsm_field("1:1:1:::default", "state", "Form:step", 60)
+                    await db.get_fsm_record("1:1:1:::default")
+        return update.count, handler.count
+
+    assert asyncio.run(scenario()) == (2, 0)
+
+
+def test_strict_budget(monkeypatch):
+    monkeypatch.setattr(Config, "QUERY_BUDGET_STRICT", True)
+    with track_queries(budget=True) as stats:
+        stats.add("first", 0.0)
+        stats.add("second", 0.0)
+    with pytest.raises(QueryBudgetExceeded):
+        check_budget(stats, 1, "handler")
+    check_budget(stats, 2, "handler")
@@ -3,8 +3,9 @@ from aiogram import types, F
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.fsm.context import FSMContext
 
-from config import ButtonText, Emoji, MessageFormatter
-from database import DatabaseManager
+from config import ButtonText, Emoji, MessageFormatter, Config
+from database import DatabaseManager, ReservationStatus
+from querystats import max_queries
 
 # Функции для создания клавиатур
 def create_date_keyboard(available_dates: dict, prefix: str = "user_date") -> InlineKeyboardMarkup:
@@ -12,7 +13,7 @@ def create_date_keyboard(available_dates: dict, prefix: str = "user_date") -> In
     keyboard = []
     today = date.today()
     
-    for i in range(7):
+    for i in range(Config.CALENDAR_DAYS_AHEAD):
         current_date = today + timedelta(days=i)
         date_str = current_date.strftime("%Y-%m-%d")
         # Проверяем доступность даты
@@ -98,31 +99,19 @@ def create_user_reservations_keyboard(reservations: list) -> InlineKeyboardMarku
 
 async def handle_user_reserve(callback: types.CallbackQuery, db: DatabaseManager):
     """Первый шаг: выбор даты для записи"""
-    user_id = callback.from_user.id
-    user = await db.get_user(user_id)
-    if not user:
-        await callback.answer("❌ Сначала необходимо зарегистрироваться!")
-        return
-    if user['is_blocked']:
-        await callback.answer("❌ Ваш аккаунт заблокирован.")
-        return
-    if user['is_banned']:
-        await callback.answer("⚠️ Ваш аккаунт забанен. Функция недоступна.")
-        return
-
-    # Получаем доступные даты
+    # Регистрация, блокировка и бан проверяются в UserAccessMiddleware
+    # Получаем доступные даты одним запросом на весь горизонт календаря
     available_dates = {}
     today = date.today()
-    for i in range(7):
-        current_date = today + timedelta(days=i)
-        slots = await db.get_available_slots(current_date)
-        if slots:
-            date_str = current_date.strftime("%Y-%m-%d")
-            total_available = sum(slot['available_count'] for slot in slots)
-            available_dates[date_str] = {'available_count': total_available}
+    end_date = today + timedelta(days=Config.CALENDAR_DAYS_AHEAD - 1)
+    slots_by_date = await db.get_available_slots_range(today, end_date)
+    for current_date, slots in slots_by_date.items():
+        date_str = current_date.strftime("%Y-%m-%d")
+        total_available = sum(slot['available_count'] for slot in slots)
+        available_dates[date_str] = {'available_count': total_available}
     if not available_dates:
         await callback.message.edit_text(
-            f"{Emoji.INFO} К сожалению, на ближайшие 7 дней нет доступных вакансий.\n\n"
+            f"{Emoji.INFO} К сожалению, на ближайшие {Config.CALENDAR_DAYS_AHEAD} дней нет доступных вакансий.\n\n"
             "Попробуйте обновить позже или обратитесь к администратору.",
             reply_markup=InlineKeyboardMarkup(inline_keyboard=[
                 [InlineKeyboardButton(text=ButtonText.REFRESH, callback_data="user_reserve")],
@@ -224,18 +213,15 @@ async def handle_user_confirmation(callback: types.CallbackQuery, db: DatabaseMa
     shift_id = int(parts[-1])
     user_id = callback.from_user.id
     selected_date = date.fromisoformat(date_str)
-    # Проверка: нет ли уже записи пользователя на эту дату
-    existing_reservations = await db.get_user_reservations(user_id)
-    if any(res['date_reservation'] == selected_date for res in existing_reservations):
+    # Проверка записи на дату, проверка мест и вставка — одна транзакция в БД
+    outcome = await db.make_reservation(user_id, selected_date, shift_id, vacancy_id)
+    if outcome['status'] == ReservationStatus.ALREADY_BOOKED:
         await callback.answer("❌ У вас уже есть запись на эту дату!")
         return
-    reservation_id = await db.make_reservation(user_id, selected_date, shift_id, vacancy_id)
-    if not reservation_id:
+    if outcome['status'] != ReservationStatus.CREATED:
         await callback.message.edit_text(
             f"{Emoji.ERROR} Не удалось создать запись!\n\n"
-            "Возможные причины:\n"
-            "• Места уже заняты\n"
-            "• У вас уже есть запись на эту дату\n\n"
+            "Все места на выбранную смену уже заняты.\n\n"
             "Попробуйте выбрать другое время или обновите информацию.",
             reply_markup=InlineKeyboardMarkup(inline_keyboard=[
                 [InlineKeyboardButton(text="🔄 Попробовать снова", callback_data="user_reserve")],
@@ -243,18 +229,13 @@ async def handle_user_confirmation(callback: types.CallbackQuery, db: DatabaseMa
             ])
         )
         return
-    slots = await db.get_available_slots(selected_date)
-    selected_slot = next(
-        (slot for slot in slots 
-         if slot['id_vacancy'] == vacancy_id and slot['id_shift'] == shift_id),
-        None
-    )
+    reservation_id = outcome['reservation_id']
     success_text = f"""
 {Emoji.SUCCESS} Запись успешно создана!
 
 📅 Дата: {selected_date.strftime('%d.%m.%Y (%A)')}
-👔 Должность: {selected_slot['vacancy_name']}
-🕐 Смена: {selected_slot['shift_name']}
+👔 Должность: {outcome['vacancy_name']}
+🕐 Смена: {outcome['shift_name']}
 🆔 Номер записи: {reservation_id}
 
 {Emoji.INFO} Администратор свяжется с вами для подтверждения.
@@ -372,13 +353,8 @@ async def handle_confirm_cancel_reservation(callback: types.CallbackQuery, db: D
             ])
         )
 
-async def handle_user_refresh(callback: types.CallbackQuery, db: DatabaseManager):
+async def handle_user_refresh(callback: types.CallbackQuery, user: dict):
     """Обновление информации для пользователя"""
-    user_id = callback.from_user.id
-    user = await db.get_user(user_id)
-    if not user:
-        await callback.answer("❌ Пользователь не найден!")
-        return
     is_admin = user['is_admin']
     welcome_text = "👨‍💼 Панель администратора" if is_admin else "👤 Главное меню"
     await callback.message.edit_text(
@@ -414,22 +390,27 @@ def register_user_handlers(dp, db: DatabaseManager):
     """Регистрация всех обработчиков пользователей"""
 
     @dp.callback_query(F.data == "user_reserve")
+    @max_queries(1)
     async def user_reserve_callback(callback: types.CallbackQuery):
         await handle_user_reserve(callback, db)
 
     @dp.callback_query(F.data.startswith("user_date_"))
+    @max_queries(1)
     async def user_date_callback(callback: types.CallbackQuery):
         await handle_user_date_selection(callback, db)
 
     @dp.callback_query(F.data.startswith("user_vacancy_"))
+    @max_queries(1)
     async def user_vacancy_callback(callback: types.CallbackQuery):
         await handle_user_vacancy_selection(callback, db)
 
     @dp.callback_query(F.data.startswith("user_shift_"))
+    @max_queries(1)
     async def user_shift_callback(callback: types.CallbackQuery):
         await handle_user_shift_selection(callback, db)
 
     @dp.callback_query(F.data.startswith("user_confirm_"))
+    @max_queries(1)
     async def user_confirm_callback(callback: types.CallbackQuery):
         if callback.data.startswith("user_confirm_cancel_"):
             await handle_confirm_cancel_reservation(callback, db)
@@ -438,10 +419,12 @@ def register_user_handlers(dp, db: DatabaseManager):
 
     # Редактирование записей
     @dp.callback_query(F.data == "user_edit")
+    @max_queries(1)
     async def user_edit_callback(callback: types.CallbackQuery):
         await handle_user_edit_reservations(callback, db)
 
     @dp.callback_query(F.data.startswith("user_edit_reservation_"))
+    @max_queries(1)
     async def user_edit_specific_callback(callback: types.CallbackQuery):
         await handle_edit_specific_reservation(callback, db)
 
@@ -451,8 +434,9 @@ def register_user_handlers(dp, db: DatabaseManager):
 
     # Обновить главное меню (для пользователя)
     @dp.callback_query(F.data == "user_refresh")
-    async def user_refresh_callback(callback: types.CallbackQuery):
-        await handle_user_refresh(callback, db)
+    @max_queries(0)
+    async def user_refresh_callback(callback: types.CallbackQuery, user: dict):
+        await handle_user_refresh(callback, user)
 
     # TODO: Добавить обработчики изменения даты, смены, вакансии в записи для пользователя
     # TODO: Добавить админские обработчики, когда реализуешь admin_handlers.py
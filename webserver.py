@@ -0,0 +1,106 @@
+import asyncio
+import logging
+from typing import Optional
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+import metrics
+from config import Config
+from database import DatabaseManager
+
+logger = logging.getLogger(__name__)
+
+
+def build_app(dp: Dispatcher, bot: Bot, db: DatabaseManager) -> web.Application:
+    """aiohttp-приложение: прием обновлений Telegram и health-проверка
+
+    Запросы без верного X-Telegram-Bot-Api-Secret-Token отклоняются
+    SimpleRequestHandler. Startup/shutdown диспетчера привязаны к
+    жизненному циклу приложения.
+    """
+    app = web.Application()
+
+    async def health(request: web.Request) -> web.Response:
+        db_ok = await db.ping()
+        body = {"status": "ok" if db_ok else "degraded", "db": db_ok, "pool": db.get_pool_stats()}
+        scheduler = getattr(dp, "scheduler", None)
+        if scheduler is not None:
+            body["updates"] = scheduler.stats()
+        return web.json_response(body, status=200 if db_ok else 503)
+
+    app.router.add_get(Config.HEALTH_PATH, health)
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=Config.WEBHOOK_SECRET).register(app, path=Config.WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+def build_metrics_app(dp: Dispatcher, db: DatabaseManager) -> web.Application:
+    """aiohttp-приложение с метриками в текстовом формате Prometheus"""
+    metrics.register_stats("tgbot_db_pool", "Состояние пула подключений к БД", db.get_pool_stats)
+    metrics.register_stats("tgbot_cache", "Попадания, промахи и размер кэшей", db.get_cache_stats, label="cache")
+    scheduler = getattr(dp, "scheduler", None)
+    if scheduler is not None:
+        metrics.register_stats("tgbot_updates", "Очередь и параллельность обработки обновлений", scheduler.stats)
+
+    async def handle_metrics(request: web.Request) -> web.Response:
+        return web.Response(
+            body=metrics.render().encode("utf-8"),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        )
+
+    app = web.Application()
+    app.router.add_get(Config.METRICS_PATH, handle_metrics)
+    return app
+
+
+async def start_metrics_server(dp: Dispatcher, db: DatabaseManager, port: int) -> Optional[web.AppRunner]:
+    """Фоновый сервер метрик; остановка — runner.cleanup()
+
+    Если порт занят, бот работает без метрик (возвращается None).
+    """
+    runner = web.AppRunner(build_metrics_app(dp, db))
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, Config.WEBAPP_HOST, port).start()
+    except OSError as e:
+        logger.error(f"Сервер метрик не запущен на {Config.WEBAPP_HOST}:{port}: {e}")
+        await runner.cleanup()
+        return None
+    logger.info(f"Метрики доступны на {Config.WEBAPP_HOST}:{port}{Config.METRICS_PATH}")
+    return runner
+
+
+async def register_webhook(dp: Dispatcher, bot: Bot):
+    """Регистрация вебхука в Telegram, если задан WEBHOOK_BASE_URL"""
+    if not Config.WEBHOOK_BASE_URL:
+        return
+    # Повторная регистрация того же адреса безопасна, поэтому ее может выполнять каждый экземпляр
+    url = Config.WEBHOOK_BASE_URL.rstrip("/") + Config.WEBHOOK_PATH
+    await bot.set_webhook(
+        url,
+        secret_token=Config.WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types(),
+    )
+    logger.info(f"Вебхук зарегистрирован: {url}")
+
+
+async def serve(app: web.Application):
+    """Работа aiohttp-приложения на WEBAPP_HOST:WEBAPP_PORT до отмены задачи"""
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, Config.WEBAPP_HOST, Config.WEBAPP_PORT)
+    await site.start()
+    logger.info(f"Сервер слушает {Config.WEBAPP_HOST}:{Config.WEBAPP_PORT}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        # Вебхук не снимается: остальные экземпляры продолжают принимать обновления
+        await runner.cleanup()
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, db: DatabaseManager):
+    """Запуск встроенного сервера вебхука до отмены задачи"""
+    await register_webhook(dp, bot)
+    await serve(build_app(dp, bot, db))